@@ -0,0 +1,114 @@
+"""
+JSON codec micro-benchmark.
+
+Measures the per-event CPU the webhook path spends on JSON: parsing the request
+body, encoding the stored event (raw and compact storage modes) and rendering
+the response. Each path is timed with the stdlib json module and with the
+server codec (orjson when installed).
+
+    python3 benchmarks/bench_codec.py --events 5000 --repeat 5
+
+"before" is the previous handler: request.json() followed by json.dumps() of
+the payload for storage. Reports microseconds of process CPU per event (best of
+--repeat runs) and the reduction against "before" as JSON.
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+from fastapi.responses import JSONResponse
+
+from benchlib import Fleet, FleetConfig, config_dict, emit, environment, server
+
+
+def best_cpu_us(fn, items, repeat):
+    """Lowest process CPU time per item over `repeat` passes, in microseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        for item in items:
+            fn(item)
+        best = min(best, time.process_time() - started)
+    return round(best / len(items) * 1e6, 2)
+
+
+def storage_encoder(mode):
+    conn = sqlite3.connect(":memory:")
+    server._create_schema(conn)
+    codec = server.RawEventCodec(mode=mode)
+    c = conn.cursor()
+    pending = {}
+
+    def encode(item):
+        body, payload = item
+        return codec.encode(c, payload, pending, body)
+    return encode
+
+
+def measure(bodies, repeat):
+    items = [(body, json.loads(body)) for body in bodies]
+    acks = [{"status": "queued", "event_type": payload.get("event_type", "unknown")} for _, payload in items]
+    compact = storage_encoder("compact")
+    raw = storage_encoder("raw")
+
+    def before(body):
+        return json.dumps(json.loads(body))
+
+    def raw_ingest(body):
+        payload = server.json_loads(body)
+        return payload, raw((body, payload))
+
+    return {
+        "before_parse_and_reencode": best_cpu_us(before, bodies, repeat),
+        "parse": best_cpu_us(server.json_loads, bodies, repeat),
+        "raw_ingest": best_cpu_us(raw_ingest, bodies, repeat),
+        "compact_encode": best_cpu_us(compact, items, repeat),
+        "response_render": best_cpu_us(lambda ack: server.CodecJSONResponse(ack), acks, repeat),
+    }
+
+
+def run(args):
+    config = FleetConfig(devices=args.devices, channels=args.channels)
+    bodies = [json.dumps(p).encode() for p in Fleet(config).events(args.events)]
+
+    codec = measure(bodies, args.repeat)
+    fast_backend = server.orjson is not None
+    if fast_backend:
+        orjson, server.orjson = server.orjson, None  # same paths on the stdlib fallback
+        try:
+            stdlib = measure(bodies, args.repeat)
+        finally:
+            server.orjson = orjson
+    else:
+        stdlib = codec
+    acks = [{"status": "queued", "event_type": "uplink"}] * len(bodies)
+    stdlib["response_render"] = best_cpu_us(JSONResponse, acks, args.repeat)
+
+    before = codec["before_parse_and_reencode"]
+    return {
+        "benchmark": "codec",
+        "backend": "orjson" if fast_backend else "json",
+        "fleet": config_dict(config),
+        "events": args.events,
+        "avg_body_bytes": round(sum(map(len, bodies)) / len(bodies), 1),
+        "cpu_us_per_event": {"codec": codec, "stdlib": stdlib},
+        "raw_ingest_reduction_pct": round(100 * (1 - codec["raw_ingest"] / before), 1),
+        "environment": environment(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    emit(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
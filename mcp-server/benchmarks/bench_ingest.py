@@ -0,0 +1,145 @@
+"""
+Ingest throughput benchmark.
+
+Drives POST /webhook concurrently through an in-process ASGI client (no sockets)
+with a synthetic fleet, then waits for the ingest writer to commit everything.
+
+    python3 benchmarks/bench_ingest.py --events 20000 --concurrency 64 --devices 200
+
+Reports request latency percentiles, end-to-end events/sec (including the final
+flush), accepted events/sec, 503 backpressure responses and database bytes per
+event as JSON.
+
+With --bulk the same events are streamed as one NDJSON upload to /webhook/bulk
+instead, and the endpoint's own counts and throughput are reported.
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchlib import (Fleet, FleetConfig, config_dict, database_bytes, emit, environment,
+                      percentiles, server, use_database)
+
+
+async def drive(bodies, concurrency):
+    latencies, rejected = [], 0
+    pending = iter(bodies)
+    transport = httpx.ASGITransport(app=server.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            nonlocal rejected
+            for body in pending:
+                while True:
+                    started = time.perf_counter()
+                    r = await client.post("/webhook", content=body,
+                                          headers={"content-type": "application/json"})
+                    latencies.append(time.perf_counter() - started)
+                    if r.status_code != 503:
+                        r.raise_for_status()
+                        break
+                    rejected += 1
+                    await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, rejected
+
+
+async def drive_bulk(bodies, chunk_size):
+    """Stream all events as NDJSON in `chunk_size`-byte pieces; returns the endpoint's summary."""
+    data = b"\n".join(bodies) + b"\n"
+    transport = httpx.ASGITransport(app=server.app)
+
+    async def chunks():
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        r = await client.post("/webhook/bulk", content=chunks(), headers={"content-type": "application/x-ndjson"})
+        r.raise_for_status()
+        return r.json()
+
+
+async def run(args):
+    config = FleetConfig(devices=args.devices, channels=args.channels, locations=args.locations,
+                         alert_ratio=args.alert_ratio, ping_ratio=args.ping_ratio,
+                         uplink_interval_s=args.uplink_interval)
+    fleet = Fleet(config)
+    # Encode up front so the client's JSON work is not part of the measurement
+    bodies = [server.json.dumps(p).encode() for p in fleet.events(args.events)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(args.db or Path(tmp) / "bench_ingest.db")
+        use_database(path)
+        await server.startup()
+
+        started = time.perf_counter()
+        if args.bulk:
+            bulk = await drive_bulk(bodies, args.chunk_size)
+        else:
+            latencies, rejected = await drive(bodies, args.concurrency)
+        accepted_s = time.perf_counter() - started
+        await server.shutdown()  # drains the ingest queue
+        elapsed_s = time.perf_counter() - started
+
+        db_bytes = database_bytes(path)
+
+    if args.bulk:
+        return {
+            "benchmark": "ingest_bulk",
+            "fleet": config_dict(config),
+            "events": args.events,
+            "chunk_size": args.chunk_size,
+            "batch_size": server.BULK_BATCH_SIZE,
+            "elapsed_s": round(elapsed_s, 3),
+            "events_per_sec": round(args.events / elapsed_s, 1),
+            "endpoint": bulk,
+            "db_bytes": db_bytes,
+            "db_bytes_per_event": round(db_bytes / args.events, 1),
+            "environment": environment(),
+        }
+
+    return {
+        "benchmark": "ingest",
+        "ingest_mode": server.INGEST_MODE,
+        "fleet": config_dict(config),
+        "events": args.events,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed_s, 3),
+        "events_per_sec": round(args.events / elapsed_s, 1),
+        "accepted_per_sec": round(args.events / accepted_s, 1),
+        "rejected_503": rejected,
+        "latency_ms": percentiles(latencies),
+        "db_bytes": db_bytes,
+        "db_bytes_per_event": round(db_bytes / args.events, 1),
+        "environment": environment(),
+    }
+
+
+def main():
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--uplink-interval", type=float, default=300.0, help="seconds between uplinks per device")
+    parser.add_argument("--alert-ratio", type=float, default=0.01)
+    parser.add_argument("--ping-ratio", type=float, default=0.005)
+    parser.add_argument("--bulk", action="store_true", help="stream one NDJSON upload to /webhook/bulk")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="--bulk: request body chunk size in bytes")
+    parser.add_argument("--db", help="database path (default: a temporary file)")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    emit(asyncio.run(run(args)), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Payload codec throughput benchmark.
+
+Measures how fast the server-side codecs (payload_codecs.py) decode raw uplink
+payloads: the bare decoder per codec (bytes in, readings out) and the batch
+re-decode path replay.py --redecode runs over stored uplinks (base64 raw
+payload, per-device session, merge with the stored network readings).
+
+    python3 benchmarks/bench_payload_codecs.py --payloads 100000 --repeat 3
+
+Reports payloads per second of process CPU (best of --repeat runs) as JSON.
+"""
+
+import argparse
+import base64
+import copy
+import random
+import struct
+import time
+
+from benchlib import Fleet, FleetConfig, emit, environment, server
+
+payload_codecs = server.payload_codecs
+
+# codec id -> (fport, options, frame builder)
+CODECS = {
+    "lorawan.dragino.lht65": (2, {"probe_offset": 0.2}, lambda rng: struct.pack(
+        ">HhHBh", 0xC000 | rng.randint(2500, 3100), rng.randint(-1000, 3500), rng.randint(200, 900), 1,
+        rng.randint(-500, 1500))),
+    "lorawan.dragino.lds03": (2, {"timezone": "America/New_York", "reset": 8}, lambda rng: struct.pack(
+        ">BHBHBI", rng.randint(0, 1), 0, rng.randint(0, 255), 0, rng.randint(0, 255), 1_700_000_000)),
+    "lorawan.dragino.ldds45": (2, {"height": 2}, lambda rng: struct.pack(
+        ">HHBHH", 0xC000 | rng.randint(2500, 3000), rng.randint(150, 1900), 0, 0, 0)),
+}
+
+
+def best_rate(fn, count, repeat):
+    """Highest items per second of process CPU over `repeat` passes of fn()."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        fn()
+        best = min(best, time.process_time() - started)
+    return round(count / best, 1) if best > 0 else None
+
+
+def stored_uplinks(codec, frames, devices, fport):
+    """Uplinks as replay reads them from the events table: raw payload plus the platform's readings."""
+    template = list(Fleet(FleetConfig(devices=devices, alert_ratio=0, ping_ratio=0)).events(devices))
+    uplinks = []
+    for i, frame in enumerate(frames):
+        payload = copy.deepcopy(template[i % len(template)])
+        payload["device_type"]["codec"] = codec
+        payload["event_data"].update(fport=fport, timestamp=1_700_000_000_000 + i * 1000, raw_format="base64",
+                                     raw_payload=base64.b64encode(frame).decode())
+        uplinks.append(payload)
+    return uplinks
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {}
+    for codec, (fport, options, build) in CODECS.items():
+        frames = [build(rng) for _ in range(args.payloads)]
+        entry = payload_codecs.CODECS[codec]
+
+        def decode_only():
+            sessions = {}
+            for i, frame in enumerate(frames):
+                entry.decode(memoryview(frame), fport, 1_700_000_000_000 + i * 1000, options,
+                             sessions.setdefault(i % args.devices, {}))
+
+        uplinks = stored_uplinks(codec, frames, args.devices, fport)
+
+        def redecode():
+            payload_codecs.BatchDecoder(options).redecode(uplinks)
+
+        readings = sum(len(entry.decode(memoryview(frame), fport, 1_700_000_000_000, dict(options), {}))
+                       for frame in frames[:1000]) / min(len(frames), 1000)
+        results[codec] = {
+            "frame_bytes": len(frames[0]),
+            "readings_per_payload": round(readings, 2),
+            "decode_payloads_per_sec": best_rate(decode_only, len(frames), args.repeat),
+            "redecode_payloads_per_sec": best_rate(redecode, len(uplinks), args.repeat),
+        }
+    return {
+        "benchmark": "payload_codecs",
+        "payloads": args.payloads,
+        "devices": args.devices,
+        "codecs": results,
+        "environment": environment(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", type=int, default=100_000, help="payloads per codec")
+    parser.add_argument("--devices", type=int, default=200, help="devices the payloads are spread over")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    emit(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+MCP tool latency benchmark.
+
+Builds (or reuses) databases holding N sensor readings from a synthetic fleet,
+then times every registered @mcp.tool() function against each of them.
+
+    python3 benchmarks/bench_tools.py --readings 1000000 --readings 10000000 --db-dir bench-dbs
+
+Databases are populated through the normal ingest path (store_events), so the
+derived tables (latest values, rollups, device registry) are realistic. They are
+kept in --db-dir and reused on later runs; building 100M readings takes a long
+time and tens of GB of disk. Results are emitted as JSON with per-tool latency
+percentiles and response sizes. Tools without an argument preset below are
+reported under "skipped" so new tools are noticed. --format (markdown, compact
+or json) and --max-chars are passed to every tool, to compare answer sizes:
+
+    python3 benchmarks/bench_tools.py --readings 1000000 --format compact
+"""
+
+import argparse
+import asyncio
+import inspect
+import sys
+import time
+from pathlib import Path
+
+from benchlib import (Fleet, FleetConfig, config_dict, database_bytes, emit, environment,
+                      percentiles, server, use_database)
+
+POPULATE_BATCH = 2000
+
+
+def tool_arguments(fleet, last_ms):
+    """Representative arguments per tool, aimed at the synthetic fleet; `last_ms` is the newest reading."""
+    device = fleet.devices[0]
+    return {
+        "list_devices": {"location_name": "Bench Site 1"},
+        "search_devices": {"query": "walk-in freezer", "limit": 20},
+        "get_device_details": {"device_id": device["device_id"]},
+        "get_latest_readings": {"device_id": device["device_id"]},
+        "get_reading_history": {"device_id": device["device_id"], "sensor_type": "temp", "limit": 100},
+        "get_reading_aggregates": {"location_name": "Bench Site 1", "sensor_type": "temp",
+                                   "start": last_ms - 7 * 86_400_000, "end": last_ms, "resolution": "1h"},
+        "get_alerts": {"triggered_only": True, "limit": 25},
+        "get_facility_summary": {},
+        "query_sensor_data": {"location_name": "Bench Site 1", "sensor_type": "temp", "min_value": 22.0,
+                              "start": last_ms - 86_400_000, "limit": 100},
+        "get_event_log": {"limit": 20},
+        "get_gateway_status": {},
+        "detect_anomalies": {"location_name": "Bench Site 1", "window": "7d", "end": last_ms},
+    }
+
+
+def populate(path, fleet, readings):
+    """Ingest synthetic events until the database holds at least `readings` readings."""
+    use_database(path)
+    with server.db.reader() as conn:
+        have = conn.execute("SELECT COUNT(*) FROM sensor_readings").fetchone()[0]
+    if have >= readings:
+        return have, None
+    events = fleet.events(sys.maxsize)
+    started = time.perf_counter()
+    while have < readings:
+        batch = [next(events) for _ in range(POPULATE_BATCH)]
+        with server.db.writer() as conn:
+            server.store_events(conn, batch)
+        have += sum(len(p["event_data"].get("payload", [])) for p in batch if p["event_type"] == "uplink")
+        rate = have / (time.perf_counter() - started)
+        print(f"\r  {path.name}: {have:,}/{readings:,} readings ({rate:,.0f}/s)", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    return have, round(time.perf_counter() - started, 1)
+
+
+def time_tools(args_by_tool, repeat, output_options):
+    registered = [t.name for t in asyncio.run(server.mcp.list_tools())]
+    results, skipped = {}, []
+    for name in registered:
+        kwargs = args_by_tool.get(name)
+        if kwargs is None:
+            skipped.append(name)
+            continue
+        fn = getattr(server, name)
+        accepted = inspect.signature(fn).parameters
+        kwargs = {**kwargs, **{k: v for k, v in output_options.items() if k in accepted}}
+        output = fn(**kwargs)  # warm-up: opens connections, fills statement and page caches
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn(**kwargs)
+            samples.append(time.perf_counter() - started)
+        results[name] = {"latency_ms": percentiles(samples), "output_chars": len(output)}
+    return results, skipped
+
+
+def run(args):
+    db_dir = Path(args.db_dir)
+    db_dir.mkdir(parents=True, exist_ok=True)
+    config = FleetConfig(devices=args.devices, channels=args.channels, locations=args.locations)
+    output_options = {"format": args.format, "max_chars": args.max_chars}
+    report = {"benchmark": "tools", "fleet": config_dict(config), "repeat": args.repeat, **output_options,
+              "databases": [], "environment": environment()}
+
+    for target in args.readings:
+        fleet = Fleet(config)
+        path = db_dir / f"bench_{target}.db"
+        readings, build_s = populate(path, fleet, target)
+        with server.db.reader() as conn:
+            last_ms = conn.execute("SELECT MAX(ts) FROM sensor_readings").fetchone()[0]
+        tools, skipped = time_tools(tool_arguments(fleet, last_ms), args.repeat, output_options)
+        server.db.close()
+        report["databases"].append({
+            "target_readings": target,
+            "readings": readings,
+            "build_s": build_s,
+            "db_bytes": database_bytes(path),
+            "tools": tools,
+            "skipped": skipped,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, action="append",
+                        help="database size in readings; repeat for several sizes (default: 1000000)")
+    parser.add_argument("--db-dir", default="bench-dbs")
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--format", choices=server.OUTPUT_FORMATS, default="markdown", help="tool output format")
+    parser.add_argument("--max-chars", type=int, help="answer size budget passed to every tool")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    args.readings = args.readings or [1_000_000]
+    emit(run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
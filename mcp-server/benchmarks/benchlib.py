@@ -0,0 +1,183 @@
+"""
+Shared helpers for the Cognituv Connect benchmarks.
+
+Synthetic fleets are built from the sample payloads in docs/webhook/ so the
+benchmarks exercise the same shapes myDevices sends: per-device company,
+location, device_type and device blocks, multi-channel uplinks, alerts and
+gateway pings.
+"""
+
+import copy
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+SAMPLES_DIR = SERVER_DIR.parent / "docs" / "webhook"
+
+if str(SERVER_DIR) not in sys.path:
+    sys.path.insert(0, str(SERVER_DIR))
+
+import server  # noqa: E402
+
+# (type, unit, name) for synthetic channels; the first five match the uplink sample
+CHANNEL_TYPES = [
+    ("temp", "c", "Temperature"),
+    ("rel_hum", "p", "Humidity"),
+    ("batt", "p", "Battery"),
+    ("rssi", "dbm", "RSSI"),
+    ("snr", "db", "SNR"),
+    ("co2", "ppm", "CO2"),
+    ("press", "hpa", "Pressure"),
+    ("lum", "lux", "Light"),
+]
+BASELINES = {"temp": 21.0, "rel_hum": 45.0, "batt": 95.0, "rssi": -80.0, "snr": 8.0,
+             "co2": 600.0, "press": 1013.0, "lum": 300.0}
+
+
+@dataclass
+class FleetConfig:
+    devices: int = 200
+    channels: int = 5
+    locations: int = 10
+    gateways: int = 4
+    uplink_interval_s: float = 300.0  # per device
+    alert_ratio: float = 0.01         # share of events that are alerts
+    ping_ratio: float = 0.005         # share of events that are gateway pings
+    start_ms: int = 1_700_000_000_000
+    seed: int = 42
+
+
+class Fleet:
+    """Deterministic stream of webhook payloads for a synthetic fleet."""
+
+    def __init__(self, config=None):
+        self.config = config or FleetConfig()
+        self.rng = random.Random(self.config.seed)
+        self.samples = {name: json.loads((SAMPLES_DIR / f"{name}-sample.json").read_text())
+                        for name in ("uplink", "alert", "ping")}
+        self.devices = [self._device(i) for i in range(self.config.devices)]
+        self.gateways = [self._gateway(i) for i in range(self.config.gateways)]
+
+    def _device(self, i):
+        cfg = self.config
+        uplink = self.samples["uplink"]
+        loc = i % cfg.locations
+        company = dict(uplink["company"], id=7000 + loc % 3, name=f"Bench Company {loc % 3}")
+        location = dict(uplink["location"], id=9000 + loc, name=f"Bench Site {loc}",
+                        company_id=company["id"])
+        device = dict(uplink["device"], id=80_000_000 + i, thing_name=f"Bench Sensor {i:05d}",
+                      sensor_use=["Walk-in Freezer", "HVAC Supply Air", "Server Room", "Cold Storage"][i % 4])
+        return {
+            "device_id": f"bench-{i:06d}-0000-0000-0000-000000000000",
+            "blocks": {"company": company, "location": location,
+                       "device_type": uplink["device_type"], "device": device},
+            "sensor_ids": [f"bench-{i:06d}-{ch:04d}" for ch in range(cfg.channels)],
+            "fcnt": 0,
+        }
+
+    def _gateway(self, i):
+        ping = self.samples["ping"]
+        return {
+            "device_id": f"bench-gw-{i:04d}",
+            "blocks": {key: ping[key] for key in ("company", "location", "device_type")},
+            "device": dict(ping["device"], id=700_000 + i, thing_name=f"Bench Gateway {i:02d}"),
+        }
+
+    def events(self, count):
+        """Yield `count` payloads in timestamp order, devices reporting round-robin."""
+        cfg = self.config
+        step_ms = max(1, int(cfg.uplink_interval_s * 1000 / max(1, cfg.devices)))
+        ts = cfg.start_ms
+        for n in range(count):
+            ts += step_ms
+            roll = self.rng.random()
+            if roll < cfg.ping_ratio:
+                yield self._ping(self.gateways[n % len(self.gateways)], ts)
+            elif roll < cfg.ping_ratio + cfg.alert_ratio:
+                yield self._alert(self.devices[n % len(self.devices)], ts)
+            else:
+                yield self._uplink(self.devices[n % len(self.devices)], ts)
+
+    def _uplink(self, dev, ts):
+        dev["fcnt"] += 1
+        readings = []
+        for ch, sensor_id in enumerate(dev["sensor_ids"]):
+            type_, unit, name = CHANNEL_TYPES[ch % len(CHANNEL_TYPES)]
+            value = round(BASELINES[type_] + self.rng.gauss(0, 1.5), 2)
+            readings.append({"name": name, "sensor_id": sensor_id, "type": type_, "unit": unit,
+                             "value": value, "channel": ch + 1, "timestamp": ts})
+        event_data = dict(self.samples["uplink"]["event_data"], device_id=dev["device_id"],
+                          payload=readings, fcnt=dev["fcnt"], timestamp=ts)
+        return {"event_type": "uplink", "event_data": event_data, **dev["blocks"]}
+
+    def _alert(self, dev, ts):
+        event_data = copy.deepcopy(self.samples["alert"]["event_data"])
+        event_data.update(thingId=dev["device_id"], sensorId=dev["sensor_ids"][0],
+                          correlation_id=f"bench-alert-{ts}", triggered=self.rng.random() < 0.5,
+                          timestamp=str(ts), title=f"{dev['blocks']['device']['thing_name']} out of range")
+        return {"event_type": "alert", "event_data": event_data, **dev["blocks"]}
+
+    def _ping(self, gw, ts):
+        event_data = dict(self.samples["ping"]["event_data"], device_id=gw["device_id"],
+                          correlation_id=f"bench-ping-{ts}", timestamp=ts)
+        return {"event_type": "ping", "event_data": event_data, **gw["blocks"], "device": gw["device"]}
+
+
+def use_database(path, **pool_kwargs):
+    """Point the server module at `path` with fresh in-process caches, and create the schema."""
+    server.db = server.ConnectionPool(str(path), **pool_kwargs)
+    server.latest_cache = server.LatestValueCache()
+    server.event_codec = server.RawEventCodec()
+    server.device_registry = server.DeviceRegistry()
+    server.dedup = server.DedupFilter()
+    server.result_cache = server.ResultCache()
+    server.columnar = server.ColumnarStore(directory="")
+    server.live_feed = server.LiveFeed()
+    server.raw_decoder = server.payload_codecs.BatchDecoder()
+    server.init_db()
+    return server
+
+
+def database_bytes(path):
+    """Size of the database after checkpointing the WAL into it."""
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return sum(os.path.getsize(str(path) + suffix)
+               for suffix in ("", "-wal") if os.path.exists(str(path) + suffix))
+
+
+def percentiles(samples_s):
+    """p50/p95/p99/max of a list of durations in seconds, reported in milliseconds."""
+    if not samples_s:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples_s)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def environment():
+    return {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def emit(result, output=None):
+    """Write a machine-readable result to `output` (or stdout)."""
+    text = json.dumps(result, indent=2)
+    if output:
+        Path(output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+def config_dict(config):
+    return asdict(config)
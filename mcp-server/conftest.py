@@ -0,0 +1,42 @@
+"""
+Shared pytest fixtures for the Cognituv Connect MCP server.
+
+test_webhook.py is a manual smoke script that posts to a running server, so it
+is excluded from collection; the remaining tests run in-process against a
+temporary database.
+"""
+
+import copy
+
+import pytest
+
+import server
+import test_webhook
+
+collect_ignore = ["test_webhook.py"]
+
+
+@pytest.fixture
+def server_db(tmp_path, monkeypatch):
+    """The server module wired to a fresh database with the sample events ingested."""
+    pool = server.ConnectionPool(str(tmp_path / "test.db"), readers=1)
+    monkeypatch.setattr(server, "db", pool)
+    monkeypatch.setattr(server, "latest_cache", server.LatestValueCache())
+    monkeypatch.setattr(server, "event_codec", server.RawEventCodec())
+    monkeypatch.setattr(server, "device_registry", server.DeviceRegistry())
+    monkeypatch.setattr(server, "dedup", server.DedupFilter())
+    monkeypatch.setattr(server, "result_cache", server.ResultCache())
+    monkeypatch.setattr(server, "metrics", server.Metrics())
+    monkeypatch.setattr(server, "columnar", server.ColumnarStore(directory=""))
+    monkeypatch.setattr(server, "live_feed", server.LiveFeed())
+    monkeypatch.setattr(server, "resource_notifier", server.ResourceNotifier())
+    monkeypatch.setattr(server, "raw_decoder", server.payload_codecs.BatchDecoder())
+    server.init_db()
+    with pool.writer() as conn:
+        server.store_events(conn, [
+            copy.deepcopy(test_webhook.UPLINK_PAYLOAD),
+            copy.deepcopy(test_webhook.ALERT_PAYLOAD),
+            copy.deepcopy(test_webhook.PING_PAYLOAD),
+        ])
+    yield server
+    pool.close()
@@ -0,0 +1,397 @@
+"""
+Server-side decoders for raw LoRaWAN uplink payloads.
+
+Uplinks carry the device's bytes in event_data.raw_payload (raw_format "base64"
+or "hex") next to the readings myDevices decoded from them. This module holds
+Python ports of the JavaScript codecs in examples/codecs/, registered under the
+device_type.codec ids they serve, so the server can decode uplinks that arrive
+without readings and re-decode stored history after a codec fix or a
+calibration offset change (replay.py --rebuild --redecode).
+
+A decoder takes (data, fport, ts, options, session) and returns readings shaped
+like the JavaScript Decoder.send() arguments: {channel, type, unit, value, name}.
+`data` is a memoryview and every field is read with struct.unpack_from, so the
+payload bytes are never copied. `ts` (epoch ms of the uplink) stands in for the
+JavaScript Date.now(), which makes replays deterministic. `session` is the
+per-device state the JavaScript keeps in Decoder.data.session (rolling averages,
+door statistics); decode uplinks of a device oldest first.
+"""
+
+import binascii
+import functools
+import math
+import struct
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+# DataTypes.TYPE / DataTypes.UNIT constants of the JavaScript decoders -> codes stored in sensor_readings.
+# Codes that do not appear in the myDevices sample payloads are the constant names in lower case.
+TYPE = {
+    "TEMPERATURE": "temp",
+    "RELATIVE_HUMIDITY": "rel_hum",
+    "BATTERY": "batt",
+    "VOLTAGE": "voltage",
+    "ALARM": "alarm",
+    "OPENCLOSED": "openclosed",
+    "VALUE_NULL": "null",
+    "TIME": "time",
+    "PROXIMITY": "proximity",
+    "PERCENTAGE": "percentage",
+    "ANALOG_SENSOR": "analog_sensor",
+}
+UNIT = {
+    "CELSIUS": "c",
+    "PERCENT": "p",
+    "MILLIVOLTS": "mv",
+    "CENTIMETER": "cm",
+    "MINUTES": "min",
+    "ANALOG": "null",
+    "NULL": "null",
+}
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_I16 = struct.Struct(">h")
+
+DAY_MS = 86_400_000
+HOUR_MS = 3_600_000
+
+
+class CodecError(ValueError):
+    """A payload the codec cannot decode: too short for its port, or a feature that was not ported."""
+
+
+class Codec:
+    """A registered decoder and the channels it can emit (other channels, e.g. RSSI/SNR, come from the network)."""
+
+    def __init__(self, name, decode, channels):
+        self.name = name
+        self.decode = decode
+        self.channels = frozenset(channels)
+
+
+CODECS = {}
+
+
+def register(*names, channels):
+    """Register a decoder function under one or more device_type.codec ids."""
+    def add(decode):
+        codec = Codec(names[0], decode, channels)
+        for name in names:
+            CODECS[name] = codec
+        return decode
+    return add
+
+
+def raw_bytes(event_data):
+    """The uplink's raw payload as bytes, or None when it has none in a known raw_format."""
+    raw = event_data.get("raw_payload")
+    if not raw:
+        return None
+    fmt = (event_data.get("raw_format") or "base64").lower()
+    try:
+        if fmt == "base64":
+            return binascii.a2b_base64(raw)
+        if fmt == "hex":
+            return bytes.fromhex(raw)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    return None
+
+
+def decode(codec, data, fport=None, ts=None, options=None, session=None):
+    """Decode one payload (any bytes-like object) with the codec registered as `codec`."""
+    try:
+        entry = CODECS[codec]
+    except KeyError:
+        raise CodecError(f"no codec registered as {codec!r}") from None
+    return _run(entry, memoryview(data), fport, ts, options or {}, {} if session is None else session)
+
+
+def _run(entry, view, fport, ts, options, session):
+    try:
+        return entry.decode(view, fport, ts, options, session)
+    except struct.error as e:
+        raise CodecError(f"{entry.name}: payload of {len(view)} bytes is too short ({e})") from None
+
+
+class BatchDecoder:
+    """
+    Decodes uplinks from their raw bytes, one at a time at ingest or thousands at once.
+
+    Sessions are kept per device across calls, so stateful codecs (rolling levels,
+    door statistics) carry on between batches as long as each device's uplinks come
+    oldest first. `options` apply to every device (calibration offsets, tank shape);
+    `device_options` maps a device_id to options that take precedence. `codecs`
+    limits decoding to those codec ids.
+    """
+
+    def __init__(self, options=None, device_options=None, codecs=None):
+        self.options = options or {}
+        self.device_options = device_options or {}
+        self.codecs = set(codecs) if codecs else None
+        self.sessions = {}
+        self.decoded = 0
+        self.failed = 0
+        self.errors = []
+
+    def _codec(self, payload):
+        name = (payload.get("device_type") or {}).get("codec")
+        if self.codecs is not None and name not in self.codecs:
+            return None
+        return CODECS.get(name)
+
+    def readings(self, payload):
+        """
+        Readings decoded from an uplink's raw payload in event_data.payload form, or None
+        when no codec applies or decoding failed.
+        """
+        entry = self._codec(payload)
+        if entry is None:
+            return None
+        event_data = payload.get("event_data") or {}
+        data = raw_bytes(event_data)
+        if data is None:
+            return None
+        device_id = event_data.get("device_id")
+        ts = event_data.get("timestamp")
+        options = {**self.options, **self.device_options.get(device_id, {})}
+        try:
+            decoded = _run(entry, memoryview(data), event_data.get("fport"), ts, options,
+                           self.sessions.setdefault(device_id, {}))
+        except CodecError as e:
+            self.failed += 1
+            if len(self.errors) < 10:
+                self.errors.append(f"{device_id} @ {ts}: {e}")
+            return None
+        self.decoded += 1
+        return [{**reading, "sensor_id": None, "timestamp": ts} for reading in decoded]
+
+    def redecode(self, payloads):
+        """
+        Replace the codec channels of each uplink's stored readings with freshly decoded
+        ones, in place; readings on other channels (RSSI, SNR) are kept. Uplinks without
+        a codec or raw payload are left alone. Returns how many uplinks were re-decoded.
+        """
+        count = 0
+        for payload in payloads:
+            if payload.get("event_type") != "uplink":
+                continue
+            decoded = self.readings(payload)
+            if decoded is None:
+                continue
+            event_data = payload["event_data"]
+            stored = event_data.get("payload") or []
+            channels = self._codec(payload).channels
+            sensor_ids = {r.get("channel"): r.get("sensor_id") for r in stored}
+            # Keep the stored timestamp so re-decoded readings line up with the network readings
+            ts = next((r["timestamp"] for r in stored if r.get("timestamp") is not None), event_data.get("timestamp"))
+            for reading in decoded:
+                reading["sensor_id"] = sensor_ids.get(reading["channel"])
+                reading["timestamp"] = ts
+            event_data["payload"] = decoded + [r for r in stored if r.get("channel") not in channels]
+            count += 1
+        return count
+
+    def stats(self):
+        return {"decoded": self.decoded, "failed": self.failed, "devices": len(self.sessions),
+                "errors": self.errors}
+
+
+def _reading(channel, data_type, unit, value, name):
+    return {"channel": channel, "type": TYPE[data_type], "unit": UNIT.get(unit), "value": value, "name": name}
+
+
+def _to_fixed(value, decimals=2):
+    # Number(x.toFixed(n)) in the JavaScript decoders
+    return round(value, decimals)
+
+
+# ---------------------------------------------------------------------------
+# Dragino LHT65 temperature & humidity sensor (examples/codecs/dragino-lht65.js)
+# ---------------------------------------------------------------------------
+LHT65_DS18B20_PROBE = 0x01
+
+
+def _lht65_offset(offset, options):
+    offset = float(offset)
+    # An offset given in Fahrenheit degrees is the same temperature difference / 1.8 in Celsius
+    return offset / 1.8 if options.get("offset_unit", "c") == "f" else offset
+
+
+@register("lorawan.dragino.lht65", "dragino-lht65", channels=(3, 4, 5, 7, 500))
+def decode_lht65(data, fport, ts, options, session):
+    readings = []
+    temperature = 23.0  # battery curve input when the internal sensor reports no value
+
+    def temperature_at(offset, channel, name, correction):
+        nonlocal temperature
+        value = _to_fixed(_I16.unpack_from(data, offset)[0] / 100)
+        if math.floor(value) == 327:  # 0x7FFF: no sensor reading
+            return
+        readings.append(_reading(channel, "TEMPERATURE", "CELSIUS", value + correction, name))
+        if channel == 3:
+            temperature = value
+
+    temperature_at(2, 3, "Internal Temp", _lht65_offset(options.get("internal_offset", 0), options))
+    humidity = _to_fixed(_U16.unpack_from(data, 4)[0] / 10, 1)
+    readings.append(_reading(4, "RELATIVE_HUMIDITY", "PERCENT",
+                             humidity + float(options.get("humidity_offset", 0)), "Humidity"))
+    if _U8.unpack_from(data, 6)[0] == LHT65_DS18B20_PROBE:
+        temperature_at(7, 7, "Probe Temp", _lht65_offset(options.get("probe_offset", 0), options))
+
+    # Battery percent from a trendline of real-world temperature / full-voltage data
+    if temperature > 39:
+        full = 3040
+    elif temperature < -40:
+        full = 2540
+    else:
+        full = 2914 + 6.25 * temperature - 0.0793 * temperature ** 2
+    empty = 2400
+    millivolts = _U16.unpack_from(data, 0)[0] & 0x3FFF
+    percent = _to_fixed(min(max(millivolts - empty, 0), full - empty) / (full - empty) * 100)
+    readings.append(_reading(5, "BATTERY", "PERCENT", percent, "Battery"))
+    readings.append(_reading(500, "VOLTAGE", "MILLIVOLTS", millivolts, "Battery Voltage"))
+    return readings
+
+
+# ---------------------------------------------------------------------------
+# Dragino LDS03A door sensor (examples/codecs/dragino-lds03.js)
+# ---------------------------------------------------------------------------
+_zone = functools.lru_cache(maxsize=64)(ZoneInfo)
+
+
+def _lds03_last_reset(now, options):
+    """Epoch ms of the latest daily counter reset (options.reset, local hour[.minute]) at or before `now`."""
+    hour = options.get("reset", 0)
+    if hour == 24:
+        hour = 0
+    h, _, m = str(hour).replace(":", ".").partition(".")
+    h, m = float(h), float(m or 0)
+    moment = datetime.fromtimestamp(now / 1000, timezone.utc)
+    offset = moment.astimezone(_zone(options.get("timezone", "UTC"))).utcoffset().total_seconds() * 1000
+    local_day = (now - h * HOUR_MS - m * 60_000 + offset) // DAY_MS
+    return local_day * DAY_MS + h * HOUR_MS + m * 60_000 - offset
+
+
+def _lds03_door_stats(open_status, now, options, session):
+    last_reset = _lds03_last_reset(now, options)
+    last_hour = now - HOUR_MS
+    last_open_at = session.get("last_open_at") or now
+    was_open = (session.get("last_open_at") or 0) > 0
+    open_count = session.get("open_count") or 0
+    last_open_duration = now - last_open_at
+    open_data = session.setdefault("open_data", [])
+
+    if not open_status:
+        if was_open:  # now closed
+            open_count += 1
+            open_data.append({"open_at": last_open_at, "closed_at": now})
+            session["last_open_at"] = None
+            session["open_count"] = open_count
+        elif open_data:  # still closed
+            last_open_duration = open_data[-1]["closed_at"] - open_data[-1]["open_at"]
+        else:
+            last_open_duration = 0
+
+    since_reset = [d for d in open_data if d["closed_at"] > last_reset]
+    since_hour = [d for d in open_data if d["closed_at"] > last_hour]
+    daily_count, hourly_count = len(since_reset), len(since_hour)
+    daily_duration = sum(d["closed_at"] - max(d["open_at"], last_reset) for d in since_reset)
+    hourly_duration = sum(d["closed_at"] - max(d["open_at"], last_hour) for d in since_hour)
+    daily_critical = sum(1 for d in since_reset if d["closed_at"] - d["open_at"] >= 60_000)
+
+    if open_status:
+        daily_duration += now - max(last_open_at, last_reset)
+        hourly_duration += now - max(last_open_at, last_hour)
+        daily_critical += 1 if now - max(last_open_at, last_reset) >= 60_000 else 0
+        daily_count += 1
+        hourly_count += 1
+        open_count += 1  # like the JavaScript, only a closing stores the count in the session
+        if not was_open:  # now open
+            session["last_open_at"] = now
+
+    session["open_data"] = since_reset
+    return [
+        _reading(144, "VALUE_NULL", "NULL", open_count, "Door Open Count"),
+        _reading(150, "VALUE_NULL", "NULL", daily_critical, "Last 24Hrs Door Open Count (+1min)"),
+        _reading(151, "OPENCLOSED", None, 1 if daily_critical > 0 else 0, "Last 24Hrs Door Open for +1min"),
+        _reading(501, "VALUE_NULL", "NULL", hourly_count, "Last Hour Door Open Count"),
+        _reading(503, "VALUE_NULL", "NULL", daily_count, "Last 24Hrs Door Open Count"),
+        _reading(168, "TIME", "MINUTES", _to_fixed(last_open_duration / 60_000), "Last Open Duration"),
+        _reading(502, "TIME", "MINUTES", _to_fixed(hourly_duration / 60_000), "Last Hour Door Open Duration"),
+        _reading(504, "TIME", "MINUTES", _to_fixed(daily_duration / 60_000), "Last 24Hrs Door Open Duration"),
+    ]
+
+
+@register("lorawan.dragino.lds03", "dragino-lds03",
+          channels=(5, 144, 150, 151, 168, 244, 245, 246, 500, 501, 502, 503, 504))
+def decode_lds03(data, fport, ts, options, session):
+    options = {"timezone": "UTC", "reset": 0, **options}
+    session.setdefault("battery", 100)
+    if fport == 2:
+        if len(data) != 11:
+            raise CodecError(f"lds03: port 2 frames are 11 bytes, got {len(data)}")
+        status = _U8.unpack_from(data, 0)[0]
+        door_open = status & 0x01
+        readings = [_reading(500, "ALARM", None, 1 if status & 0x02 else 0, "Alarm")]
+        readings += [_reading(channel, "OPENCLOSED", None, door_open, name) for channel, name in
+                     ((244, "Door Open Status"), (245, "Door Open Status FP"), (246, "Door Open Status AH"))]
+        now = int(ts) if ts is not None else int(time.time() * 1000)
+        readings += _lds03_door_stats(door_open, now, options, session)
+        readings.append(_reading(5, "BATTERY", "PERCENT", session["battery"], "Battery"))
+        return readings
+    if fport == 5:
+        if len(data) < 7:
+            return []
+        volts = _U16.unpack_from(data, 5)[0] / 1000
+        if not volts:
+            return []
+        session["battery"] = _to_fixed(min(max(volts - 3, 0), 0.5) / 0.5 * 100)
+        return [_reading(5, "BATTERY", "PERCENT", session["battery"], "Battery")]
+    return []  # datalog (3) and configuration (4) frames carry no readings
+
+
+# ---------------------------------------------------------------------------
+# Dragino LDDS45/75 distance (tank level) sensor (examples/codecs/dragino-ldds45.js)
+# ---------------------------------------------------------------------------
+LDDS45_READINGS = 30  # levels in the rolling average
+LDDS45_RESET_DISTANCE = 15.24  # cm; two closer readings in a row mean the tank was refilled
+
+
+@register("lorawan.dragino.ldds45", "dragino-ldds45", channels=(5, 23, 24, 25, 500))
+def decode_ldds45(data, fport, ts, options, session):
+    distance = _U16.unpack_from(data, 2)[0] / 10
+    if distance == 2:  # the sensor's marker for an invalid reading
+        return []
+    if options.get("measurement") == "VOLUME":
+        raise CodecError("ldds45: VOLUME measurements evaluate the template's mathjs equation, which is not ported")
+    millivolts = _U16.unpack_from(data, 0)[0] & 0x3FFF
+    readings = [_reading(5, "BATTERY", "PERCENT", _to_fixed(min(max(millivolts - 2500, 0), 300) / 300 * 100),
+                         "Battery")]
+
+    if options.get("dtc"):  # distance from the sensor to the container, in m
+        distance = max(distance - options["dtc"] * 100, 0)
+    height = options["height"] * 100 if options.get("height") else None  # m -> cm
+    percent = (height - distance) * 100 / height if height else None
+    readings.append(_reading(23, "PROXIMITY", "CENTIMETER", _to_fixed(distance), "Distance"))
+    if height:
+        level = height - distance if height >= distance else 0
+        reset = options.get("resetDistance") or LDDS45_RESET_DISTANCE
+        levels = session.setdefault("levels", [])
+        last = session.get("lastDistance")
+        if last is not None and last < reset and distance < reset:
+            level = height
+            levels.clear()
+        session["lastDistance"] = distance
+        levels.append(level)
+        del levels[:-LDDS45_READINGS]
+        level = sum(levels) / len(levels)
+        percent = level * 100 / height
+        readings.append(_reading(24, "PROXIMITY", "CENTIMETER", _to_fixed(level, 3), "Level"))
+
+    percent = math.ceil((percent or 0) / 10) * 10
+    readings.append(_reading(25, "PERCENTAGE", "PERCENT", _to_fixed(max(percent, 0)), "Percentage"))
+    readings.append(_reading(500, "ANALOG_SENSOR", "ANALOG", 0 if percent < 20 else 1, "Refill Status"))
+    return readings
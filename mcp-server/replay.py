@@ -0,0 +1,246 @@
+"""
+Offline replay and backfill for the Cognituv Connect database.
+
+Rebuild every derived table (sensor_readings, alerts, gateway_pings, devices,
+latest-value state, rollups, gateway_state, alert_state) from the stored raw events:
+
+    python3 replay.py --db cognituv_connect.db --rebuild
+
+Import webhook events from files: NDJSON, JSON arrays, or the retention
+archives (.jsonl.gz / .jsonl.zst) written by COGNITUV_ARCHIVE_DIR. "-" reads stdin.
+
+    python3 replay.py --db cognituv_connect.db archive/events/*.jsonl.gz
+
+Events are written through the normal ingest path (store_events) in large
+transactions, with the secondary indexes of the history tables dropped for the
+duration and rebuilt once at the end. Imported events are deduplicated against
+the database like webhook deliveries. Progress goes to stderr; a JSON summary
+with throughput is printed when done.
+
+Stop the server before replaying: a rebuild clears the derived tables, and the
+history tools are slow while their indexes are missing. A rebuild can only
+restore what the retained events contain; readings whose events were pruned
+earlier are not recovered.
+
+Recompute only the current alert state (alert_state) from the alerts table,
+e.g. after importing alert history out of order:
+
+    python3 replay.py --db cognituv_connect.db --alert-state
+
+Add --redecode to a rebuild to decode every uplink again from its raw payload
+with the server-side codecs (payload_codecs.py), e.g. after a codec fix or a
+calibration change. Codec channels are replaced; network readings such as RSSI
+and SNR are kept. The raw events are not modified, so a later rebuild without
+--redecode restores the stored readings.
+
+    python3 replay.py --rebuild --redecode --codec lorawan.dragino.lht65 \
+        --codec-options '{"probe_offset": -0.5}'
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+
+import server
+
+DERIVED_TABLES = ("sensor_readings", "alerts", "gateway_pings", "latest_readings", "device_stats",
+                  "gateway_state", "alert_state", *(table for table, _ in server.ROLLUPS.values()))
+READ_CHUNK = 1024 * 1024
+
+
+class Progress:
+    """Rate-limited progress lines on stderr, plus the final throughput summary."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.read = 0
+        self.stored = 0
+
+    def update(self, read, stored):
+        self.read += read
+        self.stored += stored
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            print(f"{self.read} events read, {self.stored} stored, "
+                  f"{self.read / (now - self.started):,.0f} events/s", file=sys.stderr, flush=True)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {"events_read": self.read, "events_stored": self.stored, "elapsed_s": round(elapsed, 3),
+                "events_per_sec": round(self.read / elapsed, 1) if elapsed > 0 else None}
+
+
+def drop_indexes(conn):
+    for name in server.HISTORY_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def create_indexes(conn):
+    for ddl in server.HISTORY_INDEXES.values():
+        conn.execute(ddl)
+
+
+def rebuild(batch_size, progress, redecoder=None):
+    """Replay the events table into freshly emptied derived tables, re-decoding uplinks with `redecoder`."""
+    with server.db.writer() as conn:
+        with conn:
+            for table in DERIVED_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+        server.latest_cache.load(conn)
+
+    last_id = 0
+    while True:
+        with server.db.reader() as conn:
+            rows = conn.execute("SELECT * FROM events WHERE id > ? ORDER BY id LIMIT ?",
+                                (last_id, batch_size)).fetchall()
+            payloads = [server.event_codec.decode(conn, row) for row in rows]
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        if redecoder is not None:
+            redecoder.redecode(payloads)
+        with server.db.writer() as conn:
+            stored = server.store_events(conn, payloads, store_raw=False)
+        progress.update(len(rows), stored)
+    with server.db.writer() as conn:
+        with conn:
+            server.columnar.mark_rebuilt(conn)
+
+
+def rebuild_alert_state():
+    """Recompute alert_state from the alert history and return the number of triggered rules."""
+    with server.db.writer() as conn:
+        with conn:
+            server.rebuild_alert_state(conn)
+        return conn.execute("SELECT COUNT(*) FROM alert_state WHERE triggered = 1").fetchone()[0]
+
+
+def open_source(path):
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        import zstandard  # optional dependency, only needed for zstd archives
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    return open(path, "rb")
+
+
+def unwrap(payload, raw):
+    """Retention archive lines wrap the original webhook event in {"id", ..., "event"}."""
+    if "event_data" not in payload and isinstance(payload.get("event"), dict):
+        return payload["event"], None
+    return payload, raw
+
+
+def import_files(paths, batch_size, progress):
+    """Store the events from each file (or stdin) through the ingest path."""
+    invalid, errors = 0, []
+    for path in paths:
+        stream = server.EventStream()
+        batch, bodies = [], []
+
+        def flush():
+            with server.db.writer() as conn:
+                stored = server.store_events(conn, batch, bodies)
+            progress.update(len(batch), stored)
+            batch.clear()
+            bodies.clear()
+
+        source = open_source(path)
+        try:
+            while True:
+                chunk = source.read(READ_CHUNK)
+                items = stream.feed(chunk) if chunk else stream.close()
+                for payload, raw in items:
+                    payload, raw = unwrap(payload, raw)
+                    batch.append(payload)
+                    bodies.append(raw)
+                    if len(batch) >= batch_size:
+                        flush()
+                if not chunk:
+                    break
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        if batch:
+            flush()
+        invalid += stream.invalid
+        errors += [f"{path}: {e}" for e in stream.errors]
+    return invalid, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="NDJSON / JSON array / archive files to import ('-' for stdin)")
+    parser.add_argument("--db", default=server.DB_FILE, help="database file (default: COGNITUV_DB_FILE)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild derived tables from the events table")
+    parser.add_argument("--alert-state", action="store_true",
+                        help="only recompute the current alert state from the alerts table")
+    parser.add_argument("--redecode", action="store_true",
+                        help="with --rebuild, decode uplinks again from their raw payloads")
+    parser.add_argument("--codec", action="append", help="only re-decode devices using this codec id (repeatable)")
+    parser.add_argument("--codec-options", type=json.loads, default={},
+                        help="JSON options for every re-decoded device, e.g. calibration offsets")
+    parser.add_argument("--device-codec-options", type=json.loads, default={},
+                        help="JSON object of device_id -> options, taking precedence over --codec-options")
+    parser.add_argument("--batch-size", type=int, default=20000, help="events per write transaction")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="maintain history indexes while writing instead of rebuilding them at the end")
+    parser.add_argument("--progress-interval", type=float, default=2.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+    if args.rebuild + args.alert_state + bool(args.files) != 1:
+        parser.error("give one of --rebuild, --alert-state or one or more files")
+    if args.redecode and not args.rebuild:
+        parser.error("--redecode needs --rebuild")
+    redecoder = None
+    if args.redecode:
+        unknown = [codec for codec in args.codec or () if codec not in server.payload_codecs.CODECS]
+        if unknown:
+            parser.error(f"unknown codec(s): {', '.join(unknown)}")
+        redecoder = server.payload_codecs.BatchDecoder(args.codec_options, args.device_codec_options, args.codec)
+
+    server.db = server.ConnectionPool(args.db, readers=1)
+    server.init_db()
+    if args.alert_state:
+        started = time.perf_counter()
+        try:
+            result = {"mode": "alert-state", "db": args.db, "active_alerts": rebuild_alert_state(),
+                      "elapsed_s": round(time.perf_counter() - started, 3)}
+        finally:
+            server.db.close()
+        print(json.dumps(result, indent=2))
+        return result
+    progress = Progress(args.progress_interval)
+    result = {"mode": "rebuild" if args.rebuild else "import", "db": args.db}
+    try:
+        with server.db.writer() as conn:
+            conn.execute("PRAGMA synchronous=OFF")  # a crashed replay is simply run again
+            if not args.keep_indexes:
+                drop_indexes(conn)
+        if args.rebuild:
+            rebuild(args.batch_size, progress, redecoder)
+        else:
+            result["invalid"], result["errors"] = import_files(args.files, args.batch_size, progress)
+    finally:
+        index_started = time.perf_counter()
+        with server.db.writer() as conn:
+            create_indexes(conn)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        result["index_build_s"] = round(time.perf_counter() - index_started, 3)
+        server.db.close()
+    result.update(progress.summary())
+    if redecoder is not None:
+        result["redecode"] = redecoder.stats()
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Multi-worker deployment: one writer process owns every SQLite write, and
+# COGNITUV_WORKERS uvicorn workers serve HTTP/MCP from read-only connections.
+set -e
+
+export COGNITUV_WRITER_SOCKET="${COGNITUV_WRITER_SOCKET:-/tmp/cognituv-writer.sock}"
+
+python3 writer.py &
+WRITER_PID=$!
+trap 'kill -TERM $WRITER_PID 2>/dev/null; wait $WRITER_PID' EXIT INT TERM
+
+# Workers wait for the socket (COGNITUV_WRITER_CONNECT_TIMEOUT) before serving
+uvicorn server:app --host "${HOST:-0.0.0.0}" --port "${PORT:-8000}" --workers "${COGNITUV_WORKERS:-4}"
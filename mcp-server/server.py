@@ -16,15 +16,45 @@ MCP endpoint (Streamable HTTP):
   https://<your-domain>/mcp/
 """
 
+import asyncio
+import bisect
+import codecs
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import inspect
 import json
+import logging
 import os
+import queue
+import re
 import sqlite3
-from datetime import datetime, timezone
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from typing import Optional
 
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from mcp.server.fastmcp import FastMCP
+import numpy as np
+
+import payload_codecs
+
+try:
+    import orjson  # optional: faster webhook parsing, event encoding and JSON responses
+except ImportError:
+    orjson = None
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -32,27 +62,634 @@ from mcp.server.fastmcp import FastMCP
 DB_FILE = os.environ.get("COGNITUV_DB_FILE", "cognituv_connect.db")
 WEBHOOK_SECRET = os.environ.get("COGNITUV_WEBHOOK_SECRET", "")  # optional shared secret
 
+# Connection pool: one writer plus up to N read-only connections, tuned once at open time
+DB_READ_CONNECTIONS = int(os.environ.get("COGNITUV_DB_READ_CONNECTIONS", "4"))
+DB_CACHE_SIZE_KB = int(os.environ.get("COGNITUV_DB_CACHE_SIZE_KB", "65536"))  # per connection
+DB_MMAP_SIZE = int(os.environ.get("COGNITUV_DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+DB_STATEMENT_CACHE = int(os.environ.get("COGNITUV_DB_STATEMENT_CACHE", "256"))
+
+# Ingest pipeline: "batched" queues events for a background writer, "direct" writes inline
+INGEST_MODE = os.environ.get("COGNITUV_INGEST_MODE", "batched")
+INGEST_BATCH_SIZE = int(os.environ.get("COGNITUV_INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("COGNITUV_INGEST_FLUSH_INTERVAL", "0.05"))  # seconds
+INGEST_QUEUE_SIZE = int(os.environ.get("COGNITUV_INGEST_QUEUE_SIZE", "10000"))
+
+# Raw event storage: "compact" interns metadata blocks and compresses the rest, "raw" stores JSON text
+EVENT_STORAGE = os.environ.get("COGNITUV_EVENT_STORAGE", "compact")
+EVENT_COMPRESSION_LEVEL = int(os.environ.get("COGNITUV_EVENT_COMPRESSION_LEVEL", "6"))
+
+# Multi-process mode: when set, HTTP/MCP workers forward writes to writer.py over this Unix socket
+WRITER_SOCKET = os.environ.get("COGNITUV_WRITER_SOCKET", "")
+WRITER_CONNECTIONS = int(os.environ.get("COGNITUV_WRITER_CONNECTIONS", "8"))  # per worker
+WRITER_CONNECT_TIMEOUT = float(os.environ.get("COGNITUV_WRITER_CONNECT_TIMEOUT", "30"))  # seconds
+WRITER_REQUEST_TIMEOUT = float(os.environ.get("COGNITUV_WRITER_REQUEST_TIMEOUT", "60"))  # seconds, per reply
+
+# Live feed of newly stored data (/stream SSE and MCP resource subscriptions)
+LIVE_QUEUE_SIZE = int(os.environ.get("COGNITUV_LIVE_QUEUE_SIZE", "1000"))  # messages buffered per subscriber
+LIVE_MAX_SUBSCRIBERS = int(os.environ.get("COGNITUV_LIVE_MAX_SUBSCRIBERS", "100"))
+LIVE_HEARTBEAT = float(os.environ.get("COGNITUV_LIVE_HEARTBEAT", "15"))  # seconds between SSE keep-alives
+
+# POST /webhook/bulk: events per write transaction, largest single event accepted, progress log cadence
+BULK_BATCH_SIZE = int(os.environ.get("COGNITUV_BULK_BATCH_SIZE", "5000"))
+BULK_MAX_EVENT_BYTES = int(os.environ.get("COGNITUV_BULK_MAX_EVENT_BYTES", str(1024 * 1024)))
+BULK_PROGRESS_EVERY = int(os.environ.get("COGNITUV_BULK_PROGRESS_EVERY", "50000"))  # events
+
+# Optional MQTT subscriber feeding the same ingest path (disabled while COGNITUV_MQTT_HOST is empty)
+MQTT_HOST = os.environ.get("COGNITUV_MQTT_HOST", "")
+MQTT_PORT = int(os.environ.get("COGNITUV_MQTT_PORT", "1883"))
+MQTT_TOPICS = [t.strip() for t in os.environ.get("COGNITUV_MQTT_TOPICS", "cognituv/#").split(",") if t.strip()]
+MQTT_QOS = int(os.environ.get("COGNITUV_MQTT_QOS", "1"))
+MQTT_USERNAME = os.environ.get("COGNITUV_MQTT_USERNAME") or None
+MQTT_PASSWORD = os.environ.get("COGNITUV_MQTT_PASSWORD") or None
+MQTT_CLIENT_ID = os.environ.get("COGNITUV_MQTT_CLIENT_ID", "cognituv-connect-mcp")
+MQTT_MAX_INFLIGHT = int(os.environ.get("COGNITUV_MQTT_MAX_INFLIGHT", "1000"))  # received, not yet handed to the writer
+MQTT_RECONNECT_INTERVAL = float(os.environ.get("COGNITUV_MQTT_RECONNECT_INTERVAL", "5"))  # seconds
+
+# Duplicate delivery suppression: keys remembered in memory (count, seconds) ahead of the unique index
+DEDUP_CACHE_SIZE = int(os.environ.get("COGNITUV_DEDUP_CACHE_SIZE", "100000"))
+DEDUP_TTL = float(os.environ.get("COGNITUV_DEDUP_TTL", "86400"))
+
+# Decode event_data.raw_payload with the registered codec (payload_codecs.py) when an uplink arrives
+# without decoded readings: "missing" or "off"
+DECODE_RAW_PAYLOADS = os.environ.get("COGNITUV_DECODE_RAW_PAYLOADS", "missing")
+
+# Results of list_devices / get_facility_summary kept until the devices table changes (0 disables)
+RESULT_CACHE_SIZE = int(os.environ.get("COGNITUV_RESULT_CACHE_SIZE", "256"))  # entries
+
+# query_sensor_data guard rails
+QUERY_TIME_BUDGET = float(os.environ.get("COGNITUV_QUERY_TIME_BUDGET", "2.0"))  # seconds per query
+QUERY_ROW_CAP = int(os.environ.get("COGNITUV_QUERY_ROW_CAP", "1000"))
+QUERY_DEFAULT_WINDOW_HOURS = 24  # fleet-wide queries without start/end look back this far
+
+# detect_anomalies: every finding scores its measure divided by the threshold below, so kinds
+# rank on one scale and only scores >= 1 are reported
+ANOMALY_TIME_BUDGET = float(os.environ.get("COGNITUV_ANOMALY_TIME_BUDGET", "30"))  # seconds
+ANOMALY_MIN_POINTS = 8  # readings a series needs in the window to be judged
+ANOMALY_SPIKE_Z = 4.0  # farthest reading from the series mean, in standard deviations of the rest (at least)
+ANOMALY_JUMP_RATIO = 8.0  # largest step between consecutive readings vs. the series' other steps
+ANOMALY_STUCK_HOURS = 6.0  # latest value repeated unchanged for this long
+ANOMALY_BATTERY_DROP_PER_DAY = 1.0  # battery percentage points per day
+ANOMALY_BATTERY_LOW = 20.0  # percent
+ANOMALY_SIGNAL_DROP = {"rssi": 10.0, "snr": 5.0}  # dB lost between the first and second half
+ANOMALY_STEADY_TYPES = {"batt", "digital", "rssi", "snr"}  # no spike/jump/stuck checks
+ANOMALY_SEEK_SHARE = 0.25  # up to this share of the fleet's series, read each series by index instead of one scan
+
+# Tool calls slower than this are logged with every SQL statement they ran and its query plan (0 disables)
+SLOW_QUERY_MS = float(os.environ.get("COGNITUV_SLOW_QUERY_MS", "0"))
+
+# Minimum seconds between devices.last_seen writes for the same device
+LAST_SEEN_INTERVAL = float(os.environ.get("COGNITUV_LAST_SEEN_INTERVAL", "60"))
+
+# Retention: days to keep each history table (0 keeps everything)
+RETENTION_EVENTS_DAYS = float(os.environ.get("COGNITUV_RETENTION_EVENTS_DAYS", "0"))
+RETENTION_READINGS_DAYS = float(os.environ.get("COGNITUV_RETENTION_READINGS_DAYS", "0"))
+RETENTION_PINGS_DAYS = float(os.environ.get("COGNITUV_RETENTION_PINGS_DAYS", "0"))
+PRUNE_INTERVAL = float(os.environ.get("COGNITUV_PRUNE_INTERVAL", "3600"))  # seconds between pruner runs
+PRUNE_CHUNK_SIZE = int(os.environ.get("COGNITUV_PRUNE_CHUNK_SIZE", "5000"))  # rows per delete transaction
+ARCHIVE_DIR = os.environ.get("COGNITUV_ARCHIVE_DIR", "")  # archive expired raw events here before deleting
+ARCHIVE_COMPRESSION = os.environ.get("COGNITUV_ARCHIVE_COMPRESSION", "gzip")  # "gzip" or "zstd"
+
+# Columnar tier: export closed days of sensor_readings to Parquet here and query them with DuckDB
+PARQUET_DIR = os.environ.get("COGNITUV_PARQUET_DIR", "")
+PARQUET_EXPORT_INTERVAL = float(os.environ.get("COGNITUV_PARQUET_EXPORT_INTERVAL", "3600"))  # seconds
+PARQUET_GRACE_HOURS = float(os.environ.get("COGNITUV_PARQUET_GRACE_HOURS", "2"))  # wait for late uplinks
+
+# Gateway health: silence thresholds, sweeper cadence and raw ping history
+GATEWAY_STALE_SECONDS = float(os.environ.get("COGNITUV_GATEWAY_STALE_SECONDS", "600"))
+GATEWAY_OFFLINE_SECONDS = float(os.environ.get("COGNITUV_GATEWAY_OFFLINE_SECONDS", "1800"))
+GATEWAY_SWEEP_INTERVAL = float(os.environ.get("COGNITUV_GATEWAY_SWEEP_INTERVAL", "60"))
+PING_HISTORY = os.environ.get("COGNITUV_PING_HISTORY", "all")  # "all", "sampled" or "off"
+PING_SAMPLE_SECONDS = float(os.environ.get("COGNITUV_PING_SAMPLE_SECONDS", "300"))  # "sampled": one raw ping per gateway per window
+PING_INTERVAL_SMOOTHING = 0.2  # weight of the newest inter-arrival gap in the rolling average
+
+logger = logging.getLogger("cognituv")
+
+
+def json_loads(data):
+    """Parse JSON from bytes or str with orjson when installed, else the stdlib."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib raises if the input is really invalid
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """Compact UTF-8 JSON bytes. Both backends produce the same bytes for webhook payloads."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class EventStream:
+    """
+    Incremental parser for bulk uploads: NDJSON (one event per line) or one JSON array
+    of events, detected from the first non-blank byte. feed() takes body chunks of any
+    size and returns the (payload, raw bytes) pairs completed so far, so a large upload
+    is never held in memory at once. Lines or array items that are not JSON objects are
+    counted in `invalid` (the first few messages kept in `errors`) and skipped; a broken
+    array cannot be resynchronised, so parsing stops there.
+    """
+
+    MAX_ERRORS = 10
+
+    def __init__(self, max_event_bytes=BULK_MAX_EVENT_BYTES):
+        self.max_event_bytes = max_event_bytes
+        self.format = None        # "ndjson" or "array", once known
+        self.items = 0
+        self.invalid = 0
+        self.errors = []
+        self._buf = b""           # NDJSON: bytes after the last newline
+        self._skipping = False    # NDJSON: dropping the rest of an over-long line
+        self._text = ""           # array: decoded text not yet consumed
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._decoder = json.JSONDecoder()
+        self._started = False     # array: opening bracket consumed
+        self._done = False        # array: closing bracket seen, or unrecoverable error
+
+    def feed(self, chunk):
+        if self.format is None:
+            stripped = chunk.lstrip()
+            if not stripped:
+                return []
+            self.format = "array" if stripped[:1] == b"[" else "ndjson"
+        if self.format == "ndjson":
+            return self._feed_lines(chunk, final=False)
+        return self._feed_array(chunk, final=False)
+
+    def close(self):
+        """Parse whatever is left once the body has ended."""
+        if self.format == "ndjson":
+            return self._feed_lines(b"", final=True)
+        if self.format == "array":
+            return self._feed_array(b"", final=True)
+        return []
+
+    def _error(self, message):
+        self.invalid += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(f"event {self.items + self.invalid}: {message}")
+
+    def _feed_lines(self, chunk, final):
+        if self._skipping:
+            newline = chunk.find(b"\n")
+            if newline < 0:
+                return []
+            self._skipping = False
+            chunk = chunk[newline + 1:]
+        lines = (self._buf + chunk).split(b"\n")
+        self._buf = b"" if final else lines.pop()
+        if len(self._buf) > self.max_event_bytes:
+            self._error(f"line longer than {self.max_event_bytes} bytes")
+            self._buf = b""
+            self._skipping = True  # the rest of this line is dropped up to the next newline
+        out = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payload = json_loads(line)
+            except ValueError as e:
+                self._error(f"invalid JSON ({e})")
+                continue
+            if not isinstance(payload, dict):
+                self._error("not a JSON object")
+                continue
+            self.items += 1
+            out.append((payload, line))
+        return out
+
+    def _feed_array(self, chunk, final):
+        if self._done:
+            return []
+        text = self._text + self._utf8.decode(chunk, final)
+        pos, out = 0, []
+        while True:
+            while pos < len(text) and text[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(text):
+                break
+            if not self._started:
+                self._started = True  # feed() saw the "[" already
+                pos += 1
+                continue
+            if text[pos] == "]":
+                self._done = True
+                pos = len(text)
+                break
+            try:
+                payload, end = self._decoder.raw_decode(text, pos)
+            except json.JSONDecodeError as e:
+                if final or len(text) - pos > self.max_event_bytes:
+                    self._error(f"invalid JSON array item ({e.msg})")
+                    self._done = True
+                    pos = len(text)
+                break  # otherwise the item is incomplete: wait for the next chunk
+            if isinstance(payload, dict):
+                self.items += 1
+                out.append((payload, text[pos:end].encode()))
+            else:
+                self._error("not a JSON object")
+            pos = end
+        if final and not self._done and self._started:
+            self._error("JSON array is not closed")
+        self._text = text[pos:]
+        return out
+
+
+class CodecJSONResponse(JSONResponse):
+    """JSON response rendered with the same codec as the ingest path."""
+
+    def render(self, content):
+        return json_dumps(content)
+
+# ---------------------------------------------------------------------------
+# Metrics (GET /metrics, Prometheus text format)
+# ---------------------------------------------------------------------------
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+READING_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+# name -> (type, help, histogram buckets); also the order of /metrics
+METRICS = {
+    "cognituv_events_stored_total": ("counter", "Webhook events stored, by event type.", None),
+    "cognituv_uplink_readings": ("histogram", "Sensor readings per stored uplink event.", READING_BUCKETS),
+    "cognituv_events_duplicate_total": ("counter", "Redelivered events dropped by the dedup filter or the unique index.", None),
+    "cognituv_events_rejected_total": ("counter", "Webhook events refused, by reason.", None),
+    "cognituv_ingest_errors_total": ("counter", "Events that failed to be stored, by stage.", None),
+    "cognituv_ingest_queue_depth": ("gauge", "Events waiting for the ingest writer.", None),
+    "cognituv_webhook_duration_seconds": ("histogram", "Webhook request handling time, by endpoint.", LATENCY_BUCKETS),
+    "cognituv_db_commit_duration_seconds": ("histogram", "Ingest write transaction time, first statement to commit.", LATENCY_BUCKETS),
+    "cognituv_db_wait_seconds_total": ("counter", "Time spent waiting for a pooled connection, by connection kind.", None),
+    "cognituv_db_checkouts_total": ("counter", "Pooled connections handed out, by connection kind.", None),
+    "cognituv_tool_duration_seconds": ("histogram", "MCP tool call time, by tool.", LATENCY_BUCKETS),
+    "cognituv_tool_errors_total": ("counter", "MCP tool calls that raised, by tool.", None),
+    "cognituv_slow_tool_calls_total": ("counter", "Tool calls written to the slow query log.", None),
+    "cognituv_result_cache_lookups_total": ("counter", "Result cache lookups, by result.", None),
+    "cognituv_db_size_bytes": ("gauge", "Database file sizes on disk.", None),
+    "cognituv_db_rows": ("gauge", "Rows per table, from the running totals kept by the ingest path.", None),
+    "cognituv_active_alerts": ("gauge", "Alert rules currently triggered (alert_state).", None),
+    "cognituv_gateways": ("gauge", "Gateways by status.", None),
+    "cognituv_live_subscribers": ("gauge", "Open /stream and relay subscriptions.", None),
+}
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _metric_line(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{k}="{_label_value(v)}"' for k, v in labels)
+        return f"{name}{{{rendered}}} {value}"
+    return f"{name} {value}"
+
+
+class Metrics:
+    """
+    Counters and histograms kept in process and rendered in the Prometheus text format.
+
+    Every update takes one short lock, and the ingest path records a whole batch per
+    call. Values that other components already count (pool waits, dedup hits, queue
+    depth) are not mirrored here; /metrics reads them at scrape time and passes them
+    to render() as extra samples.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [count per bucket, +Inf count, sum]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, *values, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            for value in values:
+                state[bisect.bisect_left(buckets, value)] += 1
+                state[-1] += value
+
+    def render(self, samples=()):
+        """Text exposition of the recorded metrics plus `samples`, (name, labels dict, value) triples."""
+        families = {}
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, list(state)) for key, state in self._histograms.items()]
+        for (name, labels), value in counters:
+            families.setdefault(name, []).append(_metric_line(name, labels, value))
+        for name, labels, value in samples:
+            families.setdefault(name, []).append(_metric_line(name, tuple(sorted(labels.items())), value))
+        for (name, labels), state in histograms:
+            lines, total = families.setdefault(name, []), 0
+            for bound, count in zip((*METRICS[name][2], "+Inf"), state):
+                total += count
+                lines.append(_metric_line(f"{name}_bucket", (*labels, ("le", bound)), total))
+            lines.append(_metric_line(f"{name}_sum", labels, round(state[-1], 6)))
+            lines.append(_metric_line(f"{name}_count", labels, total))
+        out = []
+        for name, (kind, help_text, _) in METRICS.items():
+            if name in families:
+                out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *families[name]]
+        return "\n".join(out) + "\n"
+
+    def value(self, name, **labels):
+        """Current value of a counter (tests and benchmarks)."""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+metrics = Metrics()
+
+
+class SlowQueryLog:
+    """
+    Logs tool calls slower than `threshold_ms` with the SQL they ran and its query plan.
+
+    While enabled, reader connections report every statement through sqlite3's trace
+    callback, which passes the SQL with its parameters filled in. Statements are only
+    collected for the thread of a running tool call, and EXPLAIN QUERY PLAN runs only
+    for calls over the threshold, after they have answered.
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS):
+        self.threshold = threshold_ms / 1000
+        self._local = threading.local()
+        self.logged = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def trace(self, sql):
+        statements = getattr(self._local, "statements", None)
+        if statements is not None:
+            statements.append(sql)
+
+    def start(self):
+        self._local.statements = []
+
+    def finish(self, tool, arguments, elapsed):
+        statements, self._local.statements = getattr(self._local, "statements", None), None
+        if statements is None or elapsed < self.threshold:
+            return
+        self.logged += 1
+        metrics.inc("cognituv_slow_tool_calls_total")
+        lines = [f"Slow tool call: {tool}({', '.join(f'{k}={v!r}' for k, v in arguments.items())}) "
+                 f"took {elapsed * 1000:.1f} ms, {len(statements)} statement(s)"]
+        with db.reader() as conn:
+            for sql in statements:
+                lines.append(f"  SQL: {' '.join(sql.split())}")
+                if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                    continue
+                try:
+                    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+                except sqlite3.Error as e:
+                    lines.append(f"  plan unavailable: {e}")
+                    continue
+                lines += [f"  plan: {row['detail']}" for row in plan]
+        logger.warning("\n".join(lines))
+
+
+slow_query_log = SlowQueryLog()
+
+# Downsampled reading tables maintained during ingest: resolution -> (table, bucket width in ms)
+ROLLUPS = {
+    "1m": ("readings_1m", 60_000),
+    "1h": ("readings_1h", 3_600_000),
+    "1d": ("readings_1d", 86_400_000),
+}
+
 # ---------------------------------------------------------------------------
 # Database helpers
 # ---------------------------------------------------------------------------
 
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
+class ConnectionPool:
+    """
+    Long-lived SQLite connections shared by the webhook writer and the MCP tools.
+
+    SQLite allows a single writer at a time, so there is exactly one read-write
+    connection, serialised by a lock. Tools borrow one of up to `readers` read-only
+    connections, which under WAL never block (or are blocked by) the writer.
+    Pragmas are applied once per connection, and each connection keeps its own
+    prepared-statement cache, so repeated tool queries skip the SQL compiler.
+
+    A `read_only` pool (the uvicorn workers of the multi-process mode) never opens the
+    read-write connection: the writer process creates the file and switches it to WAL.
+    """
+
+    def __init__(self, db_file, readers=DB_READ_CONNECTIONS, read_only=False):
+        self.db_file = db_file
+        self.max_readers = max(1, readers)
+        self.read_only = read_only
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._readers_open = 0
+        self.reader_checkouts = 0
+        self.reader_waits = 0
+        self.reader_wait_seconds = 0.0
+        self.writer_checkouts = 0
+        self.writer_wait_seconds = 0.0
+
+    def _tune(self, conn):
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _open_writer(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return self._tune(conn)
+
+    def _open_reader(self):
+        if not self.read_only:
+            self._ensure_writer()  # creates the file and the WAL before any read-only open
+        elif not os.path.exists(self.db_file):
+            raise FileNotFoundError(f"{self.db_file} does not exist yet; the writer process creates it")
+        uri = Path(self.db_file).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        self._tune(conn)
+        if slow_query_log.enabled:
+            conn.set_trace_callback(slow_query_log.trace)
+        return conn
+
+    def _ensure_writer(self):
+        if self.read_only:
+            raise RuntimeError("read-only connection pool: writes go through the writer process")
+        with self._open_lock:
+            if self._writer is None:
+                self._writer = self._open_writer()
+            return self._writer
+
+    @contextmanager
+    def writer(self):
+        """Exclusive access to the read-write connection."""
+        conn = self._ensure_writer()
+        started = time.perf_counter()
+        with self._writer_lock:
+            self.writer_wait_seconds += time.perf_counter() - started
+            self.writer_checkouts += 1
+            yield conn
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection, opening a new one while under the pool limit."""
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._open_lock:
+                can_open = self._readers_open < self.max_readers
+                if can_open:
+                    self._readers_open += 1
+            if can_open:
+                try:
+                    conn = self._open_reader()
+                except Exception:
+                    with self._open_lock:
+                        self._readers_open -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                conn = self._idle.get()
+                self.reader_waits += 1
+                self.reader_wait_seconds += time.perf_counter() - started
+        self.reader_checkouts += 1
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._open_lock:
+            self._readers_open = 0
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self):
+        return {
+            "readers_max": self.max_readers,
+            "readers_open": self._readers_open,
+            "readers_in_use": max(0, self._readers_open - self._idle.qsize()),
+            "reader_checkouts": self.reader_checkouts,
+            "reader_waits": self.reader_waits,
+            "reader_wait_ms": round(self.reader_wait_seconds * 1000, 3),
+            "writer_checkouts": self.writer_checkouts,
+            "writer_wait_ms": round(self.writer_wait_seconds * 1000, 3),
+        }
+
+
+# Workers of the multi-process mode only read; writer.py replaces this with a read-write pool
+db = ConnectionPool(DB_FILE, read_only=bool(WRITER_SOCKET))
+
+
+# Secondary indexes on the derived history tables. Bulk replays drop these and rebuild
+# them once at the end (see replay.py); ingest never needs them to write.
+HISTORY_INDEXES = {
+    "idx_readings_device_ts": "CREATE INDEX IF NOT EXISTS idx_readings_device_ts ON sensor_readings(device_id, ts)",
+    "idx_readings_device_type_ts":
+        "CREATE INDEX IF NOT EXISTS idx_readings_device_type_ts ON sensor_readings(device_id, type, ts)",
+    "idx_readings_device_channel_ts":
+        "CREATE INDEX IF NOT EXISTS idx_readings_device_channel_ts ON sensor_readings(device_id, channel, ts)",
+    "idx_readings_ts": "CREATE INDEX IF NOT EXISTS idx_readings_ts ON sensor_readings(ts)",
+    "idx_alerts_device_ts": "CREATE INDEX IF NOT EXISTS idx_alerts_device_ts ON alerts(device_id, ts)",
+    "idx_alerts_device_triggered_ts":
+        "CREATE INDEX IF NOT EXISTS idx_alerts_device_triggered_ts ON alerts(device_id, triggered, ts)",
+    "idx_alerts_triggered_ts": "CREATE INDEX IF NOT EXISTS idx_alerts_triggered_ts ON alerts(triggered, ts)",
+    "idx_alerts_ts": "CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts(ts)",
+    "idx_pings_ts": "CREATE INDEX IF NOT EXISTS idx_pings_ts ON gateway_pings(ts)",
+}
+
+
+# Device columns in the devices_fts trigram index, with their bm25 weights in search_devices
+DEVICE_SEARCH_COLUMNS = {"thing_name": 10.0, "sensor_use": 5.0, "model": 3.0, "manufacturer": 2.0,
+                         "location_name": 2.0, "location_city": 1.0, "company_name": 1.0}
+
+
+def _trigram_supported():
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(x, tokenize='trigram')")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+# FTS5 with the trigram tokenizer (SQLite 3.34+) backs search_devices and the name filters;
+# without it search_devices and the filters fall back to LIKE scans of devices
+DEVICE_SEARCH = _trigram_supported()
 
 
 def init_db():
-    conn = get_db()
+    with db.writer() as conn:
+        _create_schema(conn)
+        latest_cache.load(conn)
+        device_registry.load(conn)
+        dedup.load(conn)
+    result_cache.enable()
+
+
+def _create_schema(conn):
     c = conn.cursor()
 
+    # Only takes effect on a new, empty database; see RetentionManager.enable_auto_vacuum()
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
     c.execute("""
     CREATE TABLE IF NOT EXISTS events (
-        id          INTEGER PRIMARY KEY AUTOINCREMENT,
-        event_type  TEXT NOT NULL,
-        received_at TEXT DEFAULT (datetime('now')),
-        raw_json    TEXT NOT NULL
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type      TEXT NOT NULL,
+        received_at     TEXT DEFAULT (datetime('now')),
+        raw_json        TEXT NOT NULL,
+        body            BLOB,
+        company_ref     INTEGER,
+        location_ref    INTEGER,
+        device_type_ref INTEGER,
+        device_ref      INTEGER
+    )""")
+    _add_missing_columns(c, "events", {
+        "body": "BLOB",
+        "company_ref": "INTEGER",
+        "location_ref": "INTEGER",
+        "device_type_ref": "INTEGER",
+        "device_ref": "INTEGER",
+        "dedup_key": "BLOB",
+    })
+
+    # Interned company/location/device_type/device blocks referenced by compact events
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS event_metadata (
+        id      INTEGER PRIMARY KEY,
+        hash    BLOB NOT NULL UNIQUE,
+        block   TEXT NOT NULL
     )""")
 
     c.execute("""
@@ -113,430 +750,3864 @@ def init_db():
         received_at TEXT DEFAULT (datetime('now'))
     )""")
 
-    # Indexes for common queries
-    c.execute("CREATE INDEX IF NOT EXISTS idx_readings_device ON sensor_readings(device_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_readings_ts ON sensor_readings(ts)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_device ON alerts(device_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts(ts)")
-
-    conn.commit()
-    conn.close()
+    # Indexes for common queries. The composite indexes match the tool predicates and
+    # their ORDER BY ts DESC (rowid is implicitly the last index column, which makes the
+    # (ts, id) keyset cursors index-only range seeks).
+    for ddl in HISTORY_INDEXES.values():
+        c.execute(ddl)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_events_dedup ON events(dedup_key) WHERE dedup_key IS NOT NULL")
+    # Superseded by the composite indexes above (they share the same leading column)
+    c.execute("DROP INDEX IF EXISTS idx_readings_device")
+    c.execute("DROP INDEX IF EXISTS idx_alerts_device")
 
+    # Materialized state maintained by the ingest path (see LatestValueCache)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS latest_readings (
+        device_id   TEXT NOT NULL,
+        channel     INTEGER NOT NULL,
+        sensor_id   TEXT,
+        name        TEXT,
+        type        TEXT,
+        value       REAL,
+        unit        TEXT,
+        ts          INTEGER,
+        PRIMARY KEY (device_id, channel)
+    ) WITHOUT ROWID""")
 
-def upsert_device(c, payload):
-    """Insert or update device metadata from any webhook event."""
-    event_data = payload.get("event_data", {})
-    device_info = payload.get("device", {})
-    device_type = payload.get("device_type", {})
-    company = payload.get("company", {})
-    location = payload.get("location", {})
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS device_stats (
+        device_id     TEXT PRIMARY KEY,
+        reading_count INTEGER NOT NULL DEFAULT 0,
+        alert_count   INTEGER NOT NULL DEFAULT 0
+    )""")
 
-    device_id = event_data.get("device_id") or event_data.get("thingId") or str(device_info.get("id", ""))
-    if not device_id:
-        return device_id
+    for table, _ in ROLLUPS.values():
+        c.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            device_id   TEXT NOT NULL,
+            channel     INTEGER NOT NULL,
+            bucket      INTEGER NOT NULL,
+            type        TEXT,
+            name        TEXT,
+            unit        TEXT,
+            min_value   REAL,
+            max_value   REAL,
+            sum_value   REAL,
+            count       INTEGER NOT NULL,
+            last_value  REAL,
+            last_ts     INTEGER,
+            PRIMARY KEY (device_id, channel, bucket)
+        ) WITHOUT ROWID""")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_type ON {table}(type, bucket)")
 
-    c.execute("SELECT device_id FROM devices WHERE device_id = ?", (device_id,))
-    if c.fetchone():
-        c.execute("UPDATE devices SET last_seen = datetime('now') WHERE device_id = ?", (device_id,))
-    else:
-        c.execute("""
-        INSERT INTO devices (device_id, thing_name, sensor_use, device_type_id, device_type_name,
-                             manufacturer, model, codec, company_id, company_name,
-                             location_id, location_name, location_city, location_state,
-                             first_seen, last_seen)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,datetime('now'),datetime('now'))
-        """, (
-            device_id,
-            device_info.get("thing_name"),
-            device_info.get("sensor_use", ""),
-            device_type.get("id"),
-            device_type.get("name"),
-            device_type.get("manufacturer"),
-            device_type.get("model"),
-            device_type.get("codec"),
-            company.get("id"),
-            company.get("name"),
-            location.get("id"),
-            location.get("name"),
-            location.get("city"),
-            location.get("state"),
-        ))
-    return device_id
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS columnar_state (
+        id            INTEGER PRIMARY KEY CHECK (id = 1),
+        boundary_ts   INTEGER NOT NULL,
+        max_id        INTEGER NOT NULL,
+        exported_rows INTEGER NOT NULL DEFAULT 0,
+        updated_at    TEXT,
+        export_run    INTEGER NOT NULL DEFAULT 0
+    )""")
+    _add_missing_columns(c, "columnar_state", {"export_run": "INTEGER NOT NULL DEFAULT 0"})
 
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS gateway_state (
+        device_id          TEXT PRIMARY KEY,
+        thing_name         TEXT,
+        first_ping_ts      INTEGER,
+        last_ping_ts       INTEGER,
+        ping_count         INTEGER NOT NULL DEFAULT 0,
+        avg_interval_ms    REAL,
+        last_sampled_ts    INTEGER,
+        status             TEXT NOT NULL DEFAULT 'online',
+        status_changed_ts  INTEGER
+    )""")
 
-# ---------------------------------------------------------------------------
-# FastAPI application (webhook receiver)
-# ---------------------------------------------------------------------------
-app = FastAPI(
-    title="Cognituv Connect MCP Server",
-    description="Receives myDevices webhooks and exposes MCP tools for AI agents.",
-    version="1.0.0",
-)
+    # Current state per (device, rule, sensor); the alerts table keeps the history (see _track_alerts)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS alert_state (
+        device_id          TEXT NOT NULL,
+        rule_id            TEXT NOT NULL,
+        sensor_id          TEXT NOT NULL,
+        title              TEXT,
+        triggered          INTEGER NOT NULL,
+        value              TEXT,
+        first_triggered_ts INTEGER,
+        last_change_ts     INTEGER,
+        last_ts            INTEGER,
+        trigger_count      INTEGER NOT NULL DEFAULT 0,
+        alert_id           INTEGER,
+        PRIMARY KEY (device_id, rule_id, sensor_id)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alert_state_triggered ON alert_state(triggered, last_ts, alert_id)")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_alert_state_device_triggered
+                 ON alert_state(device_id, triggered, last_ts, alert_id)""")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    if DEVICE_SEARCH:
+        _create_device_search(c)
 
+    # Databases created before these tables existed: derive them from history once
+    has_history = c.execute("SELECT 1 FROM sensor_readings LIMIT 1").fetchone() is not None
+    if (c.execute("SELECT 1 FROM device_stats LIMIT 1").fetchone() is None
+            and (has_history or c.execute("SELECT 1 FROM alerts LIMIT 1").fetchone() is not None)):
+        rebuild_latest_state(c)
+    if has_history and c.execute("SELECT 1 FROM readings_1m LIMIT 1").fetchone() is None:
+        rebuild_rollups(c)
+    if (c.execute("SELECT 1 FROM gateway_state LIMIT 1").fetchone() is None
+            and c.execute("SELECT 1 FROM gateway_pings LIMIT 1").fetchone() is not None):
+        rebuild_gateway_state(c)
+    if (c.execute("SELECT 1 FROM alert_state LIMIT 1").fetchone() is None
+            and c.execute("SELECT 1 FROM alerts LIMIT 1").fetchone() is not None):
+        rebuild_alert_state(c)
 
-@app.on_event("startup")
-async def startup():
-    init_db()
+    conn.commit()
 
 
-@app.get("/health")
-async def health():
-    """Health check endpoint."""
-    return {"status": "ok", "service": "cognituv-connect-mcp"}
+def _create_device_search(c):
+    """
+    External-content FTS5 index over the searchable device columns. Triggers keep it in sync
+    with every write to devices (DeviceRegistry.flush upserts); last_seen refreshes do not
+    touch it. An index added to an existing database is filled once.
+    """
+    columns = ", ".join(DEVICE_SEARCH_COLUMNS)
+    new = [f"new.{col}" for col in DEVICE_SEARCH_COLUMNS]
+    old = [f"old.{col}" for col in DEVICE_SEARCH_COLUMNS]
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'devices_fts'").fetchone() is not None
+    c.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS devices_fts USING fts5(
+        {columns}, content='devices', content_rowid='rowid', tokenize='trigram'
+    )""")
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS devices_fts_insert AFTER INSERT ON devices BEGIN
+        INSERT INTO devices_fts (rowid, {columns}) VALUES (new.rowid, {', '.join(new)});
+    END""")
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS devices_fts_delete AFTER DELETE ON devices BEGIN
+        INSERT INTO devices_fts (devices_fts, rowid, {columns}) VALUES ('delete', old.rowid, {', '.join(old)});
+    END""")
+    c.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS devices_fts_update AFTER UPDATE OF {columns} ON devices BEGIN
+        INSERT INTO devices_fts (devices_fts, rowid, {columns}) VALUES ('delete', old.rowid, {', '.join(old)});
+        INSERT INTO devices_fts (rowid, {columns}) VALUES (new.rowid, {', '.join(new)});
+    END""")
+    if not exists and c.execute("SELECT 1 FROM devices LIMIT 1").fetchone() is not None:
+        c.execute("INSERT INTO devices_fts (devices_fts) VALUES ('rebuild')")
 
 
-@app.post("/webhook")
-async def receive_webhook(request: Request):
+def _name_filters(location_name=None, company_name=None, alias=""):
     """
-    Receives webhook events from myDevices (Cognituv Connect platform).
-    Supports event types: uplink, alert, ping.
+    Predicate (None without filters) and params for the location/company substring filters of the tools.
+    The '%...%' patterns are answered by the devices_fts trigram index when it exists
+    (same LIKE semantics, without scanning devices); `alias` qualifies the devices table.
     """
-    # Optional: validate shared secret header
-    if WEBHOOK_SECRET:
-        auth = request.headers.get("x-api") or request.headers.get("authorization")
-        if auth != WEBHOOK_SECRET:
-            raise HTTPException(status_code=401, detail="Unauthorized")
+    likes = [(column, value) for column, value in (("location_name", location_name), ("company_name", company_name))
+             if value]
+    if not likes:
+        return None, []
+    params = [f"%{value}%" for _, value in likes]
+    if DEVICE_SEARCH:
+        where = " AND ".join(f"{column} LIKE ?" for column, _ in likes)
+        return f"{alias}rowid IN (SELECT rowid FROM devices_fts WHERE {where})", params
+    return " AND ".join(f"{alias}{column} LIKE ?" for column, _ in likes), params
 
-    try:
-        payload = await request.json()
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid JSON body")
 
-    event_type = payload.get("event_type", "unknown")
-    conn = get_db()
-    c = conn.cursor()
+def _add_missing_columns(c, table, columns):
+    """ALTER TABLE ADD COLUMN for each column an older database does not have yet."""
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
 
-    # Log raw event
-    c.execute("INSERT INTO events (event_type, raw_json) VALUES (?, ?)",
-              (event_type, json.dumps(payload)))
 
-    try:
-        if event_type == "uplink":
-            device_id = upsert_device(c, payload)
-            for reading in payload.get("event_data", {}).get("payload", []):
-                c.execute("""
-                INSERT INTO sensor_readings (device_id, sensor_id, name, type, value, unit, channel, ts)
-                VALUES (?,?,?,?,?,?,?,?)
-                """, (
-                    device_id,
-                    reading.get("sensor_id"),
-                    reading.get("name"),
-                    reading.get("type"),
-                    reading.get("value"),
-                    reading.get("unit"),
-                    reading.get("channel"),
-                    reading.get("timestamp"),
-                ))
+def rebuild_latest_state(c):
+    """Recompute latest_readings and device_stats from the full reading/alert history."""
+    c.execute("DELETE FROM latest_readings")
+    c.execute("DELETE FROM device_stats")
+    # SQLite returns the bare columns from the row holding MAX(ts)
+    c.execute("""
+    INSERT INTO latest_readings (device_id, channel, sensor_id, name, type, value, unit, ts)
+    SELECT device_id, channel, sensor_id, name, type, value, unit, MAX(ts)
+    FROM sensor_readings
+    WHERE channel IS NOT NULL AND ts IS NOT NULL
+    GROUP BY device_id, channel
+    """)
+    c.execute("""
+    INSERT INTO device_stats (device_id, reading_count, alert_count)
+    SELECT device_id, SUM(readings), SUM(alerts) FROM (
+        SELECT device_id, COUNT(*) AS readings, 0 AS alerts FROM sensor_readings GROUP BY device_id
+        UNION ALL
+        SELECT device_id, 0, COUNT(*) FROM alerts GROUP BY device_id
+    ) GROUP BY device_id
+    """)
 
-        elif event_type == "alert":
-            device_id = upsert_device(c, payload)
-            ed = payload.get("event_data", {})
-            c.execute("""
-            INSERT INTO alerts (device_id, sensor_id, rule_id, title, triggered, value, ts)
-            VALUES (?,?,?,?,?,?,?)
-            """, (
-                device_id,
-                ed.get("sensorId"),
-                ed.get("ruleId"),
-                ed.get("title"),
-                1 if ed.get("triggered") else 0,
-                str(ed.get("value", "")),
-                ed.get("timestamp"),
-            ))
-
-        elif event_type == "ping":
-            ed = payload.get("event_data", {})
-            device = payload.get("device", {})
-            c.execute("""
-            INSERT INTO gateway_pings (device_id, thing_name, ts)
-            VALUES (?,?,?)
-            """, (
-                ed.get("device_id", str(device.get("id", ""))),
-                device.get("thing_name"),
-                ed.get("timestamp"),
-            ))
 
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
-    finally:
-        conn.close()
+def rebuild_gateway_state(c):
+    """Recompute gateway_state from the raw ping history (status is settled by the next sweep)."""
+    c.execute("DELETE FROM gateway_state")
+    # SQLite returns the bare thing_name from the row holding MAX(ts)
+    c.execute("""
+    INSERT INTO gateway_state (device_id, thing_name, first_ping_ts, last_ping_ts, ping_count,
+                               avg_interval_ms, last_sampled_ts, status, status_changed_ts)
+    SELECT device_id, thing_name, MIN(ts), MAX(ts), COUNT(*),
+           CASE WHEN COUNT(*) > 1 THEN (MAX(ts) - MIN(ts)) * 1.0 / (COUNT(*) - 1) END,
+           MAX(ts), 'online', MAX(ts)
+    FROM gateway_pings
+    WHERE ts IS NOT NULL
+    GROUP BY device_id
+    """)
 
-    return {"status": "ok", "event_type": event_type}
 
+def rebuild_alert_state(c):
+    """
+    Recompute alert_state from the alert history, replayed in (ts, id) order: the newest alert
+    per (device, rule, sensor) gives the current state, and every change of `triggered` counts
+    as a state change (a change to triggered also as a trigger).
+    """
+    c.execute("DELETE FROM alert_state")
+    c.execute("""
+    INSERT INTO alert_state (device_id, rule_id, sensor_id, title, triggered, value, first_triggered_ts,
+                             last_change_ts, last_ts, trigger_count, alert_id)
+    SELECT device_id, rule_id, sensor_id, title, triggered, value, first_triggered_ts,
+           last_change_ts, ts, trigger_count, id
+    FROM (
+        SELECT *,
+               ROW_NUMBER() OVER (PARTITION BY device_id, rule_id, sensor_id ORDER BY ts DESC, id DESC) AS newest,
+               MIN(CASE WHEN triggered THEN ts END) OVER alert AS first_triggered_ts,
+               MAX(CASE WHEN changed THEN ts END) OVER alert AS last_change_ts,
+               SUM(triggered AND changed) OVER alert AS trigger_count
+        FROM (
+            SELECT *, triggered IS NOT LAG(triggered) OVER (
+                       PARTITION BY device_id, rule_id, sensor_id ORDER BY ts, id) AS changed
+            FROM (
+                SELECT id, device_id, COALESCE(rule_id, '') AS rule_id, COALESCE(sensor_id, '') AS sensor_id,
+                       title, COALESCE(triggered, 0) AS triggered, value,
+                       COALESCE(ts, CAST(strftime('%s', received_at) AS INTEGER) * 1000) AS ts
+                FROM alerts
+            )
+        )
+        WINDOW alert AS (PARTITION BY device_id, rule_id, sensor_id)
+    )
+    WHERE newest = 1
+    """)
 
-# ---------------------------------------------------------------------------
-# MCP Server (tools for AI agents)
-# ---------------------------------------------------------------------------
-mcp = FastMCP(
-    name="cognituv-connect",
-    instructions="""You are the Cognituv Connect AI assistant. You have access to real-time
-    IoT sensor data from facilities monitored by Cognituv Connect. You can list devices,
-    query sensor readings, check alerts, and analyze facility conditions. Always present
-    data clearly with units and timestamps. Follow the Identify - Apply - Verify methodology.""",
-)
 
+def rebuild_rollups(c):
+    """Recompute the 1m rollup from sensor_readings, then each coarser rollup from the finer one."""
+    source = None
+    for table, width in ROLLUPS.values():
+        c.execute(f"DELETE FROM {table}")
+        if source is None:
+            # Raw readings: the bucket's last value is the reading with the highest ts
+            select = f"""
+            SELECT device_id, channel, (ts / {width}) * {width} AS bucket, type, name, unit,
+                   value AS min_value, value AS max_value, value AS sum_value, 1 AS count,
+                   value AS last_value, ts AS last_ts
+            FROM sensor_readings
+            WHERE channel IS NOT NULL AND ts IS NOT NULL AND typeof(value) IN ('integer', 'real')
+            """
+        else:
+            select = f"""
+            SELECT device_id, channel, (bucket / {width}) * {width} AS bucket, type, name, unit,
+                   min_value, max_value, sum_value, count, last_value, last_ts
+            FROM {source}
+            """
+        c.execute(f"""
+        INSERT INTO {table} (device_id, channel, bucket, type, name, unit,
+                             min_value, max_value, sum_value, count, last_value, last_ts)
+        SELECT device_id, channel, bucket, type, name, unit,
+               MIN(min_value), MAX(max_value), SUM(sum_value), SUM(count),
+               MAX(CASE WHEN rn = 1 THEN last_value END), MAX(last_ts)
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY device_id, channel, bucket ORDER BY last_ts DESC
+            ) AS rn
+            FROM ({select})
+        )
+        GROUP BY device_id, channel, bucket
+        """)
+        source = table
 
-@mcp.tool()
-def list_devices(company_name: Optional[str] = None, location_name: Optional[str] = None) -> str:
-    """List all devices registered in Cognituv Connect. Optionally filter by company or location name."""
-    conn = get_db()
-    query = "SELECT device_id, thing_name, sensor_use, device_type_name, manufacturer, model, company_name, location_name, location_city, location_state, last_seen FROM devices WHERE 1=1"
-    params = []
-    if company_name:
-        query += " AND company_name LIKE ?"
-        params.append(f"%{company_name}%")
-    if location_name:
-        query += " AND location_name LIKE ?"
-        params.append(f"%{location_name}%")
-    query += " ORDER BY last_seen DESC"
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
 
-    if not rows:
-        return "No devices found matching the criteria."
+DEVICE_FIELDS = ("thing_name", "sensor_use", "device_type_id", "device_type_name", "manufacturer",
+                 "model", "codec", "company_id", "company_name", "location_id", "location_name",
+                 "location_city", "location_state")
 
-    results = []
-    for r in rows:
-        results.append(
-            f"- **{r['thing_name']}** (ID: {r['device_id']})\n"
-            f"  Type: {r['device_type_name']} | {r['manufacturer']} {r['model']}\n"
-            f"  Use: {r['sensor_use'] or 'N/A'}\n"
-            f"  Location: {r['location_name']}, {r['location_city']}, {r['location_state']}\n"
-            f"  Company: {r['company_name']} | Last seen: {r['last_seen']}"
-        )
-    return f"Found {len(rows)} device(s):\n\n" + "\n\n".join(results)
 
+def device_metadata(payload):
+    """Extract (device_id, metadata tuple in DEVICE_FIELDS order) from any webhook event."""
+    event_data = payload.get("event_data", {})
+    device_info = payload.get("device", {})
+    device_type = payload.get("device_type", {})
+    company = payload.get("company", {})
+    location = payload.get("location", {})
 
-@mcp.tool()
-def get_device_details(device_id: str) -> str:
-    """Get full details for a specific device by its ID."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM devices WHERE device_id = ?", (device_id,)).fetchone()
-    if not row:
-        conn.close()
-        return f"Device {device_id} not found."
-
-    # Also get reading count and alert count
-    reading_count = conn.execute("SELECT COUNT(*) as cnt FROM sensor_readings WHERE device_id = ?", (device_id,)).fetchone()["cnt"]
-    alert_count = conn.execute("SELECT COUNT(*) as cnt FROM alerts WHERE device_id = ?", (device_id,)).fetchone()["cnt"]
-    conn.close()
-
-    lines = [f"**Device: {row['thing_name']}**", ""]
-    for key in row.keys():
-        lines.append(f"- {key}: {row[key]}")
-    lines.append(f"- total_readings: {reading_count}")
-    lines.append(f"- total_alerts: {alert_count}")
-    return "\n".join(lines)
+    device_id = event_data.get("device_id") or event_data.get("thingId") or str(device_info.get("id", ""))
+    return device_id, (
+        device_info.get("thing_name"),
+        device_info.get("sensor_use"),
+        device_type.get("id"),
+        device_type.get("name"),
+        device_type.get("manufacturer"),
+        device_type.get("model"),
+        device_type.get("codec"),
+        company.get("id"),
+        company.get("name"),
+        location.get("id"),
+        location.get("name"),
+        location.get("city"),
+        location.get("state"),
+    )
 
 
-@mcp.tool()
-def get_latest_readings(device_id: str) -> str:
-    """Get the most recent sensor reading for each sensor channel on a device."""
-    conn = get_db()
-    rows = conn.execute("""
-        SELECT sr.name, sr.type, sr.value, sr.unit, sr.channel, sr.ts
-        FROM sensor_readings sr
-        INNER JOIN (
-            SELECT device_id, channel, MAX(ts) as max_ts
-            FROM sensor_readings
-            WHERE device_id = ?
-            GROUP BY device_id, channel
-        ) latest ON sr.device_id = latest.device_id
-                 AND sr.channel = latest.channel
-                 AND sr.ts = latest.max_ts
-        WHERE sr.device_id = ?
-        ORDER BY sr.channel
-    """, (device_id, device_id)).fetchall()
-    conn.close()
+class DeviceRegistry:
+    """
+    Known-device cache that keeps device upserts off the hot path.
 
-    if not rows:
-        return f"No readings found for device {device_id}."
+    Each device is remembered with the metadata fingerprint last written to the
+    `devices` table. An event whose metadata matches costs no statement at all
+    apart from a `last_seen` refresh, which is throttled to once every
+    `last_seen_interval` seconds per device and coalesced into one executemany()
+    per batch. Only new devices and changed metadata issue the full upsert. The
+    registry also remembers each device's stored `last_seen`, so cached device
+    listings can show it without being invalidated by every refresh.
+    """
 
-    lines = [f"Latest readings for device {device_id}:", ""]
-    for r in rows:
-        ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
-        lines.append(f"- **{r['name']}**: {r['value']} {r['unit']} (channel {r['channel']}, at {ts_str})")
-    return "\n".join(lines)
+    def __init__(self, last_seen_interval=None):
+        self.last_seen_interval = LAST_SEEN_INTERVAL if last_seen_interval is None else last_seen_interval
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self._touched_at = {}
+        self._last_seen = {}
 
+    def load(self, conn):
+        fingerprints, last_seen = {}, {}
+        for row in conn.execute(f"SELECT device_id, {', '.join(DEVICE_FIELDS)}, last_seen FROM devices"):
+            fingerprints[row["device_id"]] = tuple(row[f] for f in DEVICE_FIELDS)
+            last_seen[row["device_id"]] = row["last_seen"]
+        with self._lock:
+            self._fingerprints = fingerprints
+            self._touched_at = {}
+            self._last_seen = last_seen
 
-@mcp.tool()
-def get_reading_history(device_id: str, sensor_type: Optional[str] = None, limit: int = 50) -> str:
-    """Get historical sensor readings for a device. Optionally filter by sensor type (e.g., 'temp', 'rel_hum', 'co2', 'batt'). Returns up to `limit` most recent readings."""
-    conn = get_db()
-    query = "SELECT name, type, value, unit, channel, ts FROM sensor_readings WHERE device_id = ?"
-    params: list = [device_id]
-    if sensor_type:
-        query += " AND type = ?"
-        params.append(sensor_type)
-    query += " ORDER BY ts DESC LIMIT ?"
-    params.append(limit)
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
+    def observe(self, payload, pending):
+        """
+        Record a device sighting in the batch's `pending` state and return its device_id.
+        Nothing is written here; see flush().
+        """
+        device_id, fields = device_metadata(payload)
+        if not device_id:
+            return device_id
+        upserts, touches = pending.setdefault("upserts", {}), pending.setdefault("touches", set())
+        known = upserts.get(device_id) or self._fingerprints.get(device_id)
+        fields = _merge_fields(fields, known)
+        if known != fields:
+            upserts[device_id] = fields
+            touches.discard(device_id)
+        elif device_id not in upserts:
+            last = self._touched_at.get(device_id)
+            if last is None or time.monotonic() - last >= self.last_seen_interval:
+                touches.add(device_id)
+        return device_id
 
-    if not rows:
-        return f"No readings found for device {device_id}" + (f" with type '{sensor_type}'" if sensor_type else "") + "."
+    def flush(self, c, pending):
+        upserts, touches = pending.get("upserts"), pending.get("touches")
+        # Same text as SQLite's datetime('now'), chosen here so that commit() knows what was stored
+        seen_at = pending["seen_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        if upserts:
+            assignments = ", ".join(f"{f} = COALESCE(excluded.{f}, devices.{f})" for f in DEVICE_FIELDS)
+            c.executemany(f"""
+            INSERT INTO devices (device_id, {', '.join(DEVICE_FIELDS)}, first_seen, last_seen)
+            VALUES (?, {', '.join('?' * len(DEVICE_FIELDS))}, ?, ?)
+            ON CONFLICT (device_id) DO UPDATE SET {assignments}, last_seen = excluded.last_seen
+            """, [(device_id, *fields, seen_at, seen_at) for device_id, fields in upserts.items()])
+        if touches:
+            c.executemany("UPDATE devices SET last_seen = ? WHERE device_id = ?",
+                          [(seen_at, device_id) for device_id in touches])
 
-    lines = [f"Reading history for device {device_id}" + (f" (type: {sensor_type})" if sensor_type else "") + f" — {len(rows)} records:", ""]
-    for r in rows:
-        ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
-        lines.append(f"- {r['name']}: {r['value']} {r['unit']} @ {ts_str}")
-    return "\n".join(lines)
+    def commit(self, pending):
+        """Remember what a committed batch wrote."""
+        now = time.monotonic()
+        seen_at = pending.get("seen_at")
+        with self._lock:
+            for device_id, fields in pending.get("upserts", {}).items():
+                self._fingerprints[device_id] = _merge_fields(fields, self._fingerprints.get(device_id))
+                self._touched_at[device_id] = now
+                self._last_seen[device_id] = seen_at
+            for device_id in pending.get("touches", ()):
+                self._touched_at[device_id] = now
+                self._last_seen[device_id] = seen_at
 
+    def last_seen(self, device_id, default=None):
+        return self._last_seen.get(device_id, default)
 
-@mcp.tool()
-def get_alerts(device_id: Optional[str] = None, triggered_only: bool = True, limit: int = 25) -> str:
-    """Get recent alerts. Optionally filter by device_id. Set triggered_only=False to include resolved alerts."""
-    conn = get_db()
-    query = "SELECT a.device_id, d.thing_name, a.title, a.triggered, a.value, a.ts, a.received_at FROM alerts a LEFT JOIN devices d ON a.device_id = d.device_id WHERE 1=1"
-    params: list = []
-    if device_id:
-        query += " AND a.device_id = ?"
-        params.append(device_id)
-    if triggered_only:
-        query += " AND a.triggered = 1"
-    query += " ORDER BY a.ts DESC LIMIT ?"
-    params.append(limit)
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
+    def count(self):
+        return len(self._fingerprints)
 
-    if not rows:
-        return "No alerts found matching the criteria."
 
-    lines = [f"Found {len(rows)} alert(s):", ""]
-    for r in rows:
-        ts_str = datetime.fromtimestamp(int(r["ts"]) / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
-        status = "TRIGGERED" if r["triggered"] else "RESOLVED"
-        lines.append(f"- [{status}] **{r['title']}**\n  Device: {r['thing_name']} ({r['device_id']})\n  Value: {r['value']} | Time: {ts_str}")
-    return "\n".join(lines)
+def _merge_fields(fields, known):
+    # Mirrors the COALESCE in DeviceRegistry.flush(): fields missing from an event keep the stored value
+    if not known:
+        return fields
+    return tuple(k if f is None else f for f, k in zip(fields, known))
 
 
-@mcp.tool()
-def get_facility_summary(company_name: Optional[str] = None) -> str:
-    """Get a high-level summary of all monitored facilities: device counts, latest readings, active alerts."""
-    conn = get_db()
+device_registry = DeviceRegistry()
 
-    # Device counts by company/location
-    query = """
-        SELECT company_name, location_name, location_city, location_state,
-               COUNT(*) as device_count, MAX(last_seen) as latest_activity
-        FROM devices
+
+def _channel_key(channel):
+    # Match SQLite ordering: numeric channels before text ones
+    return (isinstance(channel, str), channel)
+
+
+class LatestValueCache:
     """
-    params: list = []
-    if company_name:
-        query += " WHERE company_name LIKE ?"
-        params.append(f"%{company_name}%")
-    query += " GROUP BY company_name, location_name ORDER BY company_name, location_name"
-    locations = conn.execute(query, params).fetchall()
+    Latest reading per (device, channel) and per-device reading/alert counters.
 
-    # Active alerts count
-    alert_count = conn.execute("SELECT COUNT(*) as cnt FROM alerts WHERE triggered = 1").fetchone()["cnt"]
+    The ingest path updates the `latest_readings` and `device_stats` tables in the
+    same transaction as the raw rows, then applies the same changes here after the
+    commit. get_latest_readings and get_device_details answer from memory in
+    O(channels) instead of scanning sensor_readings, and get_facility_summary takes
+    its fleet-wide reading and active-alert totals from the running sums kept here.
+    The cache is loaded from the tables at startup; until then the tools read the
+    tables directly.
+    """
 
-    # Total readings
-    reading_count = conn.execute("SELECT COUNT(*) as cnt FROM sensor_readings").fetchone()["cnt"]
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._counts = {}
+        self._reading_total = 0
+        self._active_alerts = 0
+        self.loaded = False
 
-    # Total devices
-    device_count = conn.execute("SELECT COUNT(*) as cnt FROM devices").fetchone()["cnt"]
+    def load(self, conn):
+        latest, counts = {}, {}
+        for r in conn.execute("SELECT * FROM latest_readings"):
+            latest.setdefault(r["device_id"], {})[r["channel"]] = dict(r)
+        for r in conn.execute("SELECT device_id, reading_count, alert_count FROM device_stats"):
+            counts[r["device_id"]] = [r["reading_count"], r["alert_count"]]
+        # device_stats.reading_count follows inserts and retention, so its sum is the table's row count
+        reading_total = sum(c[0] for c in counts.values())
+        active_alerts = conn.execute("SELECT COUNT(*) FROM alert_state WHERE triggered = 1").fetchone()[0]
+        with self._lock:
+            self._latest, self._counts = latest, counts
+            self._reading_total, self._active_alerts = reading_total, active_alerts
+            self.loaded = True
 
-    conn.close()
+    def apply(self, latest_rows, count_deltas, active_alerts=0):
+        """Merge the committed changes of one ingest batch."""
+        if not self.loaded:
+            return
+        with self._lock:
+            for row in latest_rows:
+                channels = self._latest.setdefault(row["device_id"], {})
+                current = channels.get(row["channel"])
+                if current is None or row["ts"] >= current["ts"]:
+                    channels[row["channel"]] = row
+            for device_id, (readings, alerts) in count_deltas.items():
+                counts = self._counts.setdefault(device_id, [0, 0])
+                counts[0] += readings
+                counts[1] += alerts
+                self._reading_total += readings
+            self._active_alerts += active_alerts
 
-    lines = ["**Cognituv Connect Facility Summary**", ""]
-    lines.append(f"- Total devices: {device_count}")
-    lines.append(f"- Total sensor readings: {reading_count}")
-    lines.append(f"- Active alerts: {alert_count}")
-    lines.append("")
+    def latest(self, device_id):
+        with self._lock:
+            channels = self._latest.get(device_id, {})
+            return [channels[ch] for ch in sorted(channels, key=_channel_key)]
 
-    if locations:
-        lines.append("**Locations:**")
-        for loc in locations:
-            lines.append(
-                f"- {loc['company_name']} / {loc['location_name']} "
-                f"({loc['location_city']}, {loc['location_state']}) — "
-                f"{loc['device_count']} devices, last activity: {loc['latest_activity']}"
-            )
-    else:
-        lines.append("No locations registered yet.")
+    def counts(self, device_id):
+        with self._lock:
+            return tuple(self._counts.get(device_id, (0, 0)))
 
-    return "\n".join(lines)
+    def totals(self):
+        """(sensor readings, triggered alerts) across the fleet."""
+        with self._lock:
+            return self._reading_total, self._active_alerts
 
 
-@mcp.tool()
-def query_sensor_data(sql_where: str, limit: int = 100) -> str:
+latest_cache = LatestValueCache()
+
+
+class ResultCache:
     """
-    Run a custom query against sensor_readings. Provide a SQL WHERE clause
-    (e.g., "type = 'temp' AND value > 30"). Returns matching rows up to `limit`.
-    Available columns: device_id, sensor_id, name, type, value, unit, channel, ts.
+    Size-bounded LRU cache of tool query results, invalidated by table generations.
+
+    Each entry is stored with the generation of every table it was computed from.
+    The ingest path bumps a table's generation after committing a change to it, and
+    an entry whose generations no longer match is recomputed on its next lookup.
+    A generation is read before the query runs, so a write that lands meanwhile
+    only causes an extra miss, never a stale hit. The cache is enabled by init_db()
+    in the process that writes; multi-worker workers never see the bumps and
+    always query.
     """
-    conn = get_db()
-    try:
-        query = f"SELECT sr.device_id, d.thing_name, sr.name, sr.type, sr.value, sr.unit, sr.ts FROM sensor_readings sr LEFT JOIN devices d ON sr.device_id = d.device_id WHERE {sql_where} ORDER BY sr.ts DESC LIMIT ?"
-        rows = conn.execute(query, (limit,)).fetchall()
-    except sqlite3.OperationalError as e:
-        conn.close()
-        return f"Query error: {e}. Please check your WHERE clause syntax."
-    conn.close()
 
-    if not rows:
-        return "No results found for the given query."
+    def __init__(self, max_entries=None):
+        self.max_entries = RESULT_CACHE_SIZE if max_entries is None else max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = Counter()
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
 
-    lines = [f"Query results ({len(rows)} rows):", ""]
-    for r in rows:
-        ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
-        lines.append(f"- {r['thing_name']}: {r['name']} = {r['value']} {r['unit']} @ {ts_str}")
+    def enable(self):
+        with self._lock:
+            self._entries.clear()
+            self.enabled = self.max_entries > 0
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] += 1
+
+    def get(self, key, tables, compute):
+        """Return the cached result for `key`, or compute() it from `tables` and remember it."""
+        if not self.enabled:
+            return compute()
+        with self._lock:
+            generations = tuple(self._generations[t] for t in tables)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generations:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            self.stale += entry is not None
+        value = compute()
+        with self._lock:
+            self._entries[key] = (generations, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"enabled": self.enabled, "entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "stale": self.stale, "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                    "generations": dict(self._generations)}
+
+
+result_cache = ResultCache()
+
+
+METADATA_BLOCKS = ("company", "location", "device_type", "device")
+METADATA_REF_COLUMNS = ("company_ref", "location_ref", "device_type_ref", "device_ref")
+
+
+class RawEventCodec:
+    """
+    Compact storage for the raw event log.
+
+    Every webhook repeats the same company, location, device_type and device
+    blocks. In "compact" mode each block is content-hashed and interned once in
+    `event_metadata`; the event row keeps only integer references plus the rest
+    of the payload as zlib-compressed JSON in `body` (`raw_json` is left empty).
+    The block positions are kept as nulls in the body so decoding restores the
+    original key order. Rows written in "raw" mode, or by older versions, carry
+    the JSON text in `raw_json` and are returned as-is.
+    """
+
+    def __init__(self, mode=EVENT_STORAGE, level=EVENT_COMPRESSION_LEVEL):
+        self.mode = mode
+        self.level = level
+        self._lock = threading.Lock()
+        self._ids = {}     # block hash -> event_metadata.id (committed rows only)
+        self._blocks = {}  # event_metadata.id -> block JSON text
+
+    def encode(self, c, payload, pending, raw=None):
+        """
+        Column values (raw_json, body, *refs) for one event. `raw` is the request body the
+        payload was parsed from; raw mode stores it verbatim instead of re-encoding. Newly
+        interned blocks are collected in `pending` and only become visible to other
+        batches via commit().
+        """
+        if self.mode != "compact":
+            return ((raw if raw is not None else json_dumps(payload)).decode(), None, None, None, None, None)
+        body = dict(payload)
+        refs = []
+        for key in METADATA_BLOCKS:
+            block = payload.get(key)
+            if isinstance(block, dict):
+                body[key] = None
+                refs.append(self._intern(c, block, pending))
+            else:
+                refs.append(None)
+        data = zlib.compress(json_dumps(body), self.level)
+        return ("", data, *refs)
+
+    def _intern(self, c, block, pending):
+        data = json_dumps(block)
+        text = data.decode()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        ref = self._ids.get(digest) or pending.get(digest)
+        if ref is None:
+            c.execute("INSERT OR IGNORE INTO event_metadata (hash, block) VALUES (?, ?)", (digest, text))
+            ref = c.execute("SELECT id FROM event_metadata WHERE hash = ?", (digest,)).fetchone()[0]
+            pending[digest] = ref
+        return ref
+
+    def commit(self, pending):
+        if pending:
+            with self._lock:
+                self._ids.update(pending)
+
+    def decode(self, conn, row):
+        """Rebuild the original webhook payload from an events row."""
+        if row["body"] is None:
+            return json_loads(row["raw_json"])
+        payload = json_loads(zlib.decompress(row["body"]))
+        for key, column in zip(METADATA_BLOCKS, METADATA_REF_COLUMNS):
+            if row[column] is not None:
+                payload[key] = json_loads(self._block(conn, row[column]))
+        return payload
+
+    def decode_json(self, conn, row):
+        """The payload as JSON text, without a decode/encode round trip for raw rows."""
+        if row["body"] is None:
+            return row["raw_json"]
+        return json_dumps(self.decode(conn, row)).decode()
+
+    def _block(self, conn, ref):
+        text = self._blocks.get(ref)
+        if text is None:
+            text = conn.execute("SELECT block FROM event_metadata WHERE id = ?", (ref,)).fetchone()[0]
+            with self._lock:
+                self._blocks[ref] = text
+        return text
+
+
+event_codec = RawEventCodec()
+
+
+class DedupFilter:
+    """
+    Drops redelivered webhooks. Uplinks are keyed on (device_id, fcnt, timestamp), so
+    copies relayed by several gateways collapse into one; other events on their
+    correlation_id. The webhook handler checks a bounded LRU of recently admitted keys
+    (O(1), no database access); the unique index on events.dedup_key catches whatever
+    falls outside that window, e.g. retries that straddle a restart.
+    """
+
+    def __init__(self, capacity=DEDUP_CACHE_SIZE, ttl=DEDUP_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()  # key -> monotonic expiry, oldest first
+        self.duplicates = {}        # event_type -> copies dropped by the in-memory check
+        self.db_duplicates = 0      # copies that reached the writer and hit the unique index
+
+    @staticmethod
+    def key(payload):
+        """16-byte digest identifying the delivery, or None if the event carries no usable id."""
+        ed = payload.get("event_data")
+        if not isinstance(ed, dict):
+            return None
+        if payload.get("event_type") == "uplink" and ed.get("fcnt") is not None and ed.get("timestamp"):
+            ident = f"uplink:{ed.get('device_id')}:{ed['fcnt']}:{ed['timestamp']}"
+        elif ed.get("correlation_id"):
+            ident = f"{payload.get('event_type')}:{ed['correlation_id']}"
+        else:
+            return None
+        return hashlib.blake2b(ident.encode(), digest_size=16).digest()
+
+    def load(self, conn):
+        """Seed the window with the most recently stored keys."""
+        rows = conn.execute(
+            "SELECT dedup_key FROM events WHERE dedup_key IS NOT NULL ORDER BY id DESC LIMIT ?",
+            (self.capacity,),
+        ).fetchall()
+        expiry = time.monotonic() + self.ttl
+        with self._lock:
+            self._seen = OrderedDict((row[0], expiry) for row in reversed(rows))
+
+    def admit(self, payload):
+        """Remember the payload's key; False if it was already admitted within the window."""
+        key = self.key(payload)
+        if key is None or self.capacity <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            expiry = self._seen.get(key)
+            if expiry is not None and expiry > now:
+                event_type = payload.get("event_type", "unknown")
+                self.duplicates[event_type] = self.duplicates.get(event_type, 0) + 1
+                return False
+            self._seen[key] = now + self.ttl
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.capacity or (self._seen and next(iter(self._seen.values())) <= now):
+                self._seen.popitem(last=False)
+        return True
+
+    def forget(self, payloads):
+        """Un-admit payloads that were never stored (queue full, write failed) so a retry gets in."""
+        with self._lock:
+            for payload in payloads:
+                self._seen.pop(self.key(payload), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked_keys": len(self._seen),
+                "capacity": self.capacity,
+                "ttl_seconds": self.ttl,
+                "duplicates": sum(self.duplicates.values()),
+                "duplicates_by_type": dict(self.duplicates),
+                "db_duplicates": self.db_duplicates,
+            }
+
+
+dedup = DedupFilter()
+
+
+class LiveFeedFull(Exception):
+    """COGNITUV_LIVE_MAX_SUBSCRIBERS subscriptions are already open."""
+
+
+def _live_message(event_type, payload, device_id, **fields):
+    return {"event_type": event_type, "device_id": device_id,
+            "thing_name": payload.get("device", {}).get("thing_name"),
+            "location": payload.get("location", {}).get("name"),
+            "company": payload.get("company", {}).get("name"), **fields}
+
+
+def _live_key(message):
+    # What "coalesce" keeps one message per: a device channel, an alert rule, a gateway
+    event_type = message["event_type"]
+    if event_type == "uplink":
+        return event_type, message["device_id"], message["channel"]
+    if event_type == "alert":
+        return event_type, message["device_id"], message["sensor_id"], message["rule_id"]
+    return event_type, message["device_id"]
+
+
+class LiveSubscription:
+    """
+    One consumer of the live feed: its filters and a bounded buffer.
+
+    The ingest path never waits for a subscriber. When the buffer holds `max_queue`
+    messages, "drop_oldest" discards the oldest one; "coalesce" keeps only the newest
+    message per device channel, alert rule and gateway, so a slow consumer still ends
+    up with the current state of everything it watches. Dropped messages are counted.
+    """
+
+    POLICIES = ("drop_oldest", "coalesce")
+
+    def __init__(self, feed, loop, device_ids=None, location=None, sensor_types=None, event_types=None,
+                 policy="drop_oldest", max_queue=LIVE_QUEUE_SIZE):
+        if policy not in self.POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(self.POLICIES)}")
+        unknown = set(event_types or ()) - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"unknown event type(s) {', '.join(sorted(unknown))}; use {', '.join(EVENT_TYPES)}")
+        self.feed = feed
+        self.device_ids = set(device_ids) if device_ids else None
+        self.location = location.lower() if location else None
+        self.sensor_types = set(sensor_types) if sensor_types else None
+        self.event_types = set(event_types) if event_types else None
+        self.policy = policy
+        self.max_queue = max(1, max_queue)
+        self._loop = loop
+        self._buffer = OrderedDict() if policy == "coalesce" else deque()
+        self._ready = asyncio.Event()
+        self._wake_pending = False
+        self._registered = False
+        self.closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def matches(self, message):
+        if self.event_types is not None and message["event_type"] not in self.event_types:
+            return False
+        if self.device_ids is not None and message["device_id"] not in self.device_ids:
+            return False
+        if self.location is not None and self.location not in (message.get("location") or "").lower():
+            return False
+        # Alerts and pings carry no sensor type; combine with event_type=uplink for readings only
+        if (self.sensor_types is not None and message["event_type"] == "uplink"
+                and message["sensor_type"] not in self.sensor_types):
+            return False
+        return True
+
+    def _offer(self, message):
+        # Called with the feed lock held, possibly from the ingest writer thread
+        buffer = self._buffer
+        if self.policy == "coalesce":
+            key = _live_key(message)
+            if key in buffer:
+                buffer.move_to_end(key)
+                self.coalesced += 1
+            buffer[key] = message
+            if len(buffer) > self.max_queue:
+                buffer.popitem(last=False)
+                self.dropped += 1
+        else:
+            buffer.append(message)
+            if len(buffer) > self.max_queue:
+                buffer.popleft()
+                self.dropped += 1
+
+    def _wake(self):
+        # At most one wakeup in flight per subscriber, however many batches arrive meanwhile
+        if self._wake_pending:
+            return
+        self._wake_pending = True
+        try:
+            self._loop.call_soon_threadsafe(self._set_ready)
+        except RuntimeError:
+            self.closed = True  # the consumer's event loop is gone
+
+    def _set_ready(self):
+        self._wake_pending = False
+        self._ready.set()
+
+    async def get(self):
+        """Wait for messages and return everything buffered, oldest first; None once closed."""
+        while True:
+            self._ready.clear()
+            with self.feed._lock:
+                if self._buffer:
+                    messages = list(self._buffer.values() if self.policy == "coalesce" else self._buffer)
+                    self._buffer.clear()
+                    self.delivered += len(messages)
+                    return messages
+                if self.closed:
+                    return None
+            await self._ready.wait()
+
+    def close(self):
+        self.feed._remove(self)
+        with self.feed._lock:
+            self.closed = True
+            self._wake()
+
+
+class LiveFeed:
+    """
+    In-process publish/subscribe bus for newly stored readings, alerts and pings.
+
+    store_events() publishes every committed batch, after the in-memory caches have been
+    updated, so a consumer that re-reads on a message already sees the new data. Messages
+    are only built while someone is subscribed. Consumers are asyncio tasks (/stream, MCP
+    resource notifications, the relay to workers); publishing is safe from the ingest
+    writer thread and only ever appends to their bounded buffers.
+    """
+
+    def __init__(self, max_subscribers=LIVE_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._by_device = {}   # device_id -> subscriptions filtering on it
+        self._unfiltered = []  # subscriptions without a device filter
+        self.subscribers = 0
+        self.published = 0
+        self.seq = 0
+
+    @property
+    def active(self):
+        return self.subscribers > 0
+
+    def subscribe(self, **filters):
+        """Open a subscription for the running event loop; see LiveSubscription for the filters."""
+        subscription = LiveSubscription(self, asyncio.get_running_loop(), **filters)
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                raise LiveFeedFull(f"{self.subscribers} live subscriptions already open")
+            if subscription.device_ids is None:
+                self._unfiltered.append(subscription)
+            for device_id in subscription.device_ids or ():
+                self._by_device.setdefault(device_id, []).append(subscription)
+            subscription._registered = True
+            self.subscribers += 1
+        return subscription
+
+    def _remove(self, subscription):
+        with self._lock:
+            if not subscription._registered:
+                return
+            subscription._registered = False
+            if subscription.device_ids is None:
+                self._unfiltered.remove(subscription)
+            for device_id in subscription.device_ids or ():
+                subscribers = self._by_device[device_id]
+                subscribers.remove(subscription)
+                if not subscribers:
+                    del self._by_device[device_id]
+            self.subscribers -= 1
+
+    def publish(self, messages):
+        """Hand a batch of messages to every matching subscriber without blocking."""
+        with self._lock:
+            woken = set()
+            for message in messages:
+                self.seq += 1
+                message["seq"] = self.seq
+                for subscription in (*self._unfiltered, *self._by_device.get(message["device_id"], ())):
+                    if subscription.matches(message):
+                        subscription._offer(message)
+                        woken.add(subscription)
+            self.published += len(messages)
+            for subscription in woken:
+                subscription._wake()
+
+    def close(self):
+        """End every subscription, e.g. at shutdown so open /stream responses finish."""
+        with self._lock:
+            subscriptions = set(self._unfiltered).union(*self._by_device.values())
+        for subscription in subscriptions:
+            subscription.close()
+
+    def stats(self):
+        with self._lock:
+            subscriptions = set(self._unfiltered).union(*self._by_device.values())
+            return {
+                "subscribers": self.subscribers,
+                "published": self.published,
+                "delivered": sum(s.delivered for s in subscriptions),
+                "dropped": sum(s.dropped for s in subscriptions),
+                "coalesced": sum(s.coalesced for s in subscriptions),
+            }
+
+
+live_feed = LiveFeed()
+
+# Decodes uplinks that arrive with a raw payload but no readings; keeps each device's codec session
+raw_decoder = payload_codecs.BatchDecoder()
+
+
+def store_events(conn, payloads, raw_bodies=None, store_raw=True):
+    """
+    Write a batch of webhook payloads in a single transaction and return how many were stored.
+    Readings, alerts and pings are each written with one executemany(), and the latest-value
+    tables are updated once per (device, channel) touched. Raw events are inserted one by
+    one so that duplicates (unique dedup_key) are skipped along with their derived rows.
+    `raw_bodies`, when given, holds the request body bytes each payload was parsed from.
+    With `store_raw=False` (replaying the events table itself) no events rows are written.
+    Uplinks without readings are decoded from their raw payload when a codec is registered.
+    """
+    readings, alerts, pings = [], [], []
+    duplicates = 0
+    interned = {}
+    seen_devices = {}
+    latest = {}
+    count_deltas = {}
+    active_alerts = 0
+    stored_types = Counter()
+    uplink_readings = []
+    rollup = {}  # finest resolution only; coarser buckets are folded from it at write time
+    feed = [] if live_feed.active else None
+    started = time.perf_counter()
+    with conn:
+        c = conn.cursor()
+        for i, payload in enumerate(payloads):
+            event_type = payload.get("event_type", "unknown")
+            stored_types[event_type] += 1
+            if store_raw:
+                raw = raw_bodies[i] if raw_bodies else None
+                c.execute("""
+                INSERT INTO events (event_type, raw_json, body, company_ref, location_ref, device_type_ref,
+                                    device_ref, dedup_key)
+                VALUES (?,?,?,?,?,?,?,?)
+                ON CONFLICT DO NOTHING
+                """, (event_type, *event_codec.encode(c, payload, interned, raw), dedup.key(payload)))
+                if c.rowcount == 0:
+                    duplicates += 1
+                    stored_types[event_type] -= 1
+                    continue
+
+            if event_type == "uplink":
+                device_id = device_registry.observe(payload, seen_devices)
+                values = payload.get("event_data", {}).get("payload")
+                if not values:
+                    values = (raw_decoder.readings(payload) if DECODE_RAW_PAYLOADS == "missing" else None) or []
+                uplink_readings.append(len(values))
+                for reading in values:
+                    row = (
+                        device_id,
+                        reading.get("sensor_id"),
+                        reading.get("name"),
+                        reading.get("type"),
+                        reading.get("value"),
+                        reading.get("unit"),
+                        reading.get("channel"),
+                        reading.get("timestamp"),
+                    )
+                    readings.append(row)
+                    count_deltas.setdefault(device_id, [0, 0])[0] += 1
+                    if feed is not None:
+                        feed.append(_live_message("uplink", payload, device_id, channel=row[6], sensor_type=row[3],
+                                                  name=row[2], value=row[4], unit=row[5], ts=row[7]))
+                    channel, ts = row[6], row[7]
+                    if channel is None or ts is None:
+                        continue
+                    current = latest.get((device_id, channel))
+                    if current is None or ts >= current[7]:
+                        latest[(device_id, channel)] = row
+                    _accumulate_rollup(rollup, row)
+
+            elif event_type == "alert":
+                device_id = device_registry.observe(payload, seen_devices)
+                ed = payload.get("event_data", {})
+                alerts.append((
+                    device_id,
+                    ed.get("sensorId"),
+                    ed.get("ruleId"),
+                    ed.get("title"),
+                    1 if ed.get("triggered") else 0,
+                    str(ed.get("value", "")),
+                    ed.get("timestamp"),
+                ))
+                count_deltas.setdefault(device_id, [0, 0])[1] += 1
+                if feed is not None:
+                    feed.append(_live_message("alert", payload, device_id, sensor_id=ed.get("sensorId"),
+                                              rule_id=ed.get("ruleId"), title=ed.get("title"),
+                                              triggered=bool(ed.get("triggered")), value=ed.get("value"),
+                                              ts=ed.get("timestamp")))
+
+            elif event_type == "ping":
+                ed = payload.get("event_data", {})
+                device = payload.get("device", {})
+                gateway_id = ed.get("device_id", str(device.get("id", "")))
+                ts = ed.get("timestamp") or int(time.time() * 1000)
+                pings.append((gateway_id, device.get("thing_name"), ts))
+                if feed is not None:
+                    feed.append(_live_message("ping", payload, gateway_id, ts=ts))
+
+        device_registry.flush(c, seen_devices)
+        if readings:
+            c.executemany("""
+            INSERT INTO sensor_readings (device_id, sensor_id, name, type, value, unit, channel, ts)
+            VALUES (?,?,?,?,?,?,?,?)
+            """, readings)
+        if alerts:
+            c.executemany("""
+            INSERT INTO alerts (device_id, sensor_id, rule_id, title, triggered, value, ts)
+            VALUES (?,?,?,?,?,?,?)
+            """, alerts)
+            # The single writer inserts the batch under consecutive ids
+            first_id = c.execute("SELECT last_insert_rowid()").fetchone()[0] - len(alerts) + 1
+            active_alerts = _track_alerts(c, alerts, first_id)
+        if pings:
+            _track_gateways(c, pings)
+        if latest:
+            c.executemany("""
+            INSERT INTO latest_readings (device_id, sensor_id, name, type, value, unit, channel, ts)
+            VALUES (?,?,?,?,?,?,?,?)
+            ON CONFLICT (device_id, channel) DO UPDATE SET
+                sensor_id = excluded.sensor_id, name = excluded.name, type = excluded.type,
+                value = excluded.value, unit = excluded.unit, ts = excluded.ts
+            WHERE excluded.ts >= latest_readings.ts
+            """, list(latest.values()))
+        if count_deltas:
+            c.executemany("""
+            INSERT INTO device_stats (device_id, reading_count, alert_count)
+            VALUES (?,?,?)
+            ON CONFLICT (device_id) DO UPDATE SET
+                reading_count = reading_count + excluded.reading_count,
+                alert_count = alert_count + excluded.alert_count
+            """, [(device_id, r, a) for device_id, (r, a) in count_deltas.items()])
+
+        if rollup:
+            for table, width in ROLLUPS.values():
+                _write_rollup(c, table, _coarsen_rollup(rollup, width))
+
+    metrics.observe("cognituv_db_commit_duration_seconds", time.perf_counter() - started)
+    event_codec.commit(interned)
+    device_registry.commit(seen_devices)
+    dedup.db_duplicates += duplicates
+    for event_type, stored in stored_types.items():
+        if stored:
+            metrics.inc("cognituv_events_stored_total", stored, event_type=event_type)
+    if uplink_readings:
+        metrics.observe("cognituv_uplink_readings", *uplink_readings)
+    latest_cache.apply(
+        [_latest_row(row) for row in latest.values()],
+        count_deltas,
+        active_alerts,
+    )
+    # A last_seen refresh is not counted as a devices change: cached listings read it from device_registry
+    written = [table for table, rows in (("devices", seen_devices.get("upserts")), ("sensor_readings", readings),
+                                         ("alerts", alerts), ("gateway_pings", pings)) if rows]
+    if written:
+        result_cache.bump(*written)
+    if feed:
+        live_feed.publish(feed)
+    return len(payloads) - duplicates
+
+
+def _alert_ts(ts):
+    """Alert timestamps arrive as epoch-ms strings or numbers; missing ones become the receipt time."""
+    try:
+        return int(ts)
+    except (TypeError, ValueError):
+        return int(time.time() * 1000)
+
+
+def _track_alerts(c, alerts, first_id):
+    """
+    Fold a batch of alerts into alert_state and return the change in currently triggered rules.
+    Alerts older than a rule's current state only extend its first_triggered_ts; the state
+    itself follows the newest alert (rebuild_alert_state replays the history in time order).
+    """
+    batch = {}
+    for alert_id, (device_id, sensor_id, rule_id, title, triggered, value, ts) in enumerate(alerts, first_id):
+        batch.setdefault((device_id, rule_id or "", sensor_id or ""), []).append(
+            (_alert_ts(ts), alert_id, title, triggered, value))
+
+    delta = 0
+    rows = []
+    for key, changes in batch.items():
+        state = c.execute("""
+        SELECT title, triggered, value, first_triggered_ts, last_change_ts, last_ts, trigger_count, alert_id
+        FROM alert_state WHERE device_id = ? AND rule_id = ? AND sensor_id = ?
+        """, key).fetchone()
+        state = list(state) if state is not None else None
+        delta -= state[1] if state else 0
+        for ts, alert_id, title, triggered, value in sorted(changes):
+            if state is None:
+                state = [title, triggered, value, ts if triggered else None, ts, ts, triggered, alert_id]
+                continue
+            if triggered and (state[3] is None or ts < state[3]):
+                state[3] = ts
+            if ts < state[5]:
+                continue
+            if triggered != state[1]:
+                state[4] = ts
+                state[6] += triggered
+            state[0:3] = title, triggered, value
+            state[5], state[7] = ts, alert_id
+        delta += state[1]
+        rows.append((*key, *state))
+
+    c.executemany("""
+    INSERT OR REPLACE INTO alert_state (device_id, rule_id, sensor_id, title, triggered, value,
+                                        first_triggered_ts, last_change_ts, last_ts, trigger_count, alert_id)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    """, rows)
+    return delta
+
+
+def _track_gateways(c, pings):
+    """Fold a batch of pings into gateway_state and keep the raw rows COGNITUV_PING_HISTORY asks for."""
+    pings.sort(key=lambda p: p[2])
+    keep = [True] * len(pings)
+    if PING_HISTORY == "off":
+        keep = [False] * len(pings)
+    elif PING_HISTORY == "sampled":
+        gateways = list({p[0] for p in pings})
+        last_sampled = dict(c.execute(
+            f"SELECT device_id, last_sampled_ts FROM gateway_state WHERE device_id IN ({','.join('?' * len(gateways))})",
+            gateways,
+        ).fetchall())
+        window_ms = PING_SAMPLE_SECONDS * 1000
+        for i, (device_id, _, ts) in enumerate(pings):
+            previous = last_sampled.get(device_id)
+            keep[i] = previous is None or ts - previous >= window_ms
+            if keep[i]:
+                last_sampled[device_id] = ts
+
+    now_ms = int(time.time() * 1000)
+    # One upsert per ping, in ts order, so the rolling inter-arrival average sees every gap.
+    # SET expressions read the pre-update row, so last_ping_ts below is the previous ping.
+    c.executemany(f"""
+    INSERT INTO gateway_state (device_id, thing_name, first_ping_ts, last_ping_ts, ping_count,
+                               last_sampled_ts, status, status_changed_ts)
+    VALUES (?1, ?2, ?3, ?3, 1, ?4, 'online', ?5)
+    ON CONFLICT (device_id) DO UPDATE SET
+        thing_name = COALESCE(excluded.thing_name, thing_name),
+        ping_count = ping_count + 1,
+        first_ping_ts = MIN(first_ping_ts, excluded.first_ping_ts),
+        avg_interval_ms = CASE
+            WHEN excluded.last_ping_ts <= last_ping_ts THEN avg_interval_ms
+            WHEN avg_interval_ms IS NULL THEN excluded.last_ping_ts - last_ping_ts
+            ELSE avg_interval_ms + {PING_INTERVAL_SMOOTHING} * (excluded.last_ping_ts - last_ping_ts - avg_interval_ms)
+        END,
+        last_sampled_ts = COALESCE(excluded.last_sampled_ts, last_sampled_ts),
+        status_changed_ts = CASE
+            WHEN excluded.last_ping_ts > last_ping_ts AND status != 'online' THEN excluded.status_changed_ts
+            ELSE status_changed_ts
+        END,
+        status = CASE WHEN excluded.last_ping_ts > last_ping_ts THEN 'online' ELSE status END,
+        last_ping_ts = MAX(last_ping_ts, excluded.last_ping_ts)
+    """, [(device_id, thing_name, ts, ts if kept else None, now_ms)
+          for (device_id, thing_name, ts), kept in zip(pings, keep)])
+
+    raw = [p for p, kept in zip(pings, keep) if kept]
+    if raw:
+        c.executemany("INSERT INTO gateway_pings (device_id, thing_name, ts) VALUES (?,?,?)", raw)
+
+
+_FINEST_ROLLUP_WIDTH = min(width for _, width in ROLLUPS.values())
+
+
+def _accumulate_rollup(rollup, row):
+    """Fold one reading into the batch's partial aggregates at the finest rollup resolution."""
+    device_id, _, name, type_, value, unit, channel, ts = row
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return
+    key = (device_id, channel, ts - ts % _FINEST_ROLLUP_WIDTH)
+    agg = rollup.get(key)
+    if agg is None:
+        rollup[key] = [type_, name, unit, value, value, value, 1, value, ts]
+        return
+    if value < agg[3]:
+        agg[3] = value
+    if value > agg[4]:
+        agg[4] = value
+    agg[5] += value
+    agg[6] += 1
+    if ts >= agg[8]:
+        agg[7], agg[8] = value, ts
+
+
+def _coarsen_rollup(rollup, width):
+    """Merge finest-resolution partial aggregates into `width`-ms buckets (first seen keeps type/name/unit)."""
+    if width == _FINEST_ROLLUP_WIDTH:
+        return rollup
+    out = {}
+    for (device_id, channel, bucket), fine in rollup.items():
+        key = (device_id, channel, bucket - bucket % width)
+        agg = out.get(key)
+        if agg is None:
+            out[key] = list(fine)
+            continue
+        agg[3] = min(agg[3], fine[3])
+        agg[4] = max(agg[4], fine[4])
+        agg[5] += fine[5]
+        agg[6] += fine[6]
+        if fine[8] >= agg[8]:
+            agg[7], agg[8] = fine[7], fine[8]
+    return out
+
+
+def _write_rollup(c, table, buckets):
+    c.executemany(f"""
+    INSERT INTO {table} (device_id, channel, bucket, type, name, unit,
+                         min_value, max_value, sum_value, count, last_value, last_ts)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT (device_id, channel, bucket) DO UPDATE SET
+        type = excluded.type, name = excluded.name, unit = excluded.unit,
+        min_value = MIN(min_value, excluded.min_value),
+        max_value = MAX(max_value, excluded.max_value),
+        sum_value = sum_value + excluded.sum_value,
+        count = count + excluded.count,
+        last_value = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_value ELSE last_value END,
+        last_ts = MAX(last_ts, excluded.last_ts)
+    """, [key + tuple(agg) for key, agg in buckets.items()])
+
+
+def _latest_row(row):
+    device_id, sensor_id, name, type_, value, unit, channel, ts = row
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)  # REAL column affinity
+    return {"device_id": device_id, "channel": channel, "sensor_id": sensor_id, "name": name,
+            "type": type_, "value": value, "unit": unit, "ts": ts}
+
+
+def store_events_direct(payloads, raw_bodies=None):
+    """Write payloads synchronously on the shared writer connection (COGNITUV_INGEST_MODE=direct)."""
+    with db.writer() as conn:
+        return store_events(conn, payloads, raw_bodies)
+
+
+_STOP = object()
+
+
+class IngestWriter:
+    """
+    Background writer for the batched ingest mode.
+
+    The webhook handler only validates and enqueues payloads; a dedicated thread
+    drains the queue and commits up to `batch_size` events per transaction, waiting
+    at most `flush_interval` seconds for a batch to fill. A full queue is reported
+    back to the caller so the handler can apply backpressure.
+    """
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                 max_queue=INGEST_QUEUE_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="cognituv-ingest-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, payload, raw=None):
+        """Enqueue a payload (and its raw body) without blocking. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait((payload, raw))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def stop(self, timeout=30.0):
+        """Flush everything still queued and stop the writer thread."""
+        if not self._thread or not self._thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        return {
+            "mode": INGEST_MODE,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            with db.writer() as conn:
+                self._flush(conn, batch)
+
+    def _flush(self, conn, batch):
+        payloads = [payload for payload, _ in batch]
+        raw_bodies = [raw for _, raw in batch]
+        try:
+            store_events(conn, payloads, raw_bodies)
+            self.written += len(batch)
+            self.batches += 1
+            return
+        except Exception:
+            logger.exception("Batch write of %d events failed, retrying one by one", len(batch))
+
+        # Isolate the bad payload(s) so one malformed event doesn't drop the whole batch
+        for payload, raw in batch:
+            try:
+                store_events(conn, [payload], [raw])
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                dedup.forget([payload])
+                logger.exception("Dropping unprocessable %s event", payload.get("event_type", "unknown"))
+        self.batches += 1
+
+
+ingest_writer = IngestWriter()
+
+
+class RetentionManager:
+    """
+    Background pruning of the append-only history tables.
+
+    Rows older than the per-table TTL are deleted oldest-first in chunks of
+    `chunk_size`, each chunk in its own short write transaction, so the ingest
+    writer is never locked out for long. Expired raw events can be archived to
+    date-partitioned compressed JSONL files (ARCHIVE_DIR/events/YYYY-MM-DD.jsonl.gz)
+    before they are deleted. Freed pages are returned to the filesystem with
+    incremental vacuum and the WAL is truncated after each run.
+    """
+
+    def __init__(self, events_days=RETENTION_EVENTS_DAYS, readings_days=RETENTION_READINGS_DAYS,
+                 pings_days=RETENTION_PINGS_DAYS, interval=PRUNE_INTERVAL,
+                 chunk_size=PRUNE_CHUNK_SIZE, archive_dir=ARCHIVE_DIR,
+                 compression=ARCHIVE_COMPRESSION):
+        self.events_days = events_days
+        self.readings_days = readings_days
+        self.pings_days = pings_days
+        self.interval = interval
+        self.chunk_size = max(1, chunk_size)
+        self.archive_dir = archive_dir
+        self.compression = compression
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_deleted = {}
+        self.total_deleted = {"events": 0, "sensor_readings": 0, "gateway_pings": 0}
+        self.archived = 0
+
+    @property
+    def enabled(self):
+        return any(days > 0 for days in (self.events_days, self.readings_days, self.pings_days))
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cognituv-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Retention run failed")
+            self._stop.wait(self.interval)
+
+    def enable_auto_vacuum(self):
+        """Switch an existing database to incremental auto-vacuum (one full VACUUM)."""
+        with db.writer() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return
+            logger.info("Converting %s to incremental auto_vacuum; this rewrites the database once", db.db_file)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+    def run_once(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        deleted = {}
+        if self.events_days > 0:
+            cutoff = (now - timedelta(days=self.events_days)).strftime("%Y-%m-%d %H:%M:%S")
+            deleted["events"] = self._prune_events(cutoff)
+        if self.readings_days > 0:
+            cutoff_ms = int((now - timedelta(days=self.readings_days)).timestamp() * 1000)
+            max_id = None
+            if columnar.enabled:
+                # Only readings already in the Parquet tier may leave SQLite: below the boundary
+                # and not newer than the export (late readings wait for the next run)
+                with db.reader() as conn:
+                    cutoff_ms = min(cutoff_ms, columnar.boundary(conn) or 0)
+                    max_id = columnar.exported_max_id(conn) or 0
+            deleted["sensor_readings"] = self._prune_readings(cutoff_ms, max_id)
+        if self.pings_days > 0:
+            cutoff_ms = int((now - timedelta(days=self.pings_days)).timestamp() * 1000)
+            deleted["gateway_pings"] = self._prune_by_ts("gateway_pings", cutoff_ms)
+
+        if any(deleted.values()):
+            with db.writer() as conn:
+                conn.execute("PRAGMA incremental_vacuum")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for table, count in deleted.items():
+            self.total_deleted[table] += count
+        self.last_deleted = deleted
+        self.last_run = now.isoformat()
+        return deleted
+
+    def _prune_events(self, cutoff):
+        total = 0
+        while not self._stop.is_set():
+            with db.writer() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM events WHERE received_at < ? ORDER BY id LIMIT ?",
+                    (cutoff, self.chunk_size),
+                ).fetchall()
+                if not rows:
+                    break
+                if self.archive_dir:
+                    self._archive(conn, rows)
+                with conn:
+                    conn.executemany("DELETE FROM events WHERE id = ?", [(r["id"],) for r in rows])
+            total += len(rows)
+        return total
+
+    def _prune_readings(self, cutoff_ms, max_id=None):
+        total = 0
+        bound, params = ("", (cutoff_ms,)) if max_id is None else (" AND id <= ?", (cutoff_ms, max_id))
+        while not self._stop.is_set():
+            with db.writer() as conn:
+                ids = [r[0] for r in conn.execute(
+                    f"SELECT id FROM sensor_readings WHERE ts < ?{bound} LIMIT ?", (*params, self.chunk_size))]
+                if not ids:
+                    break
+                placeholders = ",".join("?" * len(ids))
+                # Keep device_stats.reading_count equal to the rows actually retained
+                per_device = conn.execute(
+                    f"SELECT device_id, COUNT(*) FROM sensor_readings WHERE id IN ({placeholders}) GROUP BY device_id",
+                    ids,
+                ).fetchall()
+                with conn:
+                    conn.execute(f"DELETE FROM sensor_readings WHERE id IN ({placeholders})", ids)
+                    conn.executemany(
+                        "UPDATE device_stats SET reading_count = MAX(reading_count - ?, 0) WHERE device_id = ?",
+                        [(n, device_id) for device_id, n in per_device],
+                    )
+                latest_cache.apply([], {device_id: [-n, 0] for device_id, n in per_device})
+                result_cache.bump("sensor_readings")
+            total += len(ids)
+        return total
+
+    def _prune_by_ts(self, table, cutoff_ms):
+        total = 0
+        while not self._stop.is_set():
+            with db.writer() as conn:
+                with conn:
+                    cur = conn.execute(
+                        f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE ts < ? LIMIT ?)",
+                        (cutoff_ms, self.chunk_size),
+                    )
+            if cur.rowcount <= 0:
+                break
+            total += cur.rowcount
+        return total
+
+    def _archive(self, conn, rows):
+        """Append rows to their day's archive file; stored JSON text is embedded without re-encoding."""
+        by_day = {}
+        for r in rows:
+            line = (f'{{"id":{r["id"]},"event_type":{json.dumps(r["event_type"])},'
+                    f'"received_at":"{r["received_at"]}","event":{event_codec.decode_json(conn, r)}}}\n')
+            by_day.setdefault(r["received_at"][:10], []).append(line)
+        folder = Path(self.archive_dir) / "events"
+        folder.mkdir(parents=True, exist_ok=True)
+        for day, lines in by_day.items():
+            data = "".join(lines).encode()
+            if self.compression == "zstd":
+                import zstandard  # optional dependency, only needed for zstd archives
+                path, data = folder / f"{day}.jsonl.zst", zstandard.ZstdCompressor().compress(data)
+            else:
+                path, data = folder / f"{day}.jsonl.gz", gzip.compress(data)
+            # Each append is a complete gzip member / zstd frame, so files stay readable as one stream
+            with open(path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.archived += len(rows)
+
+    def storage_stats(self):
+        """Database size on disk and the oldest row retained in each history table."""
+        size = {}
+        for suffix in ("", "-wal"):
+            try:
+                size[f"db{suffix.replace('-', '_')}_bytes"] = os.path.getsize(db.db_file + suffix)
+            except OSError:
+                size[f"db{suffix.replace('-', '_')}_bytes"] = 0
+        with db.reader() as conn:
+            oldest_event = conn.execute("SELECT received_at FROM events ORDER BY id LIMIT 1").fetchone()
+            oldest_reading = conn.execute("SELECT MIN(ts) FROM sensor_readings").fetchone()[0]
+            oldest_ping = conn.execute("SELECT MIN(ts) FROM gateway_pings").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            **size,
+            "free_pages": free_pages,
+            "oldest_event_received_at": oldest_event[0] if oldest_event else None,
+            "oldest_reading_ts": _ts_iso(oldest_reading) if oldest_reading is not None else None,
+            "oldest_ping_ts": _ts_iso(oldest_ping) if oldest_ping is not None else None,
+            "retention_days": {"events": self.events_days, "sensor_readings": self.readings_days,
+                               "gateway_pings": self.pings_days},
+            "last_prune": self.last_run,
+            "last_deleted": self.last_deleted,
+            "total_deleted": self.total_deleted,
+            "archived_events": self.archived,
+        }
+
+
+retention = RetentionManager()
+
+
+class ColumnarStore:
+    """
+    Optional Parquet tier for sensor_readings, queried with DuckDB (COGNITUV_PARQUET_DIR).
+
+    A background job exports every closed UTC day (older than the grace period) to
+    PARQUET_DIR/sensor_readings/date=YYYY-MM-DD/*.parquet, sorted by device and time so
+    row-group statistics skip other devices' readings. columnar_state
+    records the boundary: readings with ts < boundary_ts are read from Parquet, newer ones
+    from SQLite, so the tools can merge the two without double counting. Readings that
+    arrive late for an exported day (id > max_id) are appended on the next run. Files are
+    tagged with the run number (export_run + 1); files of a run whose state update never
+    committed carry a tag above export_run and are cleared before the next one. Values
+    that are not numbers (e.g. 'open') are stored as NULL. Once this tier is enabled,
+    retention only prunes readings below the boundary that are not newer than max_id.
+    """
+
+    COLUMNS = {"id": "BIGINT", "device_id": "VARCHAR", "sensor_id": "VARCHAR", "name": "VARCHAR",
+               "type": "VARCHAR", "value": "DOUBLE", "unit": "VARCHAR", "channel": "INTEGER", "ts": "BIGINT"}
+    # sensor_readings.value holds whatever the payload sent: staged as text, cast in DuckDB
+    STAGING = {**COLUMNS, "value": "VARCHAR"}
+    FETCH_SIZE = 50_000
+
+    def __init__(self, directory=PARQUET_DIR, interval=PARQUET_EXPORT_INTERVAL, grace_hours=PARQUET_GRACE_HOURS):
+        self.directory = directory
+        self.interval = interval
+        self.grace_ms = int(grace_hours * 3_600_000)
+        self._stop = threading.Event()
+        self._thread = None
+        self._duckdb = None
+        self._duckdb_lock = threading.Lock()
+        self.last_run = None
+        self.last_exported = 0
+        self.queries = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    @property
+    def readings_dir(self):
+        return Path(self.directory) / "sensor_readings"
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cognituv-columnar", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.export_once()
+            except Exception:
+                logger.exception("Parquet export failed")
+            self._stop.wait(self.interval)
+
+    def boundary(self, conn):
+        """Readings with ts below this are served from Parquet; None until the first export."""
+        if not self.enabled:
+            return None
+        row = conn.execute("SELECT boundary_ts FROM columnar_state WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def exported_max_id(self, conn):
+        """Highest sensor_readings id already in Parquet; None until the first export."""
+        if not self.enabled:
+            return None
+        row = conn.execute("SELECT max_id FROM columnar_state WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def export_once(self, now_ms=None):
+        """Export newly closed days and late readings; returns the number of rows written."""
+        now_ms = now_ms or int(time.time() * 1000)
+        closed = (now_ms - self.grace_ms) // 86_400_000 * 86_400_000
+        with db.reader() as conn:
+            state = conn.execute("SELECT boundary_ts, max_id, export_run FROM columnar_state WHERE id = 1").fetchone()
+            prev_boundary, prev_max_id, committed_run = tuple(state) if state else (None, 0, 0)
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sensor_readings").fetchone()[0]
+        boundary = max(closed, prev_boundary or 0)
+        if boundary == prev_boundary and max_id == prev_max_id:
+            return 0
+
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        # Files of a run that crashed before its state update carry a run tag that was never committed
+        run = committed_run + 1
+        for path in self.readings_dir.glob("*/run*_*.parquet"):
+            tag = path.name[3:].partition("_")[0]
+            if tag.isdigit() and int(tag) > committed_run:
+                path.unlink()
+
+        columns = ", ".join(self.COLUMNS)
+        queries = []
+        if prev_boundary is None:
+            queries.append((f"SELECT {columns} FROM sensor_readings WHERE ts < ? AND id <= ?", (boundary, max_id)))
+        else:
+            queries.append((f"SELECT {columns} FROM sensor_readings INDEXED BY idx_readings_ts "
+                            f"WHERE ts >= ? AND ts < ? AND id <= ?", (prev_boundary, boundary, max_id)))
+            queries.append((f"SELECT {columns} FROM sensor_readings WHERE id > ? AND id <= ? AND ts < ?",
+                            (prev_max_id, max_id, prev_boundary)))
+
+        exported = 0
+        with tempfile.NamedTemporaryFile("w", newline="", suffix=".csv", dir=self.directory) as staging:
+            writer = csv.writer(staging)
+            with db.reader() as conn:
+                for query, params in queries:
+                    cursor = conn.execute(query, params)
+                    while rows := cursor.fetchmany(self.FETCH_SIZE):
+                        writer.writerows(rows)
+                        exported += len(rows)
+            staging.flush()
+            if exported:
+                self.readings_dir.mkdir(parents=True, exist_ok=True)
+                column_types = ", ".join(f"'{name}': '{kind}'" for name, kind in self.STAGING.items())
+                select = ", ".join(f"TRY_CAST({name} AS {kind}) AS {name}" if self.STAGING[name] != kind else name
+                                   for name, kind in self.COLUMNS.items())
+                with self._duckdb_lock:
+                    self._connection().execute(f"""
+                        COPY (
+                            SELECT {select}, strftime(make_timestamp(ts * 1000), '%Y-%m-%d') AS date
+                            FROM read_csv('{staging.name}', header = false, columns = {{{column_types}}})
+                            ORDER BY device_id, ts
+                        ) TO '{self.readings_dir}'
+                        (FORMAT parquet, PARTITION_BY (date), APPEND,
+                         FILENAME_PATTERN 'run{run}_{{uuid}}')
+                    """)
+
+        with db.writer() as conn:
+            with conn:
+                conn.execute("""
+                    INSERT INTO columnar_state (id, boundary_ts, max_id, exported_rows, updated_at, export_run)
+                    VALUES (1, ?, ?, ?, datetime('now'), ?)
+                    ON CONFLICT(id) DO UPDATE SET boundary_ts = excluded.boundary_ts, max_id = excluded.max_id,
+                        exported_rows = exported_rows + excluded.exported_rows, updated_at = excluded.updated_at,
+                        export_run = excluded.export_run
+                """, (boundary, max_id, exported, run))
+        self.last_run = datetime.now(timezone.utc).isoformat()
+        self.last_exported = exported
+        return exported
+
+    def mark_rebuilt(self, conn):
+        """
+        After replay.py --rebuild: rebuilt readings get new ids, but the days below the
+        boundary are already in Parquet, so treat every current row as exported.
+        """
+        conn.execute("UPDATE columnar_state SET max_id = (SELECT COALESCE(MAX(id), 0) FROM sensor_readings)")
+
+    def _connection(self):
+        if self._duckdb is None:
+            import duckdb  # optional dependency, only needed with COGNITUV_PARQUET_DIR
+            self._duckdb = duckdb.connect()
+        return self._duckdb
+
+    def query(self, sql, params=(), timeout=QUERY_TIME_BUDGET):
+        """
+        Run `sql` against the exported readings, available as the view `cold_readings`.
+        Returns a list of dicts. A statement still running after `timeout` seconds is
+        interrupted and raises TimeoutError.
+        """
+        def rows(cursor):
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return self._execute(sql, params, timeout, rows) or []
+
+    def query_arrays(self, sql, params=(), timeout=QUERY_TIME_BUDGET):
+        """Like query(), but returns {column: numpy array} (None before the first export)."""
+        return self._execute(sql, params, timeout, lambda cursor: cursor.fetchnumpy())
+
+    def _execute(self, sql, params, timeout, fetch):
+        if next(self.readings_dir.glob("*/*.parquet"), None) is None:
+            return None
+        source = (f"read_parquet('{self.readings_dir}/*/*.parquet', hive_partitioning = true, "
+                  f"hive_types = {{'date': DATE}})")
+        with self._duckdb_lock:
+            cursor = self._connection().cursor()
+        try:
+            cursor.execute(f"CREATE TEMP VIEW cold_readings AS SELECT * FROM {source}")
+            timer = threading.Timer(timeout, cursor.interrupt)
+            timer.start()
+            try:
+                cursor.execute(sql, list(params))
+                result = fetch(cursor)
+            except Exception as e:
+                if not timer.is_alive():
+                    raise TimeoutError(f"Parquet query exceeded {timeout:g}s") from e
+                raise
+            finally:
+                timer.cancel()
+        finally:
+            cursor.close()
+        self.queries += 1
+        return result
+
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        with db.reader() as conn:
+            state = conn.execute("SELECT * FROM columnar_state WHERE id = 1").fetchone()
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "boundary": _ts_iso(state["boundary_ts"]) if state else None,
+            "exported_rows": state["exported_rows"] if state else 0,
+            "last_export": self.last_run,
+            "last_exported_rows": self.last_exported,
+            "queries": self.queries,
+        }
+
+
+columnar = ColumnarStore()
+
+
+class GatewaySweeper:
+    """
+    Background sweep that flags gateways whose last ping is older than the stale/offline
+    thresholds. Ingest marks a gateway online again as soon as a newer ping arrives; the
+    sweep only touches gateway_state rows whose status actually changes.
+    """
+
+    STATUS_ORDER = ("offline", "stale", "online")
+
+    def __init__(self, stale_seconds=GATEWAY_STALE_SECONDS, offline_seconds=GATEWAY_OFFLINE_SECONDS,
+                 interval=GATEWAY_SWEEP_INTERVAL):
+        self.stale_seconds = stale_seconds
+        self.offline_seconds = max(offline_seconds, stale_seconds)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cognituv-gateway-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Gateway sweep failed")
+            self._stop.wait(self.interval)
+
+    def run_once(self, now=None):
+        """Apply the thresholds as of `now`; returns [(device_id, thing_name, new status), ...]."""
+        now = now or datetime.now(timezone.utc)
+        now_ms = int(now.timestamp() * 1000)
+        status = """CASE
+            WHEN last_ping_ts < ?1 THEN 'offline'
+            WHEN last_ping_ts < ?2 THEN 'stale'
+            ELSE 'online'
+        END"""
+        with db.writer() as conn:
+            with conn:
+                changed = conn.execute(f"""
+                    UPDATE gateway_state SET status = {status}, status_changed_ts = ?3
+                    WHERE status != {status}
+                    RETURNING device_id, thing_name, status
+                """, (now_ms - int(self.offline_seconds * 1000), now_ms - int(self.stale_seconds * 1000),
+                      now_ms)).fetchall()
+        for device_id, thing_name, new_status in changed:
+            logger.info("Gateway %s (%s) is now %s", thing_name, device_id, new_status)
+        self.last_run = now.isoformat()
+        return [tuple(row) for row in changed]
+
+    def stats(self):
+        with db.reader() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM gateway_state GROUP BY status").fetchall())
+        stats = {status: counts.get(status, 0) for status in self.STATUS_ORDER}
+        stats["last_sweep"] = self.last_run
+        return stats
+
+
+gateway_sweeper = GatewaySweeper()
+
+
+EVENT_TYPES = ("uplink", "alert", "ping")
+
+
+class MqttSubscriber:
+    """
+    Persistent MQTT subscription feeding the same path as POST /webhook: parse with the
+    shared codec, drop duplicates, then hand the payload to the ingest writer, which
+    commits in batches. Runs as an asyncio task in the server's event loop.
+
+    The session is persistent (fixed client id, clean_session=False), so QoS 1 messages
+    published while the server is down are delivered on reconnect. At most
+    `max_inflight` received messages wait in the client; when the writer queue is full
+    the subscriber stops reading instead of dropping messages, and the broker holds the rest.
+
+    Requires the optional `aiomqtt` package (>= 2.0).
+    """
+
+    def __init__(self, host=MQTT_HOST, port=MQTT_PORT, topics=MQTT_TOPICS, qos=MQTT_QOS,
+                 username=MQTT_USERNAME, password=MQTT_PASSWORD, client_id=MQTT_CLIENT_ID,
+                 max_inflight=MQTT_MAX_INFLIGHT, reconnect_interval=MQTT_RECONNECT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.topics = list(topics)
+        self.qos = qos
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self.max_inflight = max_inflight
+        self.reconnect_interval = reconnect_interval
+        self._task = None
+        self.connected = False
+        self.received = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.backpressure_waits = 0
+
+    @property
+    def enabled(self):
+        return bool(self.host)
+
+    def start(self):
+        if self.enabled and not (self._task and not self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self.run(), name="cognituv-mqtt")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.connected = False
+
+    async def run(self):
+        import aiomqtt  # optional dependency, only needed when MQTT ingest is enabled
+
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    self.host, self.port, username=self.username, password=self.password,
+                    identifier=self.client_id, clean_session=False,
+                    max_queued_incoming_messages=self.max_inflight,
+                ) as client:
+                    for topic in self.topics:
+                        await client.subscribe(topic, qos=self.qos)
+                    self.connected = True
+                    logger.info("MQTT subscribed to %s on %s:%d", ", ".join(self.topics), self.host, self.port)
+                    async for message in client.messages:
+                        await self.handle(str(message.topic), message.payload)
+            except aiomqtt.MqttError as e:
+                self.connected = False
+                self.reconnects += 1
+                logger.warning("MQTT connection to %s:%d lost (%s); retrying in %gs",
+                               self.host, self.port, e, self.reconnect_interval)
+                await asyncio.sleep(self.reconnect_interval)
+
+    async def handle(self, topic, body):
+        """Process one message; returns "queued", "stored", "duplicate", "invalid" or "error"."""
+        self.received += 1
+        if isinstance(body, str):
+            body = body.encode()
+        elif isinstance(body, (bytearray, memoryview)):
+            body = bytes(body)
+        try:
+            payload = json_loads(body)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            self.invalid += 1
+            logger.warning("Ignoring MQTT message on %s: not a JSON object", topic)
+            return "invalid"
+        if "event_type" not in payload:
+            # e.g. .../uplink topics whose messages omit the type; the stored body must then include it
+            suffix = topic.rsplit("/", 1)[-1]
+            payload["event_type"] = suffix if suffix in EVENT_TYPES else "unknown"
+            body = None
+
+        if not dedup.admit(payload):
+            self.duplicates += 1
+            return "duplicate"
+        self.accepted += 1
+        if INGEST_MODE == "direct":
+            try:
+                await run_in_threadpool(store_events_direct, [payload], [body])
+            except Exception:
+                # Keep consuming; forgetting the key lets a redelivery of this message be stored
+                self.errors += 1
+                metrics.inc("cognituv_ingest_errors_total", stage="mqtt")
+                dedup.forget([payload])
+                logger.exception("Failed to store MQTT message on %s", topic)
+                return "error"
+            return "stored"
+        while ingest_writer.queue.full():
+            self.backpressure_waits += 1
+            await asyncio.sleep(ingest_writer.flush_interval or 0.01)
+        ingest_writer.submit(payload, body)
+        return "queued"
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "connected": self.connected,
+            "broker": f"{self.host}:{self.port}" if self.enabled else None,
+            "topics": self.topics,
+            "received": self.received,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+            "backpressure_waits": self.backpressure_waits,
+        }
+
+
+mqtt_subscriber = MqttSubscriber()
+
+
+async def ingest_event(payload, raw=None):
+    """
+    Admit one parsed webhook event. Returns "duplicate", "ok" (direct mode: stored),
+    "queued", or "full" when the writer queue has no room. Shared by /webhook and by
+    the writer process on behalf of workers.
+    """
+    if not dedup.admit(payload):
+        return "duplicate"
+    if INGEST_MODE == "direct":
+        try:
+            await run_in_threadpool(store_events_direct, [payload], [raw])
+        except Exception:
+            dedup.forget([payload])
+            raise
+        return "ok"
+    if not ingest_writer.submit(payload, raw):
+        dedup.forget([payload])
+        return "full"
+    return "queued"
+
+
+def store_bulk(payloads, raw_bodies):
+    """Deduplicate and store a bulk batch synchronously; returns (stored, duplicates)."""
+    admitted = [(payload, raw) for payload, raw in zip(payloads, raw_bodies) if dedup.admit(payload)]
+    if not admitted:
+        return 0, len(payloads)
+    try:
+        stored = store_events_direct([p for p, _ in admitted], [r for _, r in admitted])
+    except Exception:
+        dedup.forget([p for p, _ in admitted])
+        raise
+    return stored, len(payloads) - stored
+
+
+_FRAME_HEADER = struct.Struct(">cI")  # op byte, body length
+_LENGTH = struct.Struct(">I")
+
+
+async def _read_reply(reader):
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return json_loads(await reader.readexactly(length))
+
+
+class WriterUnavailable(Exception):
+    """The writer process could not be reached."""
+
+
+class WriterClient:
+    """
+    Worker side of the multi-process mode (COGNITUV_WRITER_SOCKET set).
+
+    Each uvicorn worker serves HTTP and MCP from its own read-only connections and
+    forwards every write to the single writer process (writer.py) over a Unix socket.
+    The writer applies the same dedup window, batching and backpressure as the
+    single-process server and replies with the outcome, so SQLite only ever sees one
+    writing process. Requests are an op byte, a 4-byte big-endian length and the body;
+    replies are a length-prefixed JSON document.
+    """
+
+    def __init__(self, path, connections=WRITER_CONNECTIONS, connect_timeout=WRITER_CONNECT_TIMEOUT):
+        self.path = path
+        self.connections = max(1, connections)
+        self.connect_timeout = connect_timeout
+        self._pool = None
+        self._relay = None
+        self.forwarded = 0
+        self.reconnects = 0
+        self.relay_reconnects = 0
+
+    async def connect(self):
+        """Open the connection pool, waiting up to connect_timeout for the writer to come up."""
+        self._pool = asyncio.Queue()
+        for _ in range(self.connections):
+            self._pool.put_nowait(await self._open(self.connect_timeout))
+
+    async def close(self):
+        if self._relay is not None:
+            self._relay.cancel()
+            self._relay = None
+        while self._pool is not None and not self._pool.empty():
+            connection = self._pool.get_nowait()
+            if connection is not None:
+                connection[1].close()
+        self._pool = None
+
+    async def _open(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                if time.monotonic() >= deadline:
+                    raise WriterUnavailable(f"writer socket {self.path}: {e}") from e
+                await asyncio.sleep(0.1)
+
+    async def _request(self, op, body):
+        connection = await self._pool.get()
+        try:
+            for attempt in (1, 2):
+                try:
+                    if connection is None:
+                        connection = await self._open(self.connect_timeout)
+                    reader, writer = connection
+                    writer.write(_FRAME_HEADER.pack(op, len(body)) + body)
+                    await writer.drain()
+                    reply = await asyncio.wait_for(_read_reply(reader), WRITER_REQUEST_TIMEOUT)
+                    break
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    # Reconnect once (the writer may have restarted); a replayed event is deduplicated
+                    if connection is not None:
+                        connection[1].close()
+                        connection = None
+                    if attempt == 2:
+                        raise WriterUnavailable(f"writer connection lost: {e}") from e
+                    self.reconnects += 1
+        finally:
+            self._pool.put_nowait(connection)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        self.forwarded += 1
+        return reply
+
+    async def submit(self, raw):
+        """Forward one webhook body; returns the same status as ingest_event()."""
+        return (await self._request(b"E", raw))["status"]
+
+    async def store_bulk(self, raw_bodies):
+        body = b"".join(_LENGTH.pack(len(raw)) + raw for raw in raw_bodies)
+        reply = await self._request(b"B", body)
+        return reply["stored"], reply["duplicates"]
+
+    async def stats(self):
+        return await self._request(b"S", b"")
+
+    def start_relay(self):
+        """Republish the writer's live feed in this worker; started by the first live subscriber."""
+        if self._relay is None or self._relay.done():
+            self._relay = asyncio.get_running_loop().create_task(self._run_relay())
+
+    async def _run_relay(self):
+        # A dedicated connection: after the W(atch) request the writer streams message batches
+        while True:
+            try:
+                reader, writer = await self._open(self.connect_timeout)
+                try:
+                    writer.write(_FRAME_HEADER.pack(b"W", 0))
+                    await writer.drain()
+                    while True:
+                        live_feed.publish(await _read_reply(reader))
+                finally:
+                    writer.close()
+            except (OSError, asyncio.IncompleteReadError, WriterUnavailable) as e:
+                self.relay_reconnects += 1
+                logger.warning("Live feed relay from the writer lost (%s), reconnecting", e)
+                await asyncio.sleep(1)
+
+
+writer_client = WriterClient(WRITER_SOCKET) if WRITER_SOCKET else None
+
+
+# ---------------------------------------------------------------------------
+# FastAPI application (webhook receiver)
+# ---------------------------------------------------------------------------
+app = FastAPI(
+    title="Cognituv Connect MCP Server",
+    description="Receives myDevices webhooks and exposes MCP tools for AI agents.",
+    version="1.0.0",
+    default_response_class=CodecJSONResponse,
+)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+async def start_services():
+    """Everything that writes: schema, in-process caches, ingest writer and background jobs."""
+    init_db()
+    if INGEST_MODE != "direct":
+        ingest_writer.start()
+    if retention.enabled:
+        await run_in_threadpool(retention.enable_auto_vacuum)
+        retention.start()
+    gateway_sweeper.start()
+    columnar.start()
+    mqtt_subscriber.start()
+
+
+async def stop_services():
+    await mqtt_subscriber.stop()
+    await run_in_threadpool(retention.stop)
+    await run_in_threadpool(gateway_sweeper.stop)
+    await run_in_threadpool(columnar.stop)
+    # Drain and commit whatever is still queued before the process exits
+    await run_in_threadpool(ingest_writer.stop)
+
+
+@app.on_event("startup")
+async def startup():
+    if writer_client is not None:
+        # Worker: the writer process owns the schema and the caches; tools read the tables
+        await writer_client.connect()
+        return
+    await start_services()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # End open /stream responses and MCP notifications before the services stop
+    live_feed.close()
+    await resource_notifier.stop()
+    if writer_client is not None:
+        await writer_client.close()
+    else:
+        await stop_services()
+    db.close()
+
+
+@app.get("/health")
+async def health():
+    """Health check endpoint."""
+    storage = await run_in_threadpool(retention.storage_stats)
+    columnar_stats = await run_in_threadpool(columnar.stats)
+    live_stats = {**live_feed.stats(), "mcp": resource_notifier.stats()}
+    if writer_client is not None:
+        try:
+            writer = await writer_client.stats()
+        except (WriterUnavailable, RuntimeError) as e:
+            writer = {"error": str(e)}
+        return {"status": "ok", "service": "cognituv-connect-mcp", "role": "worker", "pid": os.getpid(),
+                "db_pool": db.stats(), "storage": storage, "columnar": columnar_stats, "live": live_stats,
+                "writer": writer}
+    gateways = await run_in_threadpool(gateway_sweeper.stats)
+    return {"status": "ok", "service": "cognituv-connect-mcp", "ingest": ingest_writer.stats(),
+            "dedup": dedup.stats(), "mqtt": mqtt_subscriber.stats(), "db_pool": db.stats(),
+            "result_cache": result_cache.stats(), "storage": storage, "columnar": columnar_stats,
+            "live": live_stats, "gateways": gateways}
+
+
+def _scrape_samples():
+    """Gauges and counters owned by other components, read when /metrics is scraped."""
+    pool = db.stats()
+    samples = [
+        ("cognituv_db_wait_seconds_total", {"connection": "writer"}, round(db.writer_wait_seconds, 6)),
+        ("cognituv_db_wait_seconds_total", {"connection": "reader"}, round(db.reader_wait_seconds, 6)),
+        ("cognituv_db_checkouts_total", {"connection": "writer"}, pool["writer_checkouts"]),
+        ("cognituv_db_checkouts_total", {"connection": "reader"}, pool["reader_checkouts"]),
+        ("cognituv_result_cache_lookups_total", {"result": "hit"}, result_cache.hits),
+        ("cognituv_result_cache_lookups_total", {"result": "miss"}, result_cache.misses),
+        ("cognituv_live_subscribers", {}, live_feed.subscribers),
+    ]
+    for suffix in ("", "-wal"):
+        try:
+            size = os.path.getsize(db.db_file + suffix)
+        except OSError:
+            size = 0
+        samples.append(("cognituv_db_size_bytes", {"file": "db" + suffix.replace("-", "_")}, size))
+    gateways = gateway_sweeper.stats()
+    samples += [("cognituv_gateways", {"status": status}, gateways[status]) for status in GatewaySweeper.STATUS_ORDER]
+    if writer_client is None:
+        # Ingest runs in this process (in multi-worker mode these live in the writer, see /health)
+        dedup_stats, ingest = dedup.stats(), ingest_writer.stats()
+        samples += [("cognituv_events_duplicate_total", {"stage": "filter", "event_type": event_type}, n)
+                    for event_type, n in dedup_stats["duplicates_by_type"].items()]
+        samples += [
+            ("cognituv_events_duplicate_total", {"stage": "database"}, dedup_stats["db_duplicates"]),
+            ("cognituv_ingest_errors_total", {"stage": "writer"}, ingest["failed"]),
+            ("cognituv_ingest_queue_depth", {}, ingest["queue_depth"]),
+        ]
+    if latest_cache.loaded:
+        readings, active_alerts = latest_cache.totals()
+        samples += [("cognituv_db_rows", {"table": "sensor_readings"}, readings),
+                    ("cognituv_db_rows", {"table": "devices"}, device_registry.count()),
+                    ("cognituv_active_alerts", {}, active_alerts)]
+    return samples
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of ingest, latency and database metrics."""
+    samples = await run_in_threadpool(_scrape_samples)
+    return PlainTextResponse(metrics.render(samples), media_type="text/plain; version=0.0.4")
+
+
+def _check_secret(request):
+    """Optional: validate the shared secret header."""
+    if WEBHOOK_SECRET:
+        auth = request.headers.get("x-api") or request.headers.get("authorization")
+        if auth != WEBHOOK_SECRET:
+            metrics.inc("cognituv_events_rejected_total", reason="unauthorized")
+            raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+def _timed(histogram, **labels):
+    """Record each call of an async endpoint in `histogram`, whether it returns or raises."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            finally:
+                metrics.observe(histogram, time.perf_counter() - started, **labels)
+        return timed
+    return decorate
+
+
+@app.post("/webhook")
+@_timed("cognituv_webhook_duration_seconds", endpoint="/webhook")
+async def receive_webhook(request: Request):
+    """
+    Receives webhook events from myDevices (Cognituv Connect platform).
+    Supports event types: uplink, alert, ping.
+    """
+    _check_secret(request)
+
+    # Read the body once: it is parsed here and, in raw storage mode, stored byte-for-byte
+    body = await request.body()
+    try:
+        payload = json_loads(body)
+    except ValueError:
+        metrics.inc("cognituv_events_rejected_total", reason="invalid_json")
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(payload, dict):
+        metrics.inc("cognituv_events_rejected_total", reason="not_an_object")
+        raise HTTPException(status_code=400, detail="Webhook body must be a JSON object")
+
+    event_type = payload.get("event_type", "unknown")
+
+    # Redeliveries are acknowledged as "duplicate" so myDevices stops retrying
+    try:
+        if writer_client is not None:
+            status = await writer_client.submit(body)
+        else:
+            status = await ingest_event(payload, body)
+    except WriterUnavailable:
+        metrics.inc("cognituv_events_rejected_total", reason="writer_unavailable")
+        raise HTTPException(status_code=503, detail="Writer unavailable, retry later", headers={"Retry-After": "1"})
+    except Exception as e:
+        metrics.inc("cognituv_ingest_errors_total", stage="webhook")
+        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
+    if status == "full":
+        metrics.inc("cognituv_events_rejected_total", reason="queue_full")
+        raise HTTPException(status_code=503, detail="Ingest queue full, retry later",
+                            headers={"Retry-After": "1"})
+    return {"status": status, "event_type": event_type}
+
+
+@app.post("/webhook/bulk")
+@_timed("cognituv_webhook_duration_seconds", endpoint="/webhook/bulk")
+async def receive_webhook_bulk(request: Request):
+    """
+    Bulk import of webhook events as NDJSON (one event per line) or a JSON array.
+    The body is parsed as it streams in and committed in transactions of
+    COGNITUV_BULK_BATCH_SIZE events, bypassing the ingest queue; duplicates are
+    dropped as on /webhook. Responds with per-upload counts and throughput.
+    """
+    _check_secret(request)
+
+    stream = EventStream()
+    started = time.perf_counter()
+    counts = {"received": 0, "stored": 0, "duplicates": 0}
+    batch, bodies = [], []
+    next_progress = BULK_PROGRESS_EVERY
+
+    async def flush():
+        nonlocal next_progress
+        if not batch:
+            return
+        try:
+            if writer_client is not None:
+                stored, duplicates = await writer_client.store_bulk(bodies)
+            else:
+                stored, duplicates = await run_in_threadpool(store_bulk, list(batch), list(bodies))
+        except Exception as e:
+            metrics.inc("cognituv_ingest_errors_total", len(batch), stage="webhook")
+            raise HTTPException(status_code=500, detail=f"Processing error after {counts['stored']} "
+                                                        f"stored events: {e}")
+        counts["stored"] += stored
+        counts["duplicates"] += duplicates
+        batch.clear()
+        bodies.clear()
+        if counts["received"] >= next_progress:
+            elapsed = time.perf_counter() - started
+            logger.info("Bulk import: %d events received, %d stored (%.0f events/s)",
+                        counts["received"], counts["stored"], counts["received"] / elapsed)
+            next_progress += BULK_PROGRESS_EVERY
+
+    async def accept(items):
+        for payload, raw in items:
+            counts["received"] += 1
+            batch.append(payload)
+            bodies.append(raw)
+            if len(batch) >= BULK_BATCH_SIZE:
+                await flush()
+
+    async for chunk in request.stream():
+        await accept(stream.feed(chunk))
+    await accept(stream.close())
+    await flush()
+    if stream.invalid:
+        metrics.inc("cognituv_events_rejected_total", stream.invalid, reason="invalid_json")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "status": "ok",
+        "format": stream.format,
+        **counts,
+        "invalid": stream.invalid,
+        "errors": stream.errors,
+        "elapsed_s": round(elapsed, 3),
+        "events_per_sec": round(counts["received"] / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def _split_param(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+
+@app.get("/stream")
+async def live_stream(
+    device_id: Optional[str] = None,
+    location: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    event_type: Optional[str] = None,
+    policy: str = "drop_oldest",
+    max_queue: int = LIVE_QUEUE_SIZE,
+):
+    """
+    Server-Sent Events feed of newly stored readings (event `uplink`, one per channel),
+    alerts and gateway pings, instead of polling the tools. device_id, sensor_type and
+    event_type take comma-separated lists; location matches part of the location name.
+    A consumer that falls `max_queue` messages behind loses the oldest ones, or with
+    policy=coalesce keeps the newest per channel; losses are announced as `dropped` events.
+    """
+    try:
+        subscription = live_feed.subscribe(
+            device_ids=_split_param(device_id), location=location, sensor_types=_split_param(sensor_type),
+            event_types=_split_param(event_type), policy=policy, max_queue=min(max_queue, LIVE_QUEUE_SIZE))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LiveFeedFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    if writer_client is not None:
+        writer_client.start_relay()
+
+    async def events():
+        reported = 0
+        try:
+            yield b": connected\n\n"
+            while True:
+                try:
+                    messages = await asyncio.wait_for(subscription.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if messages is None:
+                    return
+                chunk = []
+                if subscription.dropped > reported:
+                    chunk.append(b"event: dropped\ndata: " + json_dumps({"dropped": subscription.dropped - reported})
+                                 + b"\n\n")
+                    reported = subscription.dropped
+                for m in messages:
+                    chunk.append(b"id: %d\nevent: %s\ndata: %s\n\n"
+                                 % (m["seq"], m["event_type"].encode(), json_dumps(m)))
+                yield b"".join(chunk)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------------------------------------------------------------------------
+# MCP Server (tools for AI agents)
+# ---------------------------------------------------------------------------
+mcp = FastMCP(
+    name="cognituv-connect",
+    instructions="""You are the Cognituv Connect AI assistant. You have access to real-time
+    IoT sensor data from facilities monitored by Cognituv Connect. You can list devices,
+    query sensor readings, check alerts, and analyze facility conditions. Always present
+    data clearly with units and timestamps. Follow the Identify - Apply - Verify methodology.""",
+)
+
+
+def _instrumented(tool):
+    """
+    Time every call of a tool, count the calls that raise and feed the slow query log.
+    Applied below @mcp.tool() on every tool, so the wrapper is what gets registered.
+    """
+    name = tool.__name__
+    parameters = list(inspect.signature(tool).parameters)
+
+    @functools.wraps(tool)
+    def call(*args, **kwargs):
+        tracing = slow_query_log.enabled
+        if tracing:
+            slow_query_log.start()
+        started = time.perf_counter()
+        try:
+            return tool(*args, **kwargs)
+        except Exception:
+            metrics.inc("cognituv_tool_errors_total", tool=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe("cognituv_tool_duration_seconds", elapsed, tool=name)
+            if tracing:
+                slow_query_log.finish(name, {**dict(zip(parameters, args)), **kwargs}, elapsed)
+    return call
+
+
+# ---------------------------------------------------------------------------
+# Tool output formats
+# ---------------------------------------------------------------------------
+OUTPUT_FORMATS = ("markdown", "compact", "json")
+COMPACT_MAX_FACTORED = 64  # distinct keys a repeated column may be factored into a header line by
+
+
+def _is_time_column(column):
+    # Columns holding epoch milliseconds
+    return column in ("ts", "bucket") or column.endswith("_ts")
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.replace("\t", " ").replace("\n", " ")
+    return str(value)
+
+
+def _time_cell(value, previous):
+    if value is None:
+        return ""
+    value = int(value)
+    if previous is None:
+        return _ts_iso(value)
+    seconds = (value - previous) / 1000
+    return f"{int(seconds):+d}" if seconds.is_integer() else f"{seconds:+}"
+
+
+def _render_compact(title, columns, rows, labels, notes, facts, page):
+    """
+    Tab-separated table. Columns with a single value, and label columns that are fully
+    determined by another label column (a unit by sensor name, a device id by device name),
+    move into header lines; timestamps are the first row's time, then seconds relative
+    to the row above.
+    """
+    lines = [title, *notes, *(f"{key}: {_cell(value)}" for key, value in (facts or {}).items())]
+    table = list(columns)
+    for column in columns:
+        values = {r[column] for r in rows}
+        if rows and len(values) == 1:
+            value = values.pop()
+            lines.append(f"{column}: {_ts_iso(int(value)) if _is_time_column(column) and value is not None else _cell(value)}")
+            table.remove(column)
+    # Least preferred label first, each keyed by a more preferred one that then stays in the table
+    keys = set()
+    for i in reversed(range(len(labels) if rows else 0)):
+        column = labels[i]
+        if column not in table or column in keys:
+            continue
+        for key in labels[:i]:
+            if key not in table:
+                continue
+            mapping = {}
+            if all(mapping.setdefault(r[key], r[column]) == r[column] for r in rows) \
+                    and len(mapping) <= COMPACT_MAX_FACTORED:
+                lines.append(f"{column} by {key}: " + ", ".join(f"{_cell(k)}={_cell(v)}" for k, v in mapping.items()))
+                table.remove(column)
+                keys.add(key)
+                break
+    if table:
+        times = [c for c in table if _is_time_column(c)]
+        if times and len(rows) > 1:
+            lines.append(f"{', '.join(times)}: first row as ISO 8601, then seconds relative to the row above")
+        lines.append("\t".join(table))
+        previous = {}
+        for r in rows:
+            cells = []
+            for column in table:
+                if column in times:
+                    cells.append(_time_cell(r[column], previous.get(column)))
+                    previous[column] = None if r[column] is None else int(r[column])
+                else:
+                    cells.append(_cell(r[column]))
+            lines.append("\t".join(cells))
+    if page:
+        lines.append(_next_page(page))
     return "\n".join(lines)
 
 
+def _render_json(title, columns, rows, notes, facts, page):
+    document = {"title": title}
+    if notes:
+        document["notes"] = list(notes)
+    if facts:
+        document["facts"] = facts
+    document["columns"] = list(columns)
+    document["rows"] = [[r[c] for c in columns] for r in rows]
+    if page:
+        document["next_page"] = page
+    return json_dumps(document).decode()
+
+
+def _next_page(page):
+    return "Next page: " + ", ".join(f"{key}={value}" for key, value in page.items())
+
+
+def _summarize(columns, rows, limit=240):
+    """One clause per column describing rows that were left out of an answer, about `limit` chars at most."""
+    parts, length = [], 0
+    for column in columns:
+        values = [r[column] for r in rows if r[column] is not None]
+        if not values:
+            continue
+        if _is_time_column(column):
+            part = f"{column} {_ts_iso(int(min(values)))} to {_ts_iso(int(max(values)))}"
+        elif all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            part = f"{column} {min(values):g} to {max(values):g}"
+        else:
+            counts = Counter(values)
+            if len(counts) <= 3:
+                part = f"{column} " + ", ".join(f"{_cell(v)[:32]} ({n})" for v, n in counts.most_common())
+            else:
+                part = f"{len(counts)} distinct {column}"
+        if parts and length + len(part) > limit:
+            parts.append("...")
+            break
+        parts.append(part)
+        length += len(part) + 2
+    return "; ".join(parts)
+
+
+def _reduce_rows(rows, columns, keep, series, labels, max_chars):
+    """
+    Pick about `keep` rows. Time series are thinned evenly per series (rows sharing their
+    label values) and keep each series' lowest and highest value; other results keep their
+    first rows. Returns (rows, notes, cut) where `cut` says the answer now ends early, so a
+    paging cursor must continue after its last row.
+    """
+    n = len(rows)
+    if series and keep >= 1:
+        value_column = series[1]
+        groups = {}
+        for i, r in enumerate(rows):
+            groups.setdefault(tuple(r[c] for c in labels), []).append(i)
+        quota = max(1, keep // len(groups))
+        picks = set()
+        for members in groups.values():
+            evenly = min(quota, len(members))
+            picks.update(members[round(j * (len(members) - 1) / max(evenly - 1, 1))] for j in range(evenly))
+            numeric = [i for i in members if isinstance(rows[i][value_column], (int, float))]
+            if numeric:
+                picks.add(min(numeric, key=lambda i: rows[i][value_column]))
+                picks.add(max(numeric, key=lambda i: rows[i][value_column]))
+        kept = [rows[i] for i in sorted(picks)]
+        left_out = [r for i, r in enumerate(rows) if i not in picks]
+        return kept, [f"Downsampled to {len(kept)} of {n} rows to fit max_chars={max_chars}: evenly spaced per "
+                      f"series, plus each series' lowest and highest {value_column}. "
+                      f"Left out: {_summarize(columns, left_out)}."], False
+    return rows[:keep], [f"Showing the first {keep} of {n} rows to fit max_chars={max_chars}. "
+                         f"Left out: {_summarize(columns, rows[keep:])}."], True
+
+
+def _render(rows, columns, markdown, *, title, format="markdown", max_chars=None, labels=(), notes=(),
+            facts=None, page=None, more=False, series=None):
+    """
+    Render a tool's result rows in the requested output format.
+
+    `markdown(rows, notes)` builds the tool's own markdown. "compact" is a tab-separated
+    table (see _render_compact); "json" is {"title", "notes", "facts", "columns", "rows",
+    "next_page"} with raw values. `page(last_row)` returns the cursor for the next page,
+    shown when the result filled its limit (`more`) or was cut short. With `max_chars`, rows
+    are dropped until the answer fits instead of cutting it off: `series=(time column, value column)` results are
+    downsampled per series of equal `labels`, others keep their first rows, and a note
+    summarizes what was left out.
+    """
+    if format not in OUTPUT_FORMATS:
+        return f"Invalid format '{format}'. Use {', '.join(OUTPUT_FORMATS)}."
+
+    def build(subset, extra_notes, cut):
+        cursor = page(subset[-1]) if page and subset and (more or cut) else None
+        all_notes = [*notes, *extra_notes]
+        if format == "markdown":
+            text = markdown(subset, all_notes)
+            return text + "\n\n" + _next_page(cursor) if cursor else text
+        if format == "compact":
+            return _render_compact(title, columns, subset, labels, all_notes, facts, cursor)
+        return _render_json(title, columns, subset, all_notes, facts, cursor)
+
+    text = build(rows, [], False)
+    if not max_chars or len(text) <= max_chars or len(rows) <= 1:
+        return text
+    # Too many series to keep a few points of each falls back to the first rows
+    for mode in ((series, None) if series else (None,)):
+        low, high, best = 0, len(rows) - 1, None
+        while low <= high:
+            keep = (low + high) // 2
+            candidate = build(*_reduce_rows(rows, columns, keep, mode, labels, max_chars))
+            if len(candidate) <= max_chars:
+                best, low = candidate, keep + 1
+            else:
+                high = keep - 1
+        if best is not None and (mode is None or low > 1):
+            return best
+    # Even the bare header may not fit; it is still better than a cut-off answer
+    return best if best is not None else build(*_reduce_rows(rows, columns, 0, None, labels, max_chars))
+
+
+def _device_entry(r):
+    return (
+        f"- **{r['thing_name']}** (ID: {r['device_id']})\n"
+        f"  Type: {r['device_type_name']} | {r['manufacturer']} {r['model']}\n"
+        f"  Use: {r['sensor_use'] or 'N/A'}\n"
+        f"  Location: {r['location_name']}, {r['location_city']}, {r['location_state']}\n"
+        f"  Company: {r['company_name']} | Last seen: {r['last_seen']}"
+    )
+
+
+DEVICE_LISTING_COLUMNS = ("thing_name", "device_id", "device_type_name", "manufacturer", "model", "sensor_use",
+                          "location_name", "location_city", "location_state", "company_name", "last_seen")
+DEVICE_LISTING_LABELS = ("device_type_name", "manufacturer", "model", "location_name", "location_city",
+                         "location_state", "company_name")
+
+
+@mcp.tool()
+@_instrumented
+def list_devices(
+    company_name: Optional[str] = None,
+    location_name: Optional[str] = None,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """List all devices registered in Cognituv Connect. Optionally filter by company or location name. `format` is 'markdown', 'compact' (tab-separated, repeated values factored out) or 'json'; `max_chars` caps the answer size by listing fewer devices and summarizing the rest."""
+    def select():
+        query = "SELECT device_id, thing_name, sensor_use, device_type_name, manufacturer, model, company_name, location_name, location_city, location_state, last_seen FROM devices WHERE 1=1"
+        where, params = _name_filters(location_name, company_name)
+        if where:
+            query += f" AND {where}"
+        with db.reader() as conn:
+            return [dict(r) for r in conn.execute(query, params)]
+
+    rows = [{**r, "last_seen": device_registry.last_seen(r["device_id"], r["last_seen"])}
+            for r in result_cache.get(("list_devices", company_name, location_name), ("devices",), select)]
+    rows.sort(key=lambda r: r["last_seen"] or "", reverse=True)
+
+    if not rows:
+        return "No devices found matching the criteria."
+    title = f"Found {len(rows)} device(s)"
+
+    def markdown(rows, notes):
+        return "\n\n".join([f"{title}:", *notes, *map(_device_entry, rows)])
+
+    return _render(rows, DEVICE_LISTING_COLUMNS, markdown, title=title, format=format, max_chars=max_chars,
+                   labels=DEVICE_LISTING_LABELS)
+
+
+SEARCH_MIN_TERM = 3  # trigram index: shorter terms cannot be matched
+
+
+@mcp.tool()
+@_instrumented
+def search_devices(
+    query: str,
+    limit: int = 20,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """Find devices by fragments of their name, use (e.g. 'walk-in freezer'), model, manufacturer, location, city or company, best matches first. Every word of at least 3 characters must match somewhere, partial words included; when no device matches them all, devices matching any are listed. `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size by listing fewer devices and summarizing the rest."""
+    terms = [t for t in query.split() if len(t) >= SEARCH_MIN_TERM]
+    if not terms:
+        return f"Search terms need at least {SEARCH_MIN_TERM} characters."
+
+    def select(every):
+        columns = "d.device_id, " + ", ".join(f"d.{c}" for c in DEVICE_LISTING_COLUMNS if c != "device_id")
+        if DEVICE_SEARCH:
+            # Quoted terms are matched as substrings; bm25 ranks name and use matches above the rest
+            match = (" AND " if every else " OR ").join('"' + t.replace('"', '""') + '"' for t in terms)
+            weights = ", ".join(map(str, DEVICE_SEARCH_COLUMNS.values()))
+            sql = (f"SELECT {columns} FROM devices_fts f JOIN devices d ON d.rowid = f.rowid "
+                   f"WHERE devices_fts MATCH ? AND rank MATCH 'bm25({weights})' ORDER BY rank LIMIT ?")
+            params = [match, limit]
+        else:
+            any_column = "(" + " OR ".join(f"d.{c} LIKE ?" for c in DEVICE_SEARCH_COLUMNS) + ")"
+            sql = (f"SELECT {columns} FROM devices d WHERE {(' AND ' if every else ' OR ').join([any_column] * len(terms))} "
+                   "ORDER BY d.thing_name LIMIT ?")
+            params = [f"%{t}%" for t in terms for _ in DEVICE_SEARCH_COLUMNS] + [limit]
+        with db.reader() as conn:
+            return [dict(r) for r in conn.execute(sql, params)]
+
+    def ranked():
+        rows = select(every=True)
+        if rows or len(terms) == 1:
+            return rows, True
+        return select(every=False), False
+
+    rows, every = result_cache.get(("search_devices", tuple(terms), limit), ("devices",), ranked)
+    if not rows:
+        return f"No devices match '{query}'."
+    rows = [{**r, "last_seen": device_registry.last_seen(r["device_id"], r["last_seen"])} for r in rows]
+    title = f"Found {len(rows)} device(s) matching '{query}'"
+    if not every:
+        title += " (no device matches every term; showing devices that match any)"
+
+    def markdown(rows, notes):
+        return "\n\n".join([f"{title}:", *notes, *map(_device_entry, rows)])
+
+    return _render(rows, DEVICE_LISTING_COLUMNS, markdown, title=title, format=format, max_chars=max_chars,
+                   labels=DEVICE_LISTING_LABELS)
+
+
+@mcp.tool()
+@_instrumented
+def get_device_details(device_id: str, format: str = "markdown") -> str:
+    """Get full details for a specific device by its ID. `format` is 'markdown', 'compact' or 'json'."""
+    with db.reader() as conn:
+        row = conn.execute("SELECT * FROM devices WHERE device_id = ?", (device_id,)).fetchone()
+        if not row:
+            return f"Device {device_id} not found."
+
+        # Also get reading count and alert count
+        if latest_cache.loaded:
+            reading_count, alert_count = latest_cache.counts(device_id)
+        else:
+            stats = conn.execute("SELECT reading_count, alert_count FROM device_stats WHERE device_id = ?", (device_id,)).fetchone()
+            reading_count, alert_count = (stats["reading_count"], stats["alert_count"]) if stats else (0, 0)
+
+    details = dict(row, total_readings=reading_count, total_alerts=alert_count)
+
+    def markdown(rows, notes):
+        lines = [f"**Device: {row['thing_name']}**", *notes, ""]
+        for key, value in rows[0].items():
+            lines.append(f"- {key}: {value}")
+        return "\n".join(lines)
+
+    return _render([details], tuple(details), markdown, title=f"Device: {row['thing_name']}", format=format)
+
+
+@mcp.tool()
+@_instrumented
+def get_latest_readings(device_id: str, format: str = "markdown", max_chars: Optional[int] = None) -> str:
+    """Get the most recent sensor reading for each sensor channel on a device. `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size."""
+    if latest_cache.loaded:
+        rows = latest_cache.latest(device_id)
+    else:
+        with db.reader() as conn:
+            rows = conn.execute("""
+                SELECT name, type, value, unit, channel, ts
+                FROM latest_readings
+                WHERE device_id = ?
+                ORDER BY channel
+            """, (device_id,)).fetchall()
+
+    if not rows:
+        return f"No readings found for device {device_id}."
+
+    title = f"Latest readings for device {device_id}"
+
+    def markdown(rows, notes):
+        lines = [f"{title}:", *notes, ""]
+        for r in rows:
+            ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
+            lines.append(f"- **{r['name']}**: {r['value']} {r['unit']} (channel {r['channel']}, at {ts_str})")
+        return "\n".join(lines)
+
+    return _render(rows, ("channel", "name", "type", "value", "unit", "ts"), markdown, title=title, format=format,
+                   max_chars=max_chars, labels=("name", "type", "unit"))
+
+
+@mcp.tool()
+@_instrumented
+def get_reading_history(
+    device_id: str,
+    sensor_type: Optional[str] = None,
+    limit: int = 50,
+    before_ts: Optional[int] = None,
+    before_id: Optional[int] = None,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """Get historical sensor readings for a device. Optionally filter by sensor type (e.g., 'temp', 'rel_hum', 'co2', 'batt'). Returns up to `limit` most recent readings. To page further back, pass the `before_ts`/`before_id` cursor printed at the end of the previous page. `format` is 'markdown', 'compact' (tab-separated, units and names in a header, delta-encoded times; far fewer tokens) or 'json'. `max_chars` caps the answer size by downsampling the readings evenly (keeping the extremes) instead of cutting it off."""
+    query = "SELECT id, name, type, value, unit, channel, ts FROM sensor_readings WHERE device_id = ?"
+    params: list = [device_id]
+    if sensor_type:
+        query += " AND type = ?"
+        params.append(sensor_type)
+    query, params = _keyset_before(query, params, "ts", "id", before_ts, before_id)
+    with db.reader() as conn:
+        boundary = columnar.boundary(conn)
+        hot_query, hot_params = (query, params) if boundary is None else (query + " AND ts >= ?", [*params, boundary])
+        rows = conn.execute(hot_query + " ORDER BY ts DESC, id DESC LIMIT ?", [*hot_params, limit]).fetchall()
+    if boundary is not None and len(rows) < limit:
+        # Older pages continue in the Parquet tier; the keyset cursor works across both
+        cold_query = query.replace("sensor_readings", "cold_readings", 1) + " AND ts < ? ORDER BY ts DESC, id DESC LIMIT ?"
+        try:
+            rows += columnar.query(cold_query, [*params, boundary, limit - len(rows)])
+        except TimeoutError as e:
+            return f"{e}. Narrow it with sensor_type or a before_ts cursor."
+
+    if not rows:
+        return f"No readings found for device {device_id}" + (f" with type '{sensor_type}'" if sensor_type else "") + "."
+
+    title = f"Reading history for device {device_id}" + (f" (type: {sensor_type})" if sensor_type else "") + f" — {len(rows)} records"
+
+    def markdown(rows, notes):
+        lines = [f"{title}:", *notes, ""]
+        for r in rows:
+            ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
+            lines.append(f"- {r['name']}: {r['value']} {r['unit']} @ {ts_str}")
+        return "\n".join(lines)
+
+    return _render(rows, ("ts", "name", "value", "unit", "channel", "type"), markdown, title=title, format=format,
+                   max_chars=max_chars, labels=("name", "type", "channel", "unit"), series=("ts", "value"),
+                   page=lambda r: {"before_ts": r["ts"], "before_id": r["id"]}, more=len(rows) == limit)
+
+
+def _keyset_before(query, params, ts_col, id_col, before_ts, before_id):
+    """
+    Append a keyset-pagination predicate for pages ordered by (ts, id) DESC.
+
+    Seeking with a cursor stays an index range scan however deep the page is,
+    unlike OFFSET, which has to walk every skipped row.
+    """
+    if before_ts is not None and before_id is not None:
+        query += f" AND ({ts_col}, {id_col}) < (?, ?)"
+        params += [before_ts, before_id]
+    elif before_ts is not None:
+        query += f" AND {ts_col} < ?"
+        params.append(before_ts)
+    elif before_id is not None:
+        query += f" AND {id_col} < ?"
+        params.append(before_id)
+    return query, params
+
+
+_DURATION_UNITS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+# Candidate bucket widths for resolution="auto", finest first
+_AUTO_RESOLUTIONS = ["1m", "5m", "15m", "1h", "6h", "1d", "7d"]
+AGGREGATE_MAX_BUCKETS = 200  # per series, when resolution="auto"
+
+
+def _parse_time(value, default=None):
+    """Accept epoch milliseconds or an ISO 8601 timestamp; return epoch milliseconds."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if text.lstrip("-").isdigit():
+        return int(text)
+    dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def _parse_duration(text):
+    match = re.fullmatch(r"(\d+)\s*([mhd])", text.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid resolution '{text}'. Use e.g. '1m', '15m', '1h', '6h', '1d', '7d' or 'auto'.")
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _ts_iso(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat() if ms is not None else "N/A"
+
+
+@mcp.tool()
+@_instrumented
+def get_reading_aggregates(
+    device_id: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    resolution: str = "auto",
+    location_name: Optional[str] = None,
+    company_name: Optional[str] = None,
+    limit: int = 500,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """
+    Get downsampled sensor trends: min/max/avg/count/last per time bucket for each device and channel.
+    Much cheaper than get_reading_history for spotting trends over days or weeks.
+    Filter by device_id, sensor_type (e.g. 'temp'), location_name or company_name (partial matches).
+    `start`/`end` accept ISO 8601 timestamps or epoch milliseconds (default: the last 24 hours).
+    `resolution` is a bucket width such as '1m', '15m', '1h', '6h', '1d', '7d', or 'auto' to pick one
+    that keeps each series to a readable number of buckets. Returns at most `limit` buckets.
+    `format` is 'markdown', 'compact' (tab-separated, one header line per repeated value) or 'json';
+    `max_chars` caps the answer size by keeping fewer, evenly spaced buckets.
+    """
+    try:
+        end_ms = _parse_time(end, default=int(time.time() * 1000))
+        start_ms = _parse_time(start, default=end_ms - 86_400_000)
+    except ValueError as e:
+        return f"Invalid time range: {e}"
+    if start_ms >= end_ms:
+        return "Invalid time range: start must be before end."
+
+    if resolution == "auto":
+        span = end_ms - start_ms
+        resolution = next((r for r in _AUTO_RESOLUTIONS if span / _parse_duration(r) <= AGGREGATE_MAX_BUCKETS),
+                          _AUTO_RESOLUTIONS[-1])
+    try:
+        step = _parse_duration(resolution)
+    except ValueError as e:
+        return str(e)
+
+    # Serve from the coarsest rollup whose buckets tile the requested width exactly
+    table, width = max((t for t in ROLLUPS.values() if step % t[1] == 0), key=lambda t: t[1])
+
+    where = ["r.bucket >= ?", "r.bucket < ?"]
+    params: list = [(start_ms // width) * width, end_ms]
+    if device_id:
+        where.append("r.device_id = ?")
+        params.append(device_id)
+    if sensor_type:
+        where.append("r.type = ?")
+        params.append(sensor_type)
+    names, name_params = _name_filters(location_name, company_name, alias="d.")
+    if names:
+        where.append(names)
+        params += name_params
+
+    query = f"""
+        SELECT device_id, thing_name, channel, name, type, unit, bucket,
+               MIN(min_value) AS min_value, MAX(max_value) AS max_value,
+               SUM(sum_value) / SUM(count) AS avg_value, SUM(count) AS count,
+               MAX(CASE WHEN rn = 1 THEN last_value END) AS last_value
+        FROM (
+            SELECT r.device_id, d.thing_name, r.channel, r.name, r.type, r.unit,
+                   (r.bucket / {step}) * {step} AS bucket,
+                   r.min_value, r.max_value, r.sum_value, r.count, r.last_value,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY r.device_id, r.channel, r.bucket / {step} ORDER BY r.last_ts DESC
+                   ) AS rn
+            FROM {table} r LEFT JOIN devices d ON r.device_id = d.device_id
+            WHERE {" AND ".join(where)}
+        )
+        GROUP BY device_id, channel, bucket
+        ORDER BY thing_name, device_id, channel, bucket
+        LIMIT ?
+    """
+    params.append(limit)
+    with db.reader() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if not rows:
+        return "No readings found for the given filters and time range."
+
+    title = f"Reading aggregates ({resolution} buckets, {_ts_iso(start_ms)} to {_ts_iso(end_ms)}) — {len(rows)} buckets"
+    rows = [dict(r, avg_value=round(r["avg_value"], 2)) for r in rows]  # markdown prints 2 decimals too
+
+    def markdown(rows, notes):
+        lines = [f"{title}:", *notes]
+        series = None
+        for r in rows:
+            if (r["device_id"], r["channel"]) != series:
+                series = (r["device_id"], r["channel"])
+                lines.append("")
+                lines.append(f"**{r['thing_name'] or r['device_id']}** — {r['name']} ({r['type']}, {r['unit']}), channel {r['channel']}")
+            lines.append(
+                f"- {_ts_iso(r['bucket'])}: avg {r['avg_value']:.2f}, min {r['min_value']}, "
+                f"max {r['max_value']}, last {r['last_value']} (n={r['count']})"
+            )
+        return "\n".join(lines)
+
+    return _render(rows, ("bucket", "thing_name", "device_id", "channel", "name", "type", "unit", "avg_value",
+                          "min_value", "max_value", "last_value", "count"),
+                   markdown, title=title, format=format, max_chars=max_chars,
+                   labels=("thing_name", "device_id", "name", "type", "channel", "unit"),
+                   series=("bucket", "avg_value"))
+
+
 @mcp.tool()
-def get_event_log(event_type: Optional[str] = None, limit: int = 20) -> str:
-    """Get the raw event log. Optionally filter by event_type (uplink, alert, ping)."""
-    conn = get_db()
-    query = "SELECT id, event_type, received_at FROM events"
+@_instrumented
+def get_alerts(
+    device_id: Optional[str] = None,
+    triggered_only: bool = True,
+    limit: int = 25,
+    before_ts: Optional[int] = None,
+    before_id: Optional[int] = None,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """Get alerts. By default lists the alert rules currently triggered (one entry per device, rule and sensor, with when it became active and how often it has fired). Optionally filter by device_id. Set triggered_only=False for the full alert history, triggered and resolved. To page further back, pass the `before_ts`/`before_id` cursor printed at the end of the previous page. `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size by listing fewer alerts and summarizing the rest."""
+    if triggered_only:
+        # Current state only, so the cost follows the number of active alerts rather than the history
+        query = """SELECT a.alert_id AS id, a.device_id, d.thing_name, a.title, a.triggered, a.value, a.last_ts AS ts,
+                          a.last_change_ts AS since, a.trigger_count
+                   FROM alert_state a LEFT JOIN devices d ON a.device_id = d.device_id WHERE a.triggered = 1"""
+        ts_column, id_column = "a.last_ts", "a.alert_id"
+    else:
+        query = "SELECT a.id, a.device_id, d.thing_name, a.title, a.triggered, a.value, a.ts, a.received_at FROM alerts a LEFT JOIN devices d ON a.device_id = d.device_id WHERE 1=1"
+        ts_column, id_column = "a.ts", "a.id"
+    params: list = []
+    if device_id:
+        query += " AND a.device_id = ?"
+        params.append(device_id)
+    query, params = _keyset_before(query, params, ts_column, id_column, before_ts, before_id)
+    query += f" ORDER BY {ts_column} DESC, {id_column} DESC LIMIT ?"
+    params.append(limit)
+    with db.reader() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    if not rows:
+        return "No alerts found matching the criteria."
+
+    title = f"Found {len(rows)} active alert(s)" if triggered_only else f"Found {len(rows)} alert(s)"
+    rows = [dict(r, status="TRIGGERED" if r["triggered"] else "RESOLVED") for r in rows]
+
+    def iso(ts):
+        return datetime.fromtimestamp(int(ts) / 1000, tz=timezone.utc).isoformat() if ts else "N/A"
+
+    def markdown(rows, notes):
+        lines = [f"{title}:", *notes, ""]
+        for r in rows:
+            line = f"- [{r['status']}] **{r['title']}**\n  Device: {r['thing_name']} ({r['device_id']})\n  Value: {r['value']} | Time: {iso(r['ts'])}"
+            if triggered_only:
+                line += f" | Active since: {iso(r['since'])} | Triggered {r['trigger_count']} time(s)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    columns = ("ts", "status", "title", "thing_name", "device_id", "value")
+    if triggered_only:
+        columns += ("since", "trigger_count")
+    return _render(rows, columns, markdown, title=title,
+                   format=format, max_chars=max_chars, labels=("thing_name", "device_id"),
+                   page=lambda r: {"before_ts": r["ts"], "before_id": r["id"]}, more=len(rows) == limit)
+
+
+@mcp.tool()
+@_instrumented
+def get_facility_summary(
+    company_name: Optional[str] = None,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """Get a high-level summary of all monitored facilities: device counts, latest readings, active alerts. `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size by listing fewer locations."""
+    def group_devices():
+        # Devices by company/location; counts and last activity are taken per call
+        query = """
+            SELECT company_name, location_name, location_city, location_state, device_id, last_seen
+            FROM devices
+        """
+        where, params = _name_filters(company_name=company_name)
+        if where:
+            query += f" WHERE {where}"
+        query += " ORDER BY company_name, location_name"
+        groups = {}
+        with db.reader() as conn:
+            for r in conn.execute(query, params):
+                group = groups.setdefault((r["company_name"], r["location_name"]), {
+                    "company_name": r["company_name"], "location_name": r["location_name"],
+                    "location_city": r["location_city"], "location_state": r["location_state"], "devices": []})
+                group["devices"].append((r["device_id"], r["last_seen"]))
+        return list(groups.values())
+
+    locations = []
+    for group in result_cache.get(("get_facility_summary", company_name), ("devices",), group_devices):
+        seen = [s for s in (device_registry.last_seen(d, s) for d, s in group["devices"]) if s is not None]
+        locations.append({**group, "device_count": len(group["devices"]), "latest_activity": max(seen, default=None)})
+
+    if latest_cache.loaded:
+        # Running totals kept by the ingest path
+        device_count = device_registry.count()
+        reading_count, alert_count = latest_cache.totals()
+    else:
+        with db.reader() as conn:
+            alert_count = conn.execute("SELECT COUNT(*) as cnt FROM alert_state WHERE triggered = 1").fetchone()["cnt"]
+            # Retention keeps device_stats.reading_count equal to the rows retained
+            reading_count = conn.execute(
+                "SELECT COALESCE(SUM(reading_count), 0) AS cnt FROM device_stats").fetchone()["cnt"]
+            device_count = conn.execute("SELECT COUNT(*) as cnt FROM devices").fetchone()["cnt"]
+
+    def markdown(rows, notes):
+        lines = ["**Cognituv Connect Facility Summary**", *notes, ""]
+        lines.append(f"- Total devices: {device_count}")
+        lines.append(f"- Total sensor readings: {reading_count}")
+        lines.append(f"- Active alerts: {alert_count}")
+        lines.append("")
+
+        if rows:
+            lines.append("**Locations:**")
+            for loc in rows:
+                lines.append(
+                    f"- {loc['company_name']} / {loc['location_name']} "
+                    f"({loc['location_city']}, {loc['location_state']}) — "
+                    f"{loc['device_count']} devices, last activity: {loc['latest_activity']}"
+                )
+        else:
+            lines.append("No locations registered yet.")
+
+        return "\n".join(lines)
+
+    return _render(locations, ("company_name", "location_name", "location_city", "location_state", "device_count",
+                               "latest_activity"),
+                   markdown, title="Cognituv Connect facility summary", format=format, max_chars=max_chars,
+                   labels=("location_name", "company_name", "location_city", "location_state"),
+                   facts={"total_devices": device_count, "total_sensor_readings": reading_count,
+                          "active_alerts": alert_count})
+
+
+@contextmanager
+def _query_budget(conn, seconds):
+    """Abort the statement (sqlite3.OperationalError: interrupted) once `seconds` have elapsed."""
+    deadline = time.perf_counter() + seconds
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, 10_000)
+    try:
+        yield
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+@mcp.tool()
+@_instrumented
+def query_sensor_data(
+    device_id: Optional[str] = None,
+    location_name: Optional[str] = None,
+    company_name: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    channel: Optional[int] = None,
+    min_value: Optional[float] = None,
+    max_value: Optional[float] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 100,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """
+    Search sensor readings with structured filters; results are newest first, up to `limit` rows.
+    Scope by device_id and/or location_name / company_name (partial matches), then narrow with
+    sensor_type (e.g. 'temp'), channel, min_value / max_value, and start / end (ISO 8601 or epoch ms).
+    Without a device or location scope, only the last 24 hours are searched unless start is given.
+    `format` is 'markdown', 'compact' (tab-separated, device names and units factored into header
+    lines, delta-encoded times) or 'json'; `max_chars` caps the answer size by downsampling.
+    """
+    limit = max(1, min(limit, QUERY_ROW_CAP))
+    try:
+        start_ms = _parse_time(start)
+        end_ms = _parse_time(end)
+    except ValueError as e:
+        return f"Invalid time range: {e}"
+
+    # Every statement below is pinned to an index with INDEXED BY, so a filter combination
+    # can never silently turn into a full scan of sensor_readings.
+    filters, params = [], []
+    if sensor_type:
+        filters.append("sr.type = ?")
+        params.append(sensor_type)
+    if channel is not None:
+        filters.append("sr.channel = ?")
+        params.append(channel)
+    if min_value is not None:
+        filters.append("sr.value >= ?")
+        params.append(min_value)
+    if max_value is not None:
+        filters.append("sr.value <= ?")
+        params.append(max_value)
+
+    scoped = bool(device_id or location_name or company_name)
+    notes = []
+    if not scoped and start_ms is None:
+        start_ms = (end_ms or int(time.time() * 1000)) - QUERY_DEFAULT_WINDOW_HOURS * 3_600_000
+        notes.append(f"No device or location given: searched the {QUERY_DEFAULT_WINDOW_HOURS} hours "
+                     f"since {_ts_iso(start_ms)}; pass start to look further back.")
+    if start_ms is not None:
+        filters.append("sr.ts >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        filters.append("sr.ts < ?")
+        params.append(end_ms)
+    where = "".join(f" AND {f}" for f in filters)
+
+    names = None
+    try:
+        with db.reader() as conn, _query_budget(conn, QUERY_TIME_BUDGET):
+            # Readings below the columnar boundary are read from Parquet further down
+            boundary = columnar.boundary(conn)
+            hot_where, hot_params = (where, params) if boundary is None else (where + " AND sr.ts >= ?",
+                                                                               [*params, boundary])
+            if scoped:
+                device_query = "SELECT device_id, thing_name FROM devices WHERE 1=1"
+                device_params: list = []
+                if device_id:
+                    device_query += " AND device_id = ?"
+                    device_params.append(device_id)
+                filters, filter_params = _name_filters(location_name, company_name)
+                if filters:
+                    device_query += f" AND {filters}"
+                    device_params += filter_params
+                names = dict(conn.execute(device_query, device_params).fetchall())
+                if device_id and not (location_name or company_name):
+                    names.setdefault(device_id, None)  # readings may predate the device row
+                if end_ms is not None and boundary is not None and end_ms <= boundary:
+                    names_hot = {}  # the whole range is in Parquet
+                else:
+                    names_hot = names
+
+                index = ("idx_readings_device_type_ts" if sensor_type else
+                         "idx_readings_device_channel_ts" if channel is not None else
+                         "idx_readings_device_ts")
+                per_device = f"""
+                    SELECT sr.id, sr.device_id, sr.name, sr.type, sr.value, sr.unit, sr.ts
+                    FROM sensor_readings sr INDEXED BY {index}
+                    WHERE sr.device_id = ?{hot_where}
+                    ORDER BY sr.ts DESC LIMIT ?
+                """
+                # One index seek per device, merged newest-first
+                candidates = []
+                for dev in names_hot:
+                    candidates.extend(conn.execute(per_device, [dev, *hot_params, limit]).fetchall())
+                rows = heapq.nlargest(limit, candidates, key=lambda r: (r["ts"] or 0, r["id"]))
+                rows = [dict(r, thing_name=names.get(r["device_id"])) for r in rows]
+            else:
+                rows = conn.execute(f"""
+                    SELECT sr.device_id, d.thing_name, sr.name, sr.type, sr.value, sr.unit, sr.ts
+                    FROM sensor_readings sr INDEXED BY idx_readings_ts
+                    LEFT JOIN devices d ON sr.device_id = d.device_id
+                    WHERE 1=1{hot_where}
+                    ORDER BY sr.ts DESC LIMIT ?
+                """, [*hot_params, limit]).fetchall()
+
+        # Every Parquet reading is older than every SQLite one, so the cold rows simply follow
+        if (boundary is not None and len(rows) < limit and (start_ms is None or start_ms < boundary)
+                and (names is None or names)):
+            scope = ""
+            if names is not None:
+                scope = f" AND sr.device_id IN ({','.join('?' * len(names))})"
+            cold = columnar.query(f"""
+                SELECT sr.id, sr.device_id, sr.name, sr.type, sr.value, sr.unit, sr.ts
+                FROM cold_readings sr
+                WHERE sr.ts < ?{scope}{where}
+                ORDER BY sr.ts DESC, sr.id DESC LIMIT ?
+            """, [boundary, *(names or ()), *params, limit - len(rows)])
+            if names is None and cold:
+                with db.reader() as conn:
+                    devices = {r["device_id"] for r in cold}
+                    names = dict(conn.execute(
+                        f"SELECT device_id, thing_name FROM devices WHERE device_id IN ({','.join('?' * len(devices))})",
+                        list(devices)).fetchall())
+            rows = [*rows, *(dict(r, thing_name=names.get(r["device_id"])) for r in cold)]
+    except (sqlite3.OperationalError, TimeoutError) as e:
+        if isinstance(e, TimeoutError) or "interrupted" in str(e):
+            return (f"Query exceeded the {QUERY_TIME_BUDGET:g}s time budget. Narrow it with device_id, "
+                    f"location_name, sensor_type or a shorter start/end range.")
+        raise
+
+    if not rows:
+        return "\n".join(["No results found for the given query.", *notes])
+
+    title = f"Query results ({len(rows)} rows)"
+
+    def markdown(rows, notes):
+        lines = [f"{title}:", *notes, ""]
+        for r in rows:
+            ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
+            lines.append(f"- {r['thing_name']}: {r['name']} = {r['value']} {r['unit']} @ {ts_str}")
+        return "\n".join(lines)
+
+    return _render(rows, ("ts", "thing_name", "device_id", "name", "type", "value", "unit"), markdown, title=title,
+                   format=format, max_chars=max_chars, notes=notes,
+                   labels=("thing_name", "device_id", "name", "type", "unit"), series=("ts", "value"))
+
+
+def _anomaly_arrays(conn, series, start_ms, end_ms):
+    """
+    Load the readings of `series` ([(device_id, channel), ...]) in [start_ms, end_ms) as
+    numpy arrays (code, ts, value) sorted by series code, then time. `code` indexes
+    `series`. Closed days in the Parquet tier arrive in one columnar scan. Recent readings
+    come from SQLite, numbers only: a few series (one device, one site) are read by
+    seeking idx_readings_device_channel_ts per series, larger scopes in one pass over
+    idx_readings_ts.
+    """
+    parts = []
+    boundary = columnar.boundary(conn)
+    if boundary is not None and start_ms < boundary:
+        cold_end = min(end_ms, boundary)
+        values = ", ".join("(?, ?, ?)" for _ in series)
+        cold = columnar.query_arrays(f"""
+            WITH series(code, device_id, channel) AS (VALUES {values})
+            SELECT s.code, r.ts, r.value
+            FROM cold_readings r JOIN series s ON r.device_id = s.device_id AND r.channel = s.channel
+            WHERE r.date BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+              AND r.ts >= ? AND r.ts < ? AND r.value IS NOT NULL
+        """, [*(x for code, key in enumerate(series) for x in (code, *key)),
+              _ts_iso(start_ms)[:10], _ts_iso(cold_end - 1)[:10], start_ms, cold_end],
+            timeout=ANOMALY_TIME_BUDGET)
+        if cold is not None:
+            parts.append((cold["code"], cold["ts"], cold["value"]))
+        start_ms = boundary
+    if start_ms < end_ms:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS anomaly_series "
+                     "(device_id TEXT, channel INTEGER, code INTEGER, PRIMARY KEY (device_id, channel)) WITHOUT ROWID")
+        try:
+            conn.executemany("INSERT INTO temp.anomaly_series VALUES (?, ?, ?)",
+                             [(device_id, channel, code) for code, (device_id, channel) in enumerate(series)])
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples straight into the array
+            fleet_series = conn.execute("SELECT COUNT(*) FROM latest_readings").fetchone()[0]
+            if len(series) <= fleet_series * ANOMALY_SEEK_SHARE:
+                # Seeks read only the requested series; CROSS JOIN keeps the series list outermost
+                source = ("temp.anomaly_series s CROSS JOIN sensor_readings sr INDEXED BY idx_readings_device_channel_ts "
+                          "ON sr.device_id = s.device_id AND sr.channel = s.channel")
+            else:
+                # Fleet-wide, the time-ordered scan outermost beats one seek per series
+                source = ("sensor_readings sr INDEXED BY idx_readings_ts "
+                          "CROSS JOIN temp.anomaly_series s ON s.device_id = sr.device_id AND s.channel = sr.channel")
+            cursor.execute(f"""
+                SELECT s.code, sr.ts, sr.value
+                FROM {source}
+                WHERE sr.ts >= ? AND sr.ts < ? AND typeof(sr.value) IN ('integer', 'real')
+            """, (start_ms, end_ms))
+            hot = np.fromiter(cursor, dtype=[("code", "i8"), ("ts", "i8"), ("value", "f8")])
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.anomaly_series")
+            conn.commit()
+        parts.append((hot["code"], hot["ts"], hot["value"]))
+
+    code = np.concatenate([p[0] for p in parts]).astype(np.int64)
+    ts = np.concatenate([p[1] for p in parts]).astype(np.int64)
+    value = np.concatenate([p[2] for p in parts]).astype(np.float64)
+    # DuckDB returns joins and parallel scans in no particular order, and late readings sit in
+    # later Parquet files, so sort by series, then time
+    order = np.lexsort((ts, code))
+    return code[order], ts[order], value[order]
+
+
+def _score_anomalies(code, ts, value, types):
+    """
+    Vectorized per-series checks over readings sorted by (code, ts). `types` maps each
+    series code to its sensor type. Returns (score, kind, series code, detail values) for
+    every check that reaches its threshold.
+    """
+    starts = np.flatnonzero(np.r_[True, code[1:] != code[:-1]])
+    ends = np.r_[starts[1:], len(code)] - 1
+    counts = ends - starts + 1
+    keys = code[starts]
+    idx = np.arange(len(value))
+    kind = np.array([types[k] for k in keys], dtype=object)
+    judged = counts >= ANOMALY_MIN_POINTS
+    steady = np.isin(kind, list(ANOMALY_STEADY_TYPES))
+
+    sums = np.add.reduceat(value, starts)
+    mean = sums / counts
+    # Avoid dividing by zero on perfectly flat series
+    floor = 1e-3 * np.maximum(np.abs(mean), 1.0)
+
+    # Spike: farthest reading from the mean, against the spread of the other readings
+    dev = value - np.repeat(mean, counts)
+    absdev = np.abs(dev)
+    peak = np.maximum.reduceat(absdev, starts)
+    peak_at = np.minimum.reduceat(np.where(absdev == np.repeat(peak, counts), idx, len(idx)), starts)
+    rest_std = np.sqrt(np.maximum(np.add.reduceat(dev * dev, starts) - peak ** 2, 0) / np.maximum(counts - 2, 1))
+    # The largest of n normal readings is about sqrt(2 ln n) deviations out by chance alone
+    spike_z = np.maximum(ANOMALY_SPIKE_Z, np.sqrt(2 * np.log(counts)) + 1)
+    spike = np.where(judged & ~steady, peak / np.maximum(rest_std, floor) / spike_z, 0)
+
+    # Jump: largest step between consecutive readings, against the other steps
+    step = np.r_[np.diff(value), 0.0]
+    step[ends] = 0.0  # no step across series or after the last reading
+    absstep = np.abs(step)
+    big = np.maximum.reduceat(absstep, starts)
+    big_at = np.minimum.reduceat(np.where(absstep == np.repeat(big, counts), idx, len(idx)), starts)
+    rest_rms = np.sqrt(np.maximum(np.add.reduceat(step * step, starts) - big ** 2, 0) / np.maximum(counts - 2, 1))
+    jump = np.where(judged & ~steady, big / np.maximum(rest_rms, floor) / ANOMALY_JUMP_RATIO, 0)
+    # The steps into and out of a spike are the spike, not a level change
+    jump[(spike >= 1) & ((big_at == peak_at) | (big_at + 1 == peak_at))] = 0
+
+    # Stuck: how long the latest value has been repeated unchanged
+    changed = np.r_[True, value[1:] != value[:-1]]
+    changed[starts] = True
+    run_start = np.maximum.reduceat(np.where(changed, idx, 0), starts)
+    stuck_hours = (ts[ends] - ts[run_start]) / 3_600_000
+    stuck = np.where(judged & ~steady & (ends - run_start >= 2), stuck_hours / ANOMALY_STUCK_HOURS, 0)
+
+    # Battery: least-squares slope in points per day, and the latest level
+    t_days = (ts - np.repeat(ts[starts], counts)) / 86_400_000
+    s_t, s_tt, s_tx = (np.add.reduceat(a, starts) for a in (t_days, t_days * t_days, t_days * value))
+    denom = counts * s_tt - s_t ** 2
+    slope = np.where(denom > 0, (counts * s_tx - s_t * sums) / np.where(denom > 0, denom, 1), 0)
+    battery = (kind == "batt") & judged & (ts[ends] - ts[starts] >= 43_200_000)  # at least 12 h of data
+    battery_decline = np.where(battery, -slope / ANOMALY_BATTERY_DROP_PER_DAY, 0)
+    last = value[ends]
+    battery_low = np.where((kind == "batt") & (last <= ANOMALY_BATTERY_LOW),
+                           ANOMALY_BATTERY_LOW / np.maximum(last, 1.0), 0)
+
+    # Signal: mean of the second half of the window against the first half
+    first = ts <= np.repeat((ts[starts] + ts[ends]) // 2, counts)
+    n1 = np.add.reduceat(first.astype(np.float64), starts)
+    s1 = np.add.reduceat(np.where(first, value, 0), starts)
+    n2 = counts - n1
+    halves = judged & (n1 >= 4) & (n2 >= 4)
+    mean1 = s1 / np.maximum(n1, 1)
+    mean2 = (sums - s1) / np.maximum(n2, 1)
+    threshold = np.array([ANOMALY_SIGNAL_DROP.get(k, np.inf) for k in kind])
+    signal = np.where(halves, (mean1 - mean2) / threshold, 0)
+
+    findings = []
+    for name, scores, details in (
+        ("spike", spike, lambda i: (value[peak_at[i]], ts[peak_at[i]], peak[i] / max(rest_std[i], floor[i]), mean[i])),
+        ("jump", jump, lambda i: (step[big_at[i]], ts[big_at[i]], ts[big_at[i] + 1], big[i] / max(rest_rms[i], floor[i]))),
+        ("stuck", stuck, lambda i: (last[i], stuck_hours[i], ends[i] - run_start[i] + 1, run_start[i] == starts[i])),
+        ("battery_decline", battery_decline, lambda i: (-slope[i], last[i])),
+        ("battery_low", battery_low, lambda i: (last[i],)),
+        ("signal", signal, lambda i: (mean1[i], mean2[i])),
+    ):
+        for i in np.flatnonzero(scores >= 1):
+            findings.append((float(scores[i]), name, int(keys[i]), details(i)))
+    return findings
+
+
+def _describe_anomaly(kind, unit, d):
+    if kind == "spike":
+        return f"{d[0]:g} {unit} at {_ts_iso(d[1])}, {d[2]:.1f} standard deviations from the mean of {d[3]:.2f}"
+    if kind == "jump":
+        return f"changed by {d[0]:+g} {unit} between {_ts_iso(d[1])} and {_ts_iso(d[2])}, {d[3]:.0f}x its usual step"
+    if kind == "stuck":
+        span = "for the whole window" if d[3] else "for the latest"
+        return f"unchanged at {d[0]:g} {unit} {span} {d[1]:.1f} h ({d[2]} readings)"
+    if kind == "battery_decline":
+        return f"falling {d[0]:.1f} points/day, now {d[1]:g} {unit}" + (
+            f" (empty in about {d[1] / d[0]:.0f} days)" if d[0] > 0 else "")
+    if kind == "battery_low":
+        return f"at {d[0]:g} {unit}"
+    return f"mean fell from {d[0]:.1f} to {d[1]:.1f} {unit} between the first and second half of the window"
+
+
+@mcp.tool()
+@_instrumented
+def detect_anomalies(
+    location_name: Optional[str] = None,
+    company_name: Optional[str] = None,
+    device_id: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    window: str = "24h",
+    end: Optional[str] = None,
+    limit: int = 20,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """
+    Scan many sensors at once and return only the ranked outliers, instead of reading each
+    device's history. Scope by location_name / company_name (partial matches), device_id and
+    sensor_type (e.g. 'temp'); `window` is how far back to look ('6h', '24h', '7d'), ending at
+    `end` (ISO 8601 or epoch ms, default now). Checks each device channel for spikes, sudden
+    jumps, stuck or flat values, battery decline or low battery, and falling RSSI/SNR.
+    Findings are ranked by score (1 = at the detection threshold); at most `limit` are returned.
+    `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size by returning
+    fewer findings and summarizing the rest.
+    """
+    try:
+        span = _parse_duration(window)
+    except ValueError:
+        return f"Invalid window '{window}'. Use e.g. '6h', '24h' or '7d'."
+    try:
+        end_ms = _parse_time(end, default=int(time.time() * 1000))
+    except ValueError as e:
+        return f"Invalid time range: {e}"
+    start_ms = end_ms - span
+
+    query = ("SELECT lr.device_id, lr.channel, lr.name, lr.type, lr.unit, d.thing_name "
+             "FROM latest_readings lr LEFT JOIN devices d ON lr.device_id = d.device_id WHERE 1=1")
+    names, params = _name_filters(location_name, company_name, alias="d.")
+    if names:
+        query += f" AND {names}"
+    for column, value in (("lr.device_id", device_id), ("lr.type", sensor_type)):
+        if value:
+            query += f" AND {column} = ?"
+            params.append(value)
+    scope = ", ".join(v for v in (company_name, location_name, device_id) if v) or "the fleet"
+    scope += f" ({sensor_type})" if sensor_type else ""
+
+    try:
+        with db.reader() as conn, _query_budget(conn, ANOMALY_TIME_BUDGET):
+            meta = conn.execute(query, params).fetchall()
+            if not meta:
+                return f"No sensors found in {scope}."
+            code, ts, value = _anomaly_arrays(conn, [(m["device_id"], m["channel"]) for m in meta], start_ms, end_ms)
+    except (sqlite3.OperationalError, TimeoutError) as e:
+        if isinstance(e, TimeoutError) or "interrupted" in str(e):
+            return (f"Anomaly scan exceeded the {ANOMALY_TIME_BUDGET:g}s time budget. "
+                    f"Narrow it with location_name, sensor_type or a shorter window.")
+        raise
+
+    header = f"{scope}, {window} window ({_ts_iso(start_ms)} to {_ts_iso(end_ms)})"
+    if not len(code):
+        return f"No readings in {header}."
+    findings = _score_anomalies(code, ts, value, [m["type"] for m in meta])
+    series_count = len(np.unique(code))
+    if not findings:
+        return f"No anomalies in {header}: {len(code):,} readings from {series_count} sensor channels checked."
+
+    findings.sort(key=lambda f: f[0], reverse=True)
+    title = (f"Anomalies in {header}: {min(limit, len(findings))} of {len(findings)} findings "
+             f"from {len(code):,} readings in {series_count} sensor channels")
+    rows = []
+    for score, kind, series, details in findings[:limit]:
+        m = meta[series]
+        rows.append({"score": round(score, 1), "kind": kind, "thing_name": m["thing_name"] or m["device_id"],
+                     "device_id": m["device_id"], "channel": m["channel"], "name": m["name"], "type": m["type"],
+                     "detail": _describe_anomaly(kind, m["unit"] or "", details)})
+
+    def markdown(rows, notes):
+        lines = [f"{title}.", *notes, ""]
+        for r in rows:
+            lines.append(f"- [{r['kind']}] **{r['thing_name']}** — {r['name']} ({r['type']}), "
+                         f"channel {r['channel']}: {r['detail']} (score {r['score']:.1f})")
+        return "\n".join(lines)
+
+    return _render(rows, ("score", "kind", "thing_name", "device_id", "channel", "name", "type", "detail"), markdown,
+                   title=title, format=format, max_chars=max_chars, labels=("thing_name", "device_id", "name", "type"))
+
+
+@mcp.tool()
+@_instrumented
+def get_event_log(
+    event_type: Optional[str] = None,
+    limit: int = 20,
+    before_id: Optional[int] = None,
+    include_payload: bool = False,
+    format: str = "markdown",
+    max_chars: Optional[int] = None,
+) -> str:
+    """Get the raw event log. Optionally filter by event_type (uplink, alert, ping). Set include_payload=True to include each event's original webhook JSON. To page further back, pass the `before_id` cursor printed at the end of the previous page. `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size by listing fewer events (continue with the cursor)."""
+    columns = "*" if include_payload else "id, event_type, received_at"
+    query = f"SELECT {columns} FROM events WHERE 1=1"
     params: list = []
     if event_type:
-        query += " WHERE event_type = ?"
+        query += " AND event_type = ?"
         params.append(event_type)
+    query, params = _keyset_before(query, params, "received_at", "id", None, before_id)
     query += " ORDER BY id DESC LIMIT ?"
     params.append(limit)
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
+    with db.reader() as conn:
+        rows = conn.execute(query, params).fetchall()
+        payloads = [event_codec.decode_json(conn, r) for r in rows] if include_payload else None
 
     if not rows:
         return "No events found."
+    title = f"Event log ({len(rows)} entries)"
+    columns = ("id", "event_type", "received_at", *(("payload",) if include_payload else ()))
+    rows = [{"id": r["id"], "event_type": r["event_type"], "received_at": r["received_at"],
+             "payload": payloads[i] if payloads else None} for i, r in enumerate(rows)]
 
-    lines = [f"Event log ({len(rows)} entries):", ""]
-    for r in rows:
-        lines.append(f"- [{r['event_type']}] ID: {r['id']} at {r['received_at']}")
-    return "\n".join(lines)
+    def markdown(rows, notes):
+        lines = [f"{title}:", *notes, ""]
+        for r in rows:
+            lines.append(f"- [{r['event_type']}] ID: {r['id']} at {r['received_at']}")
+            if r["payload"]:
+                lines.append(f"  {r['payload']}")
+        return "\n".join(lines)
+
+    return _render(rows, columns, markdown, title=title, format=format, max_chars=max_chars,
+                   page=lambda r: {"before_id": r["id"]}, more=len(rows) == limit)
 
 
 @mcp.tool()
-def get_gateway_status(limit: int = 20) -> str:
-    """Get the latest gateway ping/keepalive events to check gateway health."""
-    conn = get_db()
-    rows = conn.execute("""
-        SELECT device_id, thing_name, ts, received_at
-        FROM gateway_pings
-        ORDER BY ts DESC
-        LIMIT ?
-    """, (limit,)).fetchall()
-    conn.close()
+@_instrumented
+def get_gateway_status(limit: int = 100, format: str = "markdown", max_chars: Optional[int] = None) -> str:
+    """
+    Get the health of every gateway: one row per gateway with its status (offline, stale or
+    online), last ping time, ping count and average ping interval. Offline gateways are listed first.
+    `format` is 'markdown', 'compact' or 'json'; `max_chars` caps the answer size by listing fewer gateways.
+    """
+    with db.reader() as conn:
+        rows = conn.execute("""
+            SELECT device_id, thing_name, last_ping_ts, ping_count, avg_interval_ms, status, status_changed_ts
+            FROM gateway_state
+            ORDER BY CASE status WHEN 'offline' THEN 0 WHEN 'stale' THEN 1 ELSE 2 END, last_ping_ts
+            LIMIT ?
+        """, (limit,)).fetchall()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM gateway_state GROUP BY status").fetchall())
 
     if not rows:
         return "No gateway pings recorded yet."
 
-    lines = ["**Gateway Status (recent pings):**", ""]
-    for r in rows:
-        ts_str = datetime.fromtimestamp(r["ts"] / 1000, tz=timezone.utc).isoformat() if r["ts"] else "N/A"
-        lines.append(f"- **{r['thing_name']}** (ID: {r['device_id']}) — pinged at {ts_str}")
-    return "\n".join(lines)
+    summary = ", ".join(f"{counts.get(status, 0)} {status}" for status in GatewaySweeper.STATUS_ORDER)
+    now_ms = time.time() * 1000
+
+    def markdown(rows, notes):
+        lines = [f"**Gateway Status** ({summary}):", *notes, ""]
+        for r in rows:
+            ts_str = _ts_iso(r["last_ping_ts"]) if r["last_ping_ts"] else "N/A"
+            line = f"- **{r['thing_name']}** (ID: {r['device_id']}) — {r['status'].upper()}, last ping {ts_str}"
+            if r["last_ping_ts"]:
+                line += f" ({_format_age(now_ms - r['last_ping_ts'])} ago)"
+            line += f", {r['ping_count']} pings"
+            if r["avg_interval_ms"] is not None:
+                line += f", every ~{_format_age(r['avg_interval_ms'])}"
+            if r["status"] != "online" and r["status_changed_ts"]:
+                line += f"; {r['status']} since {_ts_iso(r['status_changed_ts'])}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    rows = [dict(r, avg_interval_s=None if r["avg_interval_ms"] is None else round(r["avg_interval_ms"] / 1000))
+            for r in rows]
+    return _render(rows, ("status", "thing_name", "device_id", "last_ping_ts", "ping_count", "avg_interval_s",
+                          "status_changed_ts"),
+                   markdown, title="Gateway status", format=format, max_chars=max_chars,
+                   labels=("thing_name", "device_id"),
+                   facts={status: counts.get(status, 0) for status in GatewaySweeper.STATUS_ORDER})
+
+
+def _format_age(ms):
+    """Compact duration such as '3d 4h', '12m 5s' or '40s'."""
+    seconds = max(0, int(ms / 1000))
+    days, rem = divmod(seconds, 86400)
+    hours, rem = divmod(rem, 3600)
+    minutes, seconds = divmod(rem, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+# ---------------------------------------------------------------------------
+# MCP resources with live update notifications
+# ---------------------------------------------------------------------------
+@mcp.resource("cognituv://devices/{device_id}/latest", mime_type="text/markdown")
+def latest_readings_resource(device_id: str) -> str:
+    """Latest reading per channel of one device, as get_latest_readings. Subscribe to be told when it changes."""
+    return get_latest_readings(device_id)
+
+
+@mcp.resource("cognituv://devices/{device_id}/alerts", mime_type="text/markdown")
+def device_alerts_resource(device_id: str) -> str:
+    """Recent alerts of one device, triggered and resolved. Subscribe to be told about new ones."""
+    return get_alerts(device_id=device_id, triggered_only=False)
+
+
+@mcp.resource("cognituv://alerts", mime_type="text/markdown")
+def alerts_resource() -> str:
+    """Recent alerts across all devices, triggered and resolved. Subscribe to be told about new ones."""
+    return get_alerts(triggered_only=False)
+
+
+def _resource_uris(message):
+    """The subscribable resources a live feed message changes."""
+    if message["event_type"] == "uplink":
+        return (f"cognituv://devices/{message['device_id']}/latest",)
+    if message["event_type"] == "alert":
+        return f"cognituv://devices/{message['device_id']}/alerts", "cognituv://alerts"
+    return ()
+
+
+class ResourceNotifier:
+    """
+    MCP resource subscriptions (resources/subscribe) fed by the live feed.
+
+    A subscribed session gets notifications/resources/updated for a resource URI when
+    new data for it is stored, and re-reads the resource. One task per process drains a
+    coalescing feed subscription, so a burst of readings on a device sends one
+    notification per subscribed session rather than one per reading. Sessions that can
+    no longer be reached are dropped.
+    """
+
+    def __init__(self):
+        self._sessions = {}  # uri -> subscribed sessions
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+
+    def subscribe(self, session, uri):
+        self._sessions.setdefault(uri, set()).add(session)
+        if self._task is None or self._task.done():
+            if writer_client is not None:
+                writer_client.start_relay()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unsubscribe(self, session, uri):
+        sessions = self._sessions.get(uri)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self._sessions[uri]
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        subscription = live_feed.subscribe(policy="coalesce")
+        try:
+            while (messages := await subscription.get()) is not None:
+                uris = {uri for m in messages for uri in _resource_uris(m)}
+                for uri in uris & self._sessions.keys():
+                    for session in list(self._sessions.get(uri, ())):
+                        try:
+                            await session.send_resource_updated(uri)
+                            self.sent += 1
+                        except Exception:
+                            self.failed += 1
+                            for subscribed in self._sessions.values():
+                                subscribed.discard(session)
+                self._sessions = {uri: sessions for uri, sessions in self._sessions.items() if sessions}
+        finally:
+            subscription.close()
+
+    def stats(self):
+        return {"subscriptions": sum(len(s) for s in self._sessions.values()),
+                "notifications_sent": self.sent, "notifications_failed": self.failed}
+
+
+resource_notifier = ResourceNotifier()
+
+
+# FastMCP has no public hook for resource subscriptions: the handlers and the capability
+# go through its low-level server. requirements.txt pins the mcp version this was written
+# against, and test_live.py checks both after an upgrade.
+_lowlevel = mcp._mcp_server
+
+
+@_lowlevel.subscribe_resource()
+async def subscribe_resource(uri):
+    resource_notifier.subscribe(mcp.get_context().session, str(uri))
+
+
+@_lowlevel.unsubscribe_resource()
+async def unsubscribe_resource(uri):
+    resource_notifier.unsubscribe(mcp.get_context().session, str(uri))
+
+
+_base_capabilities = _lowlevel.get_capabilities
+
+
+def _capabilities(*args, **kwargs):
+    # The low-level server always advertises resources.subscribe=False, even with a subscribe handler
+    capabilities = _base_capabilities(*args, **kwargs)
+    if capabilities.resources is not None:
+        capabilities.resources.subscribe = True
+    return capabilities
+
+
+_lowlevel.get_capabilities = _capabilities
 
 
 # ---------------------------------------------------------------------------
@@ -0,0 +1,80 @@
+"""Current alert state: maintained at ingest, read by the active-alert tools, rebuilt from history."""
+
+import copy
+import json
+
+import replay
+from test_live import store
+from test_webhook import ALERT_PAYLOAD
+
+DEVICE = ALERT_PAYLOAD["event_data"]["thingId"]
+RULE = ALERT_PAYLOAD["event_data"]["ruleId"]
+FIXTURE_TS = int(ALERT_PAYLOAD["event_data"]["timestamp"])
+
+
+def alert(n, triggered, rule_id=RULE, ts=None):
+    payload = copy.deepcopy(ALERT_PAYLOAD)
+    payload["event_data"].update(correlation_id=f"state-{n}", ruleId=rule_id, triggered=triggered,
+                                 timestamp=str(ts if ts is not None else FIXTURE_TS + n * 60_000))
+    return payload
+
+
+def state(server):
+    with server.db.reader() as conn:
+        return {r["rule_id"]: dict(r) for r in conn.execute(
+            "SELECT rule_id, triggered, first_triggered_ts, last_change_ts, last_ts, trigger_count, alert_id "
+            "FROM alert_state ORDER BY rule_id")}
+
+
+def active_total(server):
+    return server.latest_cache.totals()[1]
+
+
+def test_state_follows_trigger_and_clear_cycles(server_db):
+    # The fixture alert triggered RULE; it clears, fires again, and a second rule fires and clears
+    store(server_db, [alert(1, False), alert(2, True), alert(3, True, "rule-b")])
+    store(server_db, [alert(4, False, "rule-b"), alert(5, True)])  # still triggered: no new trigger
+    current = state(server_db)
+    assert current[RULE] | {"alert_id": None} == {
+        "rule_id": RULE, "triggered": 1, "first_triggered_ts": FIXTURE_TS, "last_change_ts": FIXTURE_TS + 120_000,
+        "last_ts": FIXTURE_TS + 300_000, "trigger_count": 2, "alert_id": None}
+    assert current["rule-b"]["triggered"] == 0 and current["rule-b"]["trigger_count"] == 1
+    with server_db.db.reader() as conn:
+        newest = conn.execute("SELECT MAX(id) FROM alerts WHERE rule_id = ?", (RULE,)).fetchone()[0]
+    assert current[RULE]["alert_id"] == newest
+
+    listing = server_db.get_alerts()
+    assert listing.startswith("Found 1 active alert(s)") and "Triggered 2 time(s)" in listing
+    assert "Active since: 2021-02-24T21:20:29.775000+00:00" in listing
+    assert server_db.get_alerts(triggered_only=False).startswith("Found 6 alert(s)")
+    assert active_total(server_db) == 1 and "- Active alerts: 1" in server_db.get_facility_summary()
+
+    answer = json.loads(server_db.get_alerts(format="json"))
+    assert answer["columns"][-2:] == ["since", "trigger_count"] and answer["rows"][0][-1] == 2
+
+
+def test_late_alerts_do_not_override_newer_state(server_db):
+    store(server_db, [alert(1, False)])
+    store(server_db, [alert(2, True, ts=FIXTURE_TS - 60_000)])  # delivered late, older than the clear
+    current = state(server_db)[RULE]
+    assert current["triggered"] == 0 and current["last_ts"] == FIXTURE_TS + 60_000
+    assert current["first_triggered_ts"] == FIXTURE_TS - 60_000
+    assert active_total(server_db) == 0 and server_db.get_alerts() == "No alerts found matching the criteria."
+
+
+def test_rebuild_from_history_matches_ingest(server_db, capsys):
+    store(server_db, [alert(1, False), alert(2, True), alert(3, True, "rule-b"), alert(4, True)])
+    store(server_db, [alert(5, False, "rule-b"), alert(6, False), alert(7, True, "rule-c")])
+    maintained = state(server_db)
+    with server_db.db.writer() as conn:
+        with conn:
+            conn.execute("DELETE FROM alert_state")
+        server_db._create_schema(conn)  # an empty alert_state next to alert history is derived once
+    assert state(server_db) == maintained
+    server_db.db.close()
+
+    result = replay.main(["--db", server_db.db.db_file, "--alert-state"])
+
+    assert result["mode"] == "alert-state" and result["active_alerts"] == 1
+    assert state(server_db) == maintained
+    assert json.loads(capsys.readouterr().out)["active_alerts"] == 1
@@ -0,0 +1,114 @@
+"""detect_anomalies: each check fires on the series built to trip it, and only there."""
+
+import numpy as np
+import pytest
+
+HOUR_MS = 3_600_000
+END = 1_709_251_200_000  # 2024-03-01T00:00Z
+POINTS = 288  # every 10 minutes for 48 hours
+
+
+def series(values, device, channel, name, kind, unit):
+    ts = END - 48 * HOUR_MS + np.arange(len(values)) * 600_000
+    return [(device, name, kind, float(v), unit, channel, int(t)) for v, t in zip(values, ts)]
+
+
+@pytest.fixture
+def site(server_db):
+    rng = np.random.default_rng(0)
+    noise = lambda: rng.normal(0, 0.1, POINTS)  # noqa: E731
+    temp = {
+        "freezer-ok": -18 + noise(),
+        "freezer-spike": -18 + noise(),
+        "freezer-jump": -18 + noise() + np.where(np.arange(POINTS) >= POINTS // 2, 6, 0),
+        "freezer-stuck": -18 + noise(),
+    }
+    temp["freezer-spike"][200] = 5.0
+    temp["freezer-stuck"][-48:] = -17.5  # the last 8 hours
+    rows = [r for device, values in temp.items() for r in series(values, device, 3, "Temperature", "temp", "c")]
+    rows += series(np.linspace(100, 99.5, POINTS).round(), "freezer-ok", 5, "Battery", "batt", "p")
+    rows += series(np.linspace(90, 80, POINTS).round(), "freezer-jump", 5, "Battery", "batt", "p")
+    rows += series(np.r_[np.full(POINTS // 2, -70), np.full(POINTS // 2, -90)] + noise(),
+                   "freezer-stuck", 100, "RSSI", "rssi", "dbm")
+    with server_db.db.writer() as conn, conn:
+        conn.executemany("INSERT INTO sensor_readings (device_id, name, type, value, unit, channel, ts) "
+                         "VALUES (?,?,?,?,?,?,?)", rows)
+        conn.execute("DELETE FROM latest_readings")
+        conn.execute("INSERT INTO latest_readings (device_id, channel, name, type, value, unit, ts) "
+                     "SELECT device_id, channel, name, type, value, unit, MAX(ts) FROM sensor_readings "
+                     "GROUP BY device_id, channel")
+        conn.executemany("INSERT OR REPLACE INTO devices (device_id, thing_name, company_name, location_name) "
+                         "VALUES (?, ?, 'Acme Foods', 'Cold Store 1')",
+                         [(device, device.replace("-", " ").title()) for device in temp])
+    return server_db
+
+
+def findings(result):
+    return {(line.split("] **")[1].split("**")[0], line[3:].split("]")[0])
+            for line in result.splitlines() if line.startswith("- [")}
+
+
+def test_each_check_flags_only_its_series(site):
+    result = site.detect_anomalies(location_name="Cold Store", window="48h", end=str(END))
+    assert findings(result) == {
+        ("Freezer Spike", "spike"),
+        ("Freezer Jump", "jump"),
+        ("Freezer Stuck", "stuck"),
+        ("Freezer Jump", "battery_decline"),
+        ("Freezer Stuck", "signal"),
+    }
+    assert "2,016 readings in 7 sensor channels" in result
+    scores = [float(line.rsplit("(score ", 1)[1][:-1]) for line in result.splitlines() if line.startswith("- [")]
+    assert scores == sorted(scores, reverse=True) and min(scores) >= 1
+    assert "unchanged at -17.5 c for the latest 7.8 h (48 readings)" in result
+
+
+def test_scope_window_and_limit(site):
+    batteries = site.detect_anomalies(company_name="Acme", sensor_type="batt", window="48h", end=str(END))
+    assert findings(batteries) == {("Freezer Jump", "battery_decline")}
+    assert "falling 5.0 points/day, now 80 p" in batteries
+
+    top = site.detect_anomalies(window="48h", end=str(END), limit=2)
+    assert "2 of 5 findings" in top and len(findings(top)) == 2
+    assert "No readings" in site.detect_anomalies(window="1h", end=str(END - 49 * HOUR_MS))
+    assert "Invalid window" in site.detect_anomalies(window="soon")
+
+
+def test_small_scopes_seek_per_series_with_the_same_findings(site, monkeypatch):
+    def traced(**kwargs):
+        statements = []
+        with site.db.reader() as conn:
+            conn.set_trace_callback(statements.append)
+        try:
+            result = site.detect_anomalies(window="48h", end=str(END), **kwargs)
+        finally:
+            with site.db.reader() as conn:
+                conn.set_trace_callback(None)
+        return findings(result), " ".join(statements)
+
+    found, sql = traced(device_id="freezer-spike")
+    assert found == {("Freezer Spike", "spike")} and "INDEXED BY idx_readings_device_channel_ts" in sql
+    fleet, sql = traced()
+    assert "INDEXED BY idx_readings_ts" in sql
+    monkeypatch.setattr(site, "ANOMALY_SEEK_SHARE", 1.0)
+    seeks, sql = traced()
+    assert seeks == fleet and "INDEXED BY idx_readings_device_channel_ts" in sql
+
+
+def test_parquet_readings_are_merged_in_time_order(site, monkeypatch, tmp_path):
+    pytest.importorskip("duckdb")
+    columnar = site.ColumnarStore(directory=str(tmp_path / "parquet"), grace_hours=0)
+    monkeypatch.setattr(site, "columnar", columnar)
+    columnar.export_once(now_ms=END - 24 * HOUR_MS)  # the first of the two days goes to Parquet
+    with site.db.writer() as conn, conn:  # a late reading for that day, exported by a second run
+        conn.execute("INSERT INTO sensor_readings (device_id, name, type, value, unit, channel, ts) "
+                     "VALUES ('freezer-ok', 'Temperature', 'temp', -18.0, 'c', 3, ?)", (END - 48 * HOUR_MS + 300_000,))
+    assert columnar.export_once(now_ms=END - 24 * HOUR_MS) == 1
+
+    with site.db.reader() as conn:
+        code, ts, _ = site._anomaly_arrays(conn, [("freezer-ok", 3), ("freezer-jump", 3)], END - 48 * HOUR_MS, END)
+    assert np.all(np.diff(code) >= 0) and np.all(np.diff(ts)[np.diff(code) == 0] > 0)
+    tiered = site.detect_anomalies(window="48h", end=str(END))
+
+    monkeypatch.setattr(site, "columnar", site.ColumnarStore(directory=""))  # every reading is still in SQLite
+    assert tiered == site.detect_anomalies(window="48h", end=str(END))
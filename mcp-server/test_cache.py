@@ -0,0 +1,76 @@
+"""Result cache of list_devices / get_facility_summary and the running totals behind the summary."""
+
+import copy
+from datetime import datetime, timedelta, timezone
+
+from test_live import store, uplink
+from test_webhook import ALERT_PAYLOAD
+
+
+def counted_totals(server):
+    with server.db.reader() as conn:
+        return [conn.execute(query).fetchone()[0] for query in (
+            "SELECT COUNT(*) FROM devices", "SELECT COUNT(*) FROM sensor_readings",
+            "SELECT COUNT(*) FROM alert_state WHERE triggered = 1")]
+
+
+def summary_totals(summary):
+    return [int(line.rsplit(": ", 1)[1]) for line in summary.splitlines()
+            if line.startswith(("- Total devices", "- Total sensor readings", "- Active alerts"))]
+
+
+def test_repeated_calls_hit_until_devices_change(server_db):
+    cache = server_db.result_cache
+    first = server_db.get_facility_summary()
+    assert server_db.get_facility_summary() == first
+    assert server_db.list_devices(format="json") == server_db.list_devices(format="json")
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # New readings and alerts move the running totals without invalidating anything
+    store(server_db, [uplink(10, 20.0), copy.deepcopy(ALERT_PAYLOAD) | {"correlation_id": "cache-1"}])
+    summary = server_db.get_facility_summary()
+    assert summary_totals(summary) == counted_totals(server_db) and summary != first
+    assert (cache.hits, cache.stale) == (3, 0)
+
+    # A new device bumps the devices generation
+    store(server_db, [uplink(11, 20.0, device_id="cache-device")])
+    assert "Found 3 device(s)" in server_db.list_devices()
+    assert summary_totals(server_db.get_facility_summary()) == counted_totals(server_db)
+    assert cache.stale == 2 and cache.stats()["generations"]["devices"] == 2
+
+
+def test_last_seen_is_current_without_invalidation(server_db, monkeypatch):
+    monkeypatch.setattr(server_db.device_registry, "last_seen_interval", 0)
+    server_db.list_devices()
+    with server_db.db.writer() as conn:
+        with conn:
+            conn.execute("UPDATE devices SET last_seen = '2020-01-01 00:00:00'")
+        server_db.device_registry.load(conn)
+    assert store(server_db, [uplink(40, 21.0)]) == 1  # refreshes last_seen for the uplink device only
+
+    listing = server_db.list_devices()
+    with server_db.db.reader() as conn:
+        stored = [r[0] for r in conn.execute("SELECT last_seen FROM devices ORDER BY last_seen DESC")]
+    assert stored[0] > stored[1] == "2020-01-01 00:00:00"
+    assert listing.index(f"Last seen: {stored[0]}") < listing.index("Last seen: 2020-01-01 00:00:00")
+    assert server_db.result_cache.stale == 0
+
+
+def test_least_recently_used_entry_is_evicted(server_db, monkeypatch):
+    cache = server_db.ResultCache(max_entries=2)
+    cache.enable()
+    monkeypatch.setattr(server_db, "result_cache", cache)
+    server_db.list_devices(company_name="Trane")
+    server_db.list_devices(location_name="Warehouse")
+    server_db.list_devices(company_name="Trane")
+    server_db.get_facility_summary()  # evicts the location_name entry
+    server_db.list_devices(company_name="Trane")
+    server_db.list_devices(location_name="Warehouse")
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 4, 2)
+
+
+def test_totals_follow_retention(server_db):
+    retention = server_db.RetentionManager(events_days=0, readings_days=30, pings_days=0)
+    retention.run_once(now=datetime.now(timezone.utc) + timedelta(days=2))
+    assert summary_totals(server_db.get_facility_summary()) == counted_totals(server_db)
+    assert counted_totals(server_db)[1] == 0
@@ -0,0 +1,115 @@
+"""Parquet tier: export of closed days and tools reading across SQLite and Parquet."""
+
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("duckdb")
+
+DAY_MS = 86_400_000
+DAY0 = int(datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp() * 1000)
+NOW = DAY0 + 3 * DAY_MS + 12 * 3_600_000  # days 0-2 are closed, day 3 is still hot
+
+
+def insert(server, rows):
+    with server.db.writer() as conn, conn:
+        conn.executemany(
+            "INSERT INTO sensor_readings (device_id, sensor_id, name, type, value, unit, channel, ts) "
+            "VALUES (?, 1, 'Temperature', 'temp', ?, 'c', 3, ?)", rows)
+
+
+@pytest.fixture
+def tiered(server_db, monkeypatch, tmp_path):
+    columnar = server_db.ColumnarStore(directory=str(tmp_path / "parquet"))
+    monkeypatch.setattr(server_db, "columnar", columnar)
+    insert(server_db, [(device, -20 + day + hour / 100, DAY0 + day * DAY_MS + hour * 3_600_000)
+                       for device in ("freezer-1", "freezer-2") for day in range(4) for hour in (1, 9, 17)])
+    return server_db
+
+
+def history_values(server, **kwargs):
+    result = server.get_reading_history("freezer-1", limit=100, **kwargs)
+    return [float(line.split(": ")[1].split()[0]) for line in result.splitlines() if line.startswith("- ")]
+
+
+def test_closed_days_move_to_parquet_and_tools_merge_both_tiers(tiered):
+    assert tiered.columnar.export_once(now_ms=NOW) == 18 + 5  # + the sample uplink's readings
+    partitions = sorted(p.parent.name for p in tiered.columnar.readings_dir.glob("*/*.parquet"))
+    assert partitions == ["date=2021-02-24", "date=2024-03-01", "date=2024-03-02", "date=2024-03-03"]
+    with tiered.db.reader() as conn:
+        assert tiered.columnar.boundary(conn) == DAY0 + 3 * DAY_MS
+
+    # Newest first across the boundary: 3 hot readings from day 3, then 9 from Parquet
+    values = history_values(tiered)
+    assert len(values) == 12 and values == sorted(values, reverse=True)
+    first_page = tiered.get_reading_history("freezer-1", limit=4)
+    cursor = first_page.splitlines()[-1].split("Next page: ")[1]
+    before_ts, before_id = (int(part.split("=")[1]) for part in cursor.split(", "))
+    assert history_values(tiered, before_ts=before_ts, before_id=before_id) == values[4:]
+
+    result = tiered.query_sensor_data(location_name=None, device_id="freezer-2", max_value=-18.5,
+                                      start="2024-03-01")
+    assert "Query results (6 rows)" in result  # day 0 and day 1 readings, all in Parquet
+    fleet = tiered.query_sensor_data(sensor_type="temp", start="2024-03-02", end="2024-03-03")
+    assert "Query results (6 rows)" in fleet
+
+
+def test_late_readings_are_appended_and_retention_waits_for_export(tiered):
+    retention = tiered.RetentionManager(events_days=0, readings_days=1, pings_days=0)
+    future = datetime.fromtimestamp(NOW / 1000, tz=timezone.utc) + timedelta(days=10)
+    # Nothing exported yet: retention leaves the history readings alone
+    assert retention.run_once(now=future)["sensor_readings"] == 0
+
+    tiered.columnar.export_once(now_ms=NOW)
+    insert(tiered, [("freezer-1", -30.0, DAY0 + DAY_MS + 5 * 3_600_000)])  # late uplink for day 1
+    assert tiered.columnar.export_once(now_ms=NOW) == 1
+    assert -30.0 in history_values(tiered)
+
+    # Retention drops exported readings only; history is still complete from Parquet
+    assert retention.run_once(now=future)["sensor_readings"] == 19 + 5  # + the sample uplink's readings
+    assert len(history_values(tiered)) == 13
+    assert tiered.columnar.stats()["exported_rows"] == 19 + 5
+
+
+def test_files_of_an_unfinished_export_are_replaced(tiered):
+    tiered.columnar.export_once(now_ms=NOW)
+    # A run that wrote its files but died before committing columnar_state
+    first = next(tiered.columnar.readings_dir.glob("*/*.parquet"))
+    shutil.copy(first, first.with_name("run2_crashed.parquet"))
+
+    insert(tiered, [("freezer-1", -30.0, DAY0 + 5 * 3_600_000)])
+    tiered.columnar.export_once(now_ms=NOW)
+    assert len(history_values(tiered)) == 13
+
+
+def test_a_day_closing_without_new_readings_stays_exported(tiered):
+    tiered.columnar.export_once(now_ms=NOW)
+    # The next day closes, but no reading arrived since the last run: same max_id, new files
+    assert tiered.columnar.export_once(now_ms=NOW + DAY_MS) == 6
+    insert(tiered, [("freezer-1", -30.0, DAY0 + DAY_MS + 5 * 3_600_000)])
+    assert tiered.columnar.export_once(now_ms=NOW + DAY_MS) == 1
+
+    partitions = {p.parent.name for p in tiered.columnar.readings_dir.glob("*/*.parquet")}
+    assert "date=2024-03-04" in partitions
+    assert len(history_values(tiered)) == 13 and tiered.columnar.stats()["exported_rows"] == 18 + 5 + 6 + 1
+
+
+def test_retention_keeps_late_readings_until_they_are_exported(tiered):
+    retention = tiered.RetentionManager(events_days=0, readings_days=1, pings_days=0)
+    future = datetime.fromtimestamp(NOW / 1000, tz=timezone.utc) + timedelta(days=10)
+    tiered.columnar.export_once(now_ms=NOW)
+    insert(tiered, [("freezer-1", -30.0, DAY0 + DAY_MS + 5 * 3_600_000)])  # late, below the boundary
+
+    assert retention.run_once(now=future)["sensor_readings"] == 18 + 5
+    assert tiered.columnar.export_once(now_ms=NOW) == 1
+    assert -30.0 in history_values(tiered) and len(history_values(tiered)) == 13
+
+
+def test_text_values_do_not_stall_the_export(tiered):
+    insert(tiered, [("door-1", "open", DAY0 + 3_600_000), ("door-1", 1, DAY0 + 7_200_000)])
+    assert tiered.columnar.export_once(now_ms=NOW) == 18 + 5 + 2
+    values = tiered.columnar.query("SELECT value FROM cold_readings WHERE device_id = 'door-1' ORDER BY ts")
+    assert [r["value"] for r in values] == [None, 1.0]
+    insert(tiered, [("freezer-1", -30.0, DAY0 + DAY_MS + 5 * 3_600_000)])
+    assert tiered.columnar.export_once(now_ms=NOW) == 1
@@ -0,0 +1,69 @@
+"""Duplicate delivery suppression: in-memory window and unique-index backstop."""
+
+import copy
+
+from fastapi.testclient import TestClient
+
+from test_webhook import ALERT_PAYLOAD, UPLINK_PAYLOAD
+
+
+def alert(correlation_id="0937ce89-b5fc-410a-8375-fcc72c5fc3a4"):
+    payload = copy.deepcopy(ALERT_PAYLOAD)
+    payload["event_data"]["correlation_id"] = correlation_id
+    return payload
+
+
+def table_counts(server):
+    with server.db.reader() as conn:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("events", "sensor_readings", "alerts")}
+
+
+def test_webhook_retries_are_acknowledged_but_not_stored(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "INGEST_MODE", "direct")
+    client = TestClient(server_db.app)
+    uplink = copy.deepcopy(UPLINK_PAYLOAD)
+    uplink["event_data"]["fcnt"] = 13
+    before = table_counts(server_db)
+
+    statuses = [client.post("/webhook", json=uplink).json()["status"] for _ in range(3)]
+    # Same (device_id, fcnt, timestamp) relayed under another correlation_id: still a duplicate
+    relayed = dict(uplink, event_data=dict(uplink["event_data"], correlation_id="via-gateway-2"))
+    statuses.append(client.post("/webhook", json=relayed).json()["status"])
+    statuses += [client.post("/webhook", json=alert()).json()["status"] for _ in range(2)]
+
+    assert statuses == ["ok", "duplicate", "duplicate", "duplicate", "ok", "duplicate"]
+    after = table_counts(server_db)
+    assert after["events"] == before["events"] + 2
+    assert after["sensor_readings"] == before["sensor_readings"] + len(uplink["event_data"]["payload"])
+    assert after["alerts"] == before["alerts"] + 1
+
+    stats = client.get("/health").json()["dedup"]
+    assert stats["duplicates"] == 4 and stats["duplicates_by_type"] == {"uplink": 3, "alert": 1}
+
+
+def test_unique_index_catches_duplicates_outside_the_window(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "dedup", server_db.DedupFilter(capacity=0))  # e.g. after a restart
+    with server_db.db.writer() as conn:
+        server_db.store_events(conn, [alert()])
+    before = table_counts(server_db)
+
+    with server_db.db.writer() as conn:
+        server_db.store_events(conn, [copy.deepcopy(UPLINK_PAYLOAD), alert(), alert()])
+
+    assert table_counts(server_db) == before
+    assert server_db.dedup.db_duplicates == 3
+    assert server_db.latest_cache.counts(UPLINK_PAYLOAD["event_data"]["device_id"])[0] == \
+        before["sensor_readings"]
+
+
+def test_window_is_reloaded_and_bounded(server_db):
+    with server_db.db.writer() as conn:
+        server_db.store_events(conn, [alert()])
+    fresh = server_db.DedupFilter(capacity=2)
+    with server_db.db.reader() as conn:
+        fresh.load(conn)  # the two newest keyed events: the sample ping and the alert
+
+    assert not fresh.admit(alert())
+    assert fresh.admit(copy.deepcopy(UPLINK_PAYLOAD))  # evicted: left to the unique index
+    assert fresh.stats()["tracked_keys"] == 2
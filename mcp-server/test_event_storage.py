@@ -0,0 +1,89 @@
+"""Compact raw-event storage: metadata interning and lossless reconstruction."""
+
+import copy
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from test_webhook import ALERT_PAYLOAD, PING_PAYLOAD, UPLINK_PAYLOAD
+
+
+def redelivered_ping(correlation_id="second-delivery"):
+    """The sample ping under a new correlation_id, so it is not dropped as a duplicate."""
+    payload = copy.deepcopy(PING_PAYLOAD)
+    payload["event_data"]["correlation_id"] = correlation_id
+    return payload
+
+
+def stored_events(server):
+    with server.db.reader() as conn:
+        rows = conn.execute("SELECT * FROM events ORDER BY id").fetchall()
+        return rows, [server.event_codec.decode(conn, r) for r in rows]
+
+
+def test_events_round_trip_with_key_order(server_db):
+    rows, payloads = stored_events(server_db)
+    assert payloads == [UPLINK_PAYLOAD, ALERT_PAYLOAD, PING_PAYLOAD]
+    assert [list(p) for p in payloads] == [list(UPLINK_PAYLOAD), list(ALERT_PAYLOAD), list(PING_PAYLOAD)]
+    assert all(r["raw_json"] == "" and r["body"] for r in rows)
+
+
+def test_metadata_blocks_are_interned_once(server_db):
+    with server_db.db.reader() as conn:
+        before = conn.execute("SELECT COUNT(*) FROM event_metadata").fetchone()[0]
+
+    batch = []
+    for i in range(50):
+        payload = copy.deepcopy(UPLINK_PAYLOAD)
+        payload["event_data"]["fcnt"] = 100 + i
+        batch.append(payload)
+    with server_db.db.writer() as conn:
+        server_db.store_events(conn, batch)
+
+    rows, _ = stored_events(server_db)
+    with server_db.db.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM event_metadata").fetchone()[0] == before
+    stored = sum(len(r["body"]) for r in rows[3:]) / 50
+    assert stored * 4 < len(json.dumps(UPLINK_PAYLOAD))
+
+
+def test_raw_mode_and_legacy_rows_decode(server_db, monkeypatch):
+    monkeypatch.setattr(server_db.event_codec, "mode", "raw")
+    with server_db.db.writer() as conn:
+        server_db.store_events(conn, [redelivered_ping()])
+    rows, payloads = stored_events(server_db)
+    assert rows[-1]["body"] is None and json.loads(rows[-1]["raw_json"]) == redelivered_ping()
+    assert payloads[-1] == redelivered_ping()
+
+    log = server_db.get_event_log(include_payload=True, limit=4)
+    assert log.count('"event_type":"uplink"') == 1
+
+
+def test_webhook_stores_request_body_verbatim(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "INGEST_MODE", "direct")
+    monkeypatch.setattr(server_db.event_codec, "mode", "raw")
+    body = json.dumps(redelivered_ping(), indent=1, ensure_ascii=True)
+
+    response = TestClient(server_db.app).post("/webhook", content=body,
+                                              headers={"content-type": "application/json"})
+
+    assert response.json() == {"status": "ok", "event_type": "ping"}
+    rows, payloads = stored_events(server_db)
+    assert rows[-1]["raw_json"] == body and payloads[-1] == redelivered_ping()
+    assert TestClient(server_db.app).post("/webhook", content=b"{not json").status_code == 400
+
+
+def test_codec_backends_produce_identical_bytes(monkeypatch):
+    import server
+
+    if server.orjson is None:
+        pytest.skip("orjson not installed")
+    payload = copy.deepcopy(UPLINK_PAYLOAD)
+    payload["location"]["name"] = "Café Nord — Bâtiment 2"
+    samples = [payload, ALERT_PAYLOAD, PING_PAYLOAD, {"big": 2**70, "ratio": 0.1}]
+    fast = [server.json_dumps(p) for p in samples]
+
+    monkeypatch.setattr(server, "orjson", None)
+    assert [server.json_dumps(p) for p in samples] == fast
+    assert [server.json_loads(b) for b in fast] == samples
@@ -0,0 +1,72 @@
+"""Output formats of the MCP tools: compact and json answers, and the max_chars budget."""
+
+import json
+
+import pytest
+
+from test_webhook import UPLINK_PAYLOAD
+
+DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+
+
+@pytest.fixture
+def history(server_db):
+    """Five channels with 100 readings each for the fixture device."""
+    channels = [("Temperature", "temp", "c", 3), ("Humidity", "rel_hum", "p", 4), ("Battery", "batt", "p", 5),
+                ("RSSI", "rssi", "dbm", 6), ("SNR", "snr", "db", 7)]
+    with server_db.db.writer() as conn, conn:
+        conn.executemany(
+            "INSERT INTO sensor_readings (device_id, sensor_id, name, type, value, unit, channel, ts) "
+            "VALUES (?, 1, ?, ?, ?, ?, ?, ?)",
+            [(DEVICE, name, kind, round(20 + (i * 7 + channel) % 13 * 0.37, 2), unit, channel,
+              1_700_000_000_000 + i * 60_000)
+             for i in range(100) for name, kind, unit, channel in channels],
+        )
+    return server_db
+
+
+def test_compact_and_json_are_smaller_or_equal(history):
+    sizes = {fmt: len(history.get_reading_history(DEVICE, limit=500, format=fmt))
+             for fmt in history.OUTPUT_FORMATS}
+    assert sizes["compact"] < sizes["markdown"] * 0.5
+    assert sizes["json"] < sizes["markdown"] * 1.1
+
+    compact = history.get_reading_history(DEVICE, limit=500, format="compact")
+    assert "unit by name: " in compact and "Temperature=c" in compact  # factored out of every row
+    assert "device_id: " not in compact.splitlines()[-1]
+
+
+def test_json_keeps_raw_values_and_pages(history):
+    answer = json.loads(history.get_reading_history(DEVICE, limit=50, format="json"))
+    assert answer["columns"][:2] == ["ts", "name"] and len(answer["rows"]) == 50
+    assert all(isinstance(row[0], int) for row in answer["rows"])  # epoch milliseconds
+    assert answer["next_page"]["before_ts"] == answer["rows"][-1][0]
+
+    older = json.loads(history.get_reading_history(DEVICE, limit=50, format="json", **answer["next_page"]))
+    assert older["rows"][0][0] <= answer["rows"][-1][0] and older["rows"] != answer["rows"]
+
+
+def test_max_chars_downsamples_series(history):
+    full = history.get_reading_history(DEVICE, limit=500)
+    for fmt in history.OUTPUT_FORMATS:
+        answer = history.get_reading_history(DEVICE, limit=500, format=fmt, max_chars=4000)
+        assert len(answer) <= 4000 < len(full)
+        assert "Downsampled to" in answer and "Left out: " in answer
+    compact = history.get_reading_history(DEVICE, limit=500, format="compact", max_chars=4000)
+    rows = [line.split("\t") for line in compact.splitlines() if line.count("\t") >= 2][1:]
+    assert {row[1] for row in rows} == {"Temperature", "Humidity", "Battery", "RSSI", "SNR"}
+    # Every series keeps its extremes
+    assert {"20.0", "24.44"} <= {row[2] for row in rows if row[1] == "Temperature"}
+
+
+def test_max_chars_keeps_markdown_within_budget(server_db):
+    full = server_db.list_devices()
+    answer = server_db.list_devices(max_chars=len(full) - 1)
+    assert len(answer) < len(full) and "Showing the first" in answer and answer.endswith("...")
+    assert server_db.list_devices(max_chars=100_000) == server_db.list_devices()
+
+
+def test_unknown_format_and_empty_results(server_db):
+    assert server_db.get_alerts(format="xml") == "Invalid format 'xml'. Use markdown, compact, json."
+    assert server_db.get_reading_history("no-such-device", format="json") == \
+        server_db.get_reading_history("no-such-device")
@@ -0,0 +1,79 @@
+"""Gateway health state: ingest upserts, offline sweep and raw ping history."""
+
+import copy
+from datetime import datetime, timedelta, timezone
+
+from test_webhook import PING_PAYLOAD
+
+GATEWAY = PING_PAYLOAD["event_data"]["device_id"]
+FIRST_PING = PING_PAYLOAD["event_data"]["timestamp"]
+
+
+def ping(gateway=GATEWAY, ts=FIRST_PING, name="Gateway-Tektelic-01"):
+    payload = copy.deepcopy(PING_PAYLOAD)
+    payload["event_data"]["device_id"] = gateway
+    payload["event_data"]["timestamp"] = ts
+    payload["event_data"]["correlation_id"] = f"{gateway}-{ts}"
+    payload["device"]["thing_name"] = name
+    return payload
+
+
+def store(server, payloads):
+    with server.db.writer() as conn:
+        server.store_events(conn, payloads)
+
+
+def state(server, gateway=GATEWAY):
+    with server.db.reader() as conn:
+        return conn.execute("SELECT * FROM gateway_state WHERE device_id = ?", (gateway,)).fetchone()
+
+
+def test_pings_maintain_one_state_row_per_gateway(server_db):
+    # The fixture already stored one ping; three more a minute apart, plus one out of order
+    store(server_db, [ping(ts=FIRST_PING + 60_000 * i) for i in (3, 1, 2)])
+    store(server_db, [ping(ts=FIRST_PING + 30_000)])
+
+    row = state(server_db)
+    assert row["ping_count"] == 5
+    assert row["first_ping_ts"] == FIRST_PING and row["last_ping_ts"] == FIRST_PING + 180_000
+    assert row["avg_interval_ms"] == 60_000
+    with server_db.db.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM gateway_pings").fetchone()[0] == 5
+
+
+def test_sweep_flags_silent_gateways_offline_first(server_db):
+    now = datetime.fromtimestamp(FIRST_PING / 1000, tz=timezone.utc)
+    store(server_db, [ping("gw-quiet", FIRST_PING - 700_000, "Quiet"),
+                      ping("gw-chatty", FIRST_PING, "Chatty")] * 3)
+    sweeper = server_db.GatewaySweeper(stale_seconds=600, offline_seconds=1800)
+
+    assert sweeper.run_once(now) == [("gw-quiet", "Quiet", "stale")]
+    assert set(sweeper.run_once(now + timedelta(seconds=1200))) == {
+        ("gw-quiet", "Quiet", "offline"), ("gw-chatty", "Chatty", "stale"),
+        (GATEWAY, "Gateway-Tektelic-01", "stale")}
+    assert sweeper.run_once(now + timedelta(seconds=1200)) == []
+
+    report = server_db.get_gateway_status()
+    lines = [line for line in report.splitlines() if line.startswith("- ")]
+    assert "1 offline, 2 stale, 0 online" in report
+    assert len(lines) == 3 and "Quiet" in lines[0] and "OFFLINE" in lines[0]
+
+    # A newer ping brings the gateway straight back online
+    store(server_db, [ping("gw-quiet", FIRST_PING + 1_200_000, "Quiet")])
+    assert state(server_db, "gw-quiet")["status"] == "online"
+
+
+def test_sampled_ping_history(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "PING_HISTORY", "sampled")
+    monkeypatch.setattr(server_db, "PING_SAMPLE_SECONDS", 300)
+    store(server_db, [ping(ts=FIRST_PING + 60_000 * i) for i in range(1, 11)])
+
+    with server_db.db.reader() as conn:
+        kept = [r[0] for r in conn.execute("SELECT ts FROM gateway_pings ORDER BY ts")]
+    assert kept == [FIRST_PING, FIRST_PING + 300_000, FIRST_PING + 600_000]
+    assert state(server_db)["ping_count"] == 11
+
+    monkeypatch.setattr(server_db, "PING_HISTORY", "off")
+    store(server_db, [ping(ts=FIRST_PING + 3_600_000)])
+    with server_db.db.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM gateway_pings").fetchone()[0] == 3
@@ -0,0 +1,51 @@
+"""Ingest path: batched storage side effects."""
+
+import copy
+
+from test_webhook import UPLINK_PAYLOAD, uplink
+
+UPLINK_DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+
+
+def traced_store(server, payloads):
+    statements = []
+    with server.db.writer() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            server.store_events(conn, payloads)
+        finally:
+            conn.set_trace_callback(None)
+    # Trigger programs (the devices_fts sync) trace their statements as "-- ..." comments and
+    # report the statement that fired them again as they start
+    return list(dict.fromkeys(s for s in statements if "devices" in s and not s.startswith("--")))
+
+
+def test_known_device_skips_upsert_and_throttles_last_seen(server_db):
+    # Same metadata, inside the last_seen interval: no devices statement at all
+    assert traced_store(server_db, [uplink(100)]) == []
+
+    # Interval elapsed: one coalesced last_seen update for the whole batch
+    server_db.device_registry.last_seen_interval = 0
+    statements = traced_store(server_db, [uplink(fcnt) for fcnt in range(100, 103)])
+    assert len(statements) == 1 and statements[0].lstrip().startswith("UPDATE devices SET last_seen")
+
+
+def test_changed_metadata_is_refreshed(server_db):
+    payload = uplink(100)
+    payload["device"]["thing_name"] = "AHU-01 Supply Air (renamed)"
+    payload["location"]["name"] = "Building B"
+    statements = traced_store(server_db, [payload])
+    assert len(statements) == 1 and "ON CONFLICT" in statements[0]
+
+    with server_db.db.reader() as conn:
+        row = conn.execute("SELECT thing_name, location_name, location_city, first_seen FROM devices "
+                           "WHERE device_id = ?", (UPLINK_DEVICE,)).fetchone()
+    assert (row["thing_name"], row["location_name"], row["location_city"]) == \
+        ("AHU-01 Supply Air (renamed)", "Building B", "Erie")
+    assert row["first_seen"] is not None
+
+    # Partial metadata (fields absent from the event) does not count as a change
+    partial = copy.deepcopy(payload)
+    partial["event_data"]["fcnt"] = 101
+    del partial["device_type"]
+    assert traced_store(server_db, [partial]) == []
@@ -0,0 +1,136 @@
+"""Live feed: filtered, bounded subscriptions, the /stream SSE endpoint and MCP resource notifications."""
+
+import asyncio
+import copy
+import json
+
+from mcp.shared.memory import create_connected_server_and_client_session
+from starlette.concurrency import run_in_threadpool
+
+import test_webhook
+from test_webhook import ALERT_PAYLOAD, PING_PAYLOAD, UPLINK_PAYLOAD
+
+DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+ALERT_DEVICE = ALERT_PAYLOAD["event_data"]["thingId"]
+
+
+def uplink(fcnt, temp, device_id=DEVICE):
+    payload = test_webhook.uplink(fcnt, device_id=device_id)
+    for reading in payload["event_data"]["payload"]:
+        reading["timestamp"] = 1_700_000_000_000 + fcnt
+        if reading["type"] == "temp":
+            reading["value"] = temp
+    return payload
+
+
+def ping(correlation_id):
+    payload = copy.deepcopy(PING_PAYLOAD)
+    payload["event_data"]["correlation_id"] = correlation_id
+    return payload
+
+
+def store(server, payloads):
+    with server.db.writer() as conn:
+        return server.store_events(conn, payloads)
+
+
+def test_subscriptions_filter_and_bound_their_buffers(server_db):
+    async def run():
+        feed = server_db.live_feed
+        temps = feed.subscribe(device_ids=[DEVICE], sensor_types=["temp"], event_types=["uplink"])
+        site = feed.subscribe(location="warehouse", policy="coalesce", max_queue=12)
+        tail = feed.subscribe(max_queue=4)
+        await run_in_threadpool(store, server_db, [uplink(1, 20.5), uplink(2, 21.0), uplink(3, 21.5, "other"),
+                                                   copy.deepcopy(ALERT_PAYLOAD), ping("live-1")])
+        return await temps.get(), await site.get(), await tail.get(), site, tail, feed.stats()
+
+    temps, site, tail, site_sub, tail_sub, stats = asyncio.run(run())
+    assert [(m["device_id"], m["sensor_type"], m["value"]) for m in temps] == [(DEVICE, "temp", 20.5),
+                                                                             (DEVICE, "temp", 21.0)]
+    # Coalescing keeps the newest message per channel and alert rule (the ping has no location)
+    assert len(site) == 11 and site_sub.coalesced == 5 and site_sub.dropped == 0
+    assert [m["value"] for m in site if m["event_type"] == "uplink" and m["sensor_type"] == "temp"] == [21.0, 21.5]
+    assert site[-1]["event_type"] == "alert"
+    assert [m["event_type"] for m in tail] == ["uplink", "uplink", "alert", "ping"]
+    assert tail_sub.dropped == 13
+    assert [m["seq"] for m in tail] == sorted(m["seq"] for m in tail)
+    assert stats["subscribers"] == 3 and stats["published"] == 17
+
+
+def test_nothing_is_built_without_subscribers(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "_live_message", None)  # would raise if store_events called it
+    assert store(server_db, [uplink(4, 19.0)]) == 1
+    assert server_db.live_feed.published == 0
+
+
+def test_stream_endpoint_sends_matching_events(server_db):
+    async def run():
+        response = await server_db.live_stream(device_id=f"{DEVICE},{ALERT_DEVICE}", event_type="uplink,alert",
+                                               sensor_type="temp")
+        body = response.body_iterator
+        assert await body.__anext__() == b": connected\n\n"
+        await run_in_threadpool(store, server_db, [uplink(5, 22.0), copy.deepcopy(ALERT_PAYLOAD),
+                                                   ping("live-2")])
+        chunk = await body.__anext__()
+        open_streams = server_db.live_feed.subscribers
+        await body.aclose()
+        return chunk, open_streams
+
+    chunk, open_streams = asyncio.run(run())
+    events = [block.split("\n") for block in chunk.decode().strip().split("\n\n")]
+    assert [lines[1] for lines in events] == ["event: uplink", "event: alert"]
+    reading = json.loads(events[0][2][len("data: "):])
+    assert (reading["device_id"], reading["sensor_type"], reading["value"]) == (DEVICE, "temp", 22.0)
+    assert reading["location"] == "Building A - Warehouse"
+    assert open_streams == 1 and server_db.live_feed.subscribers == 0
+
+
+def test_stream_rejects_unknown_filters(server_db):
+    from fastapi.testclient import TestClient
+    client = TestClient(server_db.app)
+    assert client.get("/stream", params={"policy": "newest"}).status_code == 400
+    assert client.get("/stream", params={"event_type": "reading"}).status_code == 400
+
+
+def test_resource_subscribers_get_one_notification_per_update(server_db):
+    class Session:
+        def __init__(self):
+            self.updated = []
+
+        async def send_resource_updated(self, uri):
+            self.updated.append(str(uri))
+
+    async def run():
+        session = Session()
+        notifier = server_db.resource_notifier
+        notifier.subscribe(session, f"cognituv://devices/{DEVICE}/latest")
+        notifier.subscribe(session, "cognituv://alerts")
+        await asyncio.sleep(0)  # let the notifier subscribe to the feed
+        await run_in_threadpool(store, server_db, [uplink(6, 23.0), uplink(7, 23.5)])
+        await run_in_threadpool(store, server_db, [copy.deepcopy(ALERT_PAYLOAD)])
+        for _ in range(100):
+            if len(session.updated) >= 2:
+                break
+            await asyncio.sleep(0.01)
+        await notifier.stop()
+        return session.updated
+
+    updated = asyncio.run(run())
+    assert updated == [f"cognituv://devices/{DEVICE}/latest", "cognituv://alerts"]
+    assert "23.5" in server_db.latest_readings_resource(DEVICE)
+
+
+def test_mcp_clients_can_subscribe_to_resources(server_db):
+    # Guards the low-level hooks server.py uses for subscriptions against SDK changes
+    async def run():
+        uri = f"cognituv://devices/{DEVICE}/latest"
+        async with create_connected_server_and_client_session(server_db.mcp) as client:
+            initialized = await client.initialize()
+            await client.subscribe_resource(uri)
+            subscribed = server_db.resource_notifier.stats()["subscriptions"]
+            await client.unsubscribe_resource(uri)
+        await server_db.resource_notifier.stop()
+        return initialized.capabilities.resources.subscribe, subscribed
+
+    assert asyncio.run(run()) == (True, 1)
+    assert server_db.resource_notifier.stats()["subscriptions"] == 0
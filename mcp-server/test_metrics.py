@@ -0,0 +1,72 @@
+"""GET /metrics, the per-tool instrumentation and the slow query log."""
+
+import asyncio
+import logging
+
+import pytest
+from fastapi.testclient import TestClient
+
+from test_webhook import UPLINK_PAYLOAD, uplink
+
+UPLINK_DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+
+
+def scrape(server):
+    text = TestClient(server.app).get("/metrics").text
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line and not line.startswith("#")}
+
+
+def test_ingest_counters_latency_and_gauges(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "INGEST_MODE", "direct")
+    client = TestClient(server_db.app)
+    assert client.post("/webhook", json=uplink(200)).json()["status"] == "ok"
+    assert client.post("/webhook", json=uplink(200)).json()["status"] == "duplicate"
+    assert client.post("/webhook", content=b"{not json").status_code == 400
+
+    samples = scrape(server_db)
+    assert samples['cognituv_events_stored_total{event_type="uplink"}'] == 2  # fixture + one new event
+    assert samples['cognituv_events_stored_total{event_type="alert"}'] == 1
+    assert samples['cognituv_events_duplicate_total{event_type="uplink",stage="filter"}'] == 1
+    assert samples['cognituv_events_rejected_total{reason="invalid_json"}'] == 1
+    assert samples['cognituv_webhook_duration_seconds_count{endpoint="/webhook"}'] == 3
+    assert samples['cognituv_webhook_duration_seconds_bucket{endpoint="/webhook",le="+Inf"}'] == 3
+    assert samples["cognituv_uplink_readings_count"] == 2 and samples["cognituv_uplink_readings_sum"] == 10
+    assert samples['cognituv_uplink_readings_bucket{le="4"}'] == 0
+    assert samples["cognituv_db_commit_duration_seconds_count"] == 2
+    with server_db.db.reader() as conn:
+        readings = conn.execute("SELECT COUNT(*) FROM sensor_readings").fetchone()[0]
+    assert samples['cognituv_db_rows{table="sensor_readings"}'] == readings
+    assert samples['cognituv_db_size_bytes{file="db"}'] > 0
+
+
+def test_tools_are_timed_and_errors_counted(server_db, monkeypatch):
+    server_db.list_devices()
+    server_db.list_devices(company_name="Trane")
+    monkeypatch.setattr(server_db, "_render", None)
+    with pytest.raises(TypeError):
+        server_db.get_alerts()
+
+    samples = scrape(server_db)
+    assert samples['cognituv_tool_duration_seconds_count{tool="list_devices"}'] == 2
+    assert samples['cognituv_tool_duration_seconds_count{tool="get_alerts"}'] == 1
+    assert samples['cognituv_tool_errors_total{tool="get_alerts"}'] == 1
+
+
+def test_every_registered_tool_is_instrumented(server_db):
+    names = [tool.name for tool in asyncio.run(server_db.mcp.list_tools())]
+    assert len(names) == 12
+    assert [name for name in names if not hasattr(getattr(server_db, name), "__wrapped__")] == []
+
+
+def test_slow_tool_calls_are_logged_with_sql_and_plan(server_db, monkeypatch, caplog):
+    monkeypatch.setattr(server_db, "slow_query_log", server_db.SlowQueryLog(threshold_ms=0.001))
+    server_db.db.close()  # readers reopen with the trace callback
+    with caplog.at_level(logging.WARNING, logger="cognituv"):
+        server_db.get_reading_history(UPLINK_DEVICE, sensor_type="temp")
+
+    [record] = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Slow tool call")]
+    assert record.startswith("Slow tool call: get_reading_history(device_id=")
+    assert f"WHERE device_id = '{UPLINK_DEVICE}'" in " ".join(record.split())
+    assert "plan: SEARCH sensor_readings USING INDEX" in record
+    assert server_db.metrics.value("cognituv_slow_tool_calls_total") == 1
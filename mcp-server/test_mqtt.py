@@ -0,0 +1,135 @@
+"""MQTT ingest: message handling, and an end-to-end run against a local mosquitto broker."""
+
+import asyncio
+import json
+import shutil
+import socket
+import subprocess
+import time
+from pathlib import Path
+
+import pytest
+
+import test_webhook
+
+MQTT_UPLINK = json.loads((Path(__file__).resolve().parent.parent / "docs" / "mqtt" / "uplink.json").read_text())
+
+
+def uplink(fcnt, with_type=True):
+    payload = test_webhook.uplink(fcnt, base=MQTT_UPLINK)
+    if not with_type:
+        del payload["event_type"]
+    return json.dumps(payload).encode()
+
+
+def stored_uplinks(server):
+    with server.db.reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM events WHERE event_type = 'uplink'").fetchone()[0]
+
+
+def test_messages_feed_the_ingest_path(server_db, monkeypatch):
+    monkeypatch.setattr(server_db, "INGEST_MODE", "direct")
+    subscriber = server_db.MqttSubscriber(host="broker.test")
+    before = stored_uplinks(server_db)
+
+    async def deliver():
+        return [await subscriber.handle("cognituv/site-1/uplink", body) for body in (
+            uplink(40), uplink(40), uplink(41, with_type=False), b"not json", b"[1, 2]")]
+
+    assert asyncio.run(deliver()) == ["stored", "duplicate", "stored", "invalid", "invalid"]
+    assert stored_uplinks(server_db) == before + 2
+    # MQTT uplinks carry no device block; readings are still stored under the device id
+    rows = server_db.get_latest_readings(device_id=MQTT_UPLINK["event_data"]["device_id"])
+    assert "Temperature" in rows
+    stats = subscriber.stats()
+    assert (stats["received"], stats["accepted"], stats["duplicates"], stats["invalid"]) == (5, 2, 1, 2)
+
+
+def test_store_failures_are_logged_and_redelivery_is_stored(server_db, monkeypatch, caplog):
+    monkeypatch.setattr(server_db, "INGEST_MODE", "direct")
+    subscriber = server_db.MqttSubscriber(host="broker.test")
+    store = server_db.store_events_direct
+
+    def locked(*args):
+        raise server_db.sqlite3.OperationalError("database is locked")
+
+    async def deliver():
+        monkeypatch.setattr(server_db, "store_events_direct", locked)
+        first = await subscriber.handle("cognituv/uplink", uplink(45))
+        monkeypatch.setattr(server_db, "store_events_direct", store)
+        return [first, await subscriber.handle("cognituv/uplink", uplink(45))]  # the broker redelivers
+
+    before = stored_uplinks(server_db)
+    assert asyncio.run(deliver()) == ["error", "stored"]
+    assert stored_uplinks(server_db) == before + 1
+    assert subscriber.stats()["errors"] == 1 and "database is locked" in caplog.text
+
+
+def test_full_writer_queue_pauses_instead_of_dropping(server_db, monkeypatch):
+    writer = server_db.IngestWriter(max_queue=1)
+    monkeypatch.setattr(server_db, "ingest_writer", writer)
+    subscriber = server_db.MqttSubscriber(host="broker.test")
+
+    async def deliver():
+        assert await subscriber.handle("cognituv/uplink", uplink(50)) == "queued"
+        second = asyncio.ensure_future(subscriber.handle("cognituv/uplink", uplink(51)))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        writer.queue.get_nowait()  # the writer catches up
+        return await second
+
+    assert asyncio.run(deliver()) == "queued"
+    assert subscriber.backpressure_waits > 0 and writer.rejected == 0
+
+
+@pytest.fixture
+def mosquitto(tmp_path):
+    """A throwaway mosquitto broker on a free local port."""
+    binary = shutil.which("mosquitto")
+    if binary is None:
+        pytest.skip("mosquitto not installed")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    config = tmp_path / "mosquitto.conf"
+    config.write_text(f"listener {port} 127.0.0.1\nallow_anonymous true\n")
+    proc = subprocess.Popen([binary, "-c", str(config)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                pytest.fail("mosquitto did not start")
+            time.sleep(0.05)
+    yield port
+    proc.terminate()
+    proc.wait(5)
+
+
+def test_subscriber_ingests_from_broker(server_db, monkeypatch, mosquitto):
+    aiomqtt = pytest.importorskip("aiomqtt")
+    writer = server_db.IngestWriter(flush_interval=0.01)
+    monkeypatch.setattr(server_db, "ingest_writer", writer)
+    subscriber = server_db.MqttSubscriber(host="127.0.0.1", port=mosquitto, topics=["cognituv/#"],
+                                          client_id="cognituv-test", reconnect_interval=0.1)
+    before = stored_uplinks(server_db)
+
+    async def scenario():
+        writer.start()
+        subscriber.start()
+        while not subscriber.connected:
+            await asyncio.sleep(0.02)
+        async with aiomqtt.Client("127.0.0.1", mosquitto) as publisher:
+            for fcnt in range(100, 200):
+                await publisher.publish("cognituv/site-1/uplink", uplink(fcnt), qos=1)
+        while subscriber.accepted < 100:
+            await asyncio.sleep(0.02)
+        await subscriber.stop()
+        writer.stop()
+
+    asyncio.run(asyncio.wait_for(scenario(), 20))
+    assert stored_uplinks(server_db) == before + 100
+    assert writer.batches < 100  # committed in batches, not per message
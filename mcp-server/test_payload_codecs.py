@@ -0,0 +1,113 @@
+"""Server-side payload codecs: golden vectors from examples/codecs/, ingest of undecoded uplinks and re-decoding."""
+
+import base64
+
+import pytest
+
+import payload_codecs
+import replay
+from test_webhook import UPLINK_PAYLOAD, uplink
+
+LHT65_PROBE = bytes.fromhex("0B4501050248010105")  # sample headers of examples/codecs/*.js
+LHT65_SOIL = bytes.fromhex("0B49FF3F024802")
+LDDS45 = bytes.fromhex("4b3a02000009000000")
+LDS03_OPEN = bytes.fromhex("0100000400000362f15ee2")
+LDS03_CLOSED = bytes.fromhex("0000010d00000e630e057f")
+
+
+def values(readings):
+    return {r["channel"]: r["value"] for r in readings}
+
+
+def test_lht65_golden_vectors():
+    readings = payload_codecs.decode("lorawan.dragino.lht65", LHT65_PROBE)
+    assert [(r["channel"], r["type"], r["unit"], r["name"]) for r in readings] == [
+        (3, "temp", "c", "Internal Temp"), (4, "rel_hum", "p", "Humidity"), (7, "temp", "c", "Probe Temp"),
+        (5, "batt", "p", "Battery"), (500, "voltage", "mv", "Battery Voltage")]
+    assert values(readings) == {3: 2.61, 4: 58.4, 7: 2.61, 5: 91.55, 500: 2885}
+    assert values(payload_codecs.decode("dragino-lht65", LHT65_SOIL)) == {3: -1.93, 4: 58.4, 5: 97.48, 500: 2889}
+
+    # Offsets in Fahrenheit degrees; an internal sensor reading of 327.67 (no value) is left out
+    calibrated = payload_codecs.decode("dragino-lht65", LHT65_PROBE,
+                                       options={"probe_offset": 1.8, "offset_unit": "f", "humidity_offset": -0.4})
+    assert values(calibrated)[7] == pytest.approx(3.61) and values(calibrated)[4] == pytest.approx(58.0)
+    missing = payload_codecs.decode("dragino-lht65", bytes.fromhex("0B457FFF0248010105"))
+    assert 3 not in values(missing) and values(missing)[5] == 78.76  # battery curve at 23 °C
+    with pytest.raises(payload_codecs.CodecError):
+        payload_codecs.decode("dragino-lht65", LHT65_PROBE[:8])
+
+
+def test_ldds45_golden_vector_and_rolling_level():
+    assert values(payload_codecs.decode("dragino-ldds45", LDDS45)) == {5: 100, 23: 51.2, 25: 0, 500: 0}
+    session = {}
+    first = payload_codecs.decode("dragino-ldds45", LDDS45, options={"height": 1}, session=session)
+    assert values(first) == {5: 100, 23: 51.2, 24: 48.8, 25: 50, 500: 1}
+
+    emptier = bytes.fromhex("4b3a03520009000000")  # 85 cm
+    assert values(payload_codecs.decode("dragino-ldds45", emptier, options={"height": 1}, session=session))[24] == 31.9
+    close = bytes.fromhex("4b3a00640009000000")  # 10 cm twice in a row: refilled, the average restarts full
+    payload_codecs.decode("dragino-ldds45", close, options={"height": 1}, session=session)
+    refilled = payload_codecs.decode("dragino-ldds45", close, options={"height": 1}, session=session)
+    assert values(refilled)[24] == 100 and session["levels"] == [100]
+    assert payload_codecs.decode("dragino-ldds45", bytes.fromhex("4b3a00140009000000")) == []  # invalid reading
+
+
+def test_lds03_door_statistics_follow_uplink_time():
+    session = {}
+    battery = payload_codecs.decode("dragino-lds03", bytes.fromhex("0a0121010f0c8a"), fport=5, session=session)
+    assert values(battery) == {5: 42} and session["battery"] == 42
+    opened = payload_codecs.decode("dragino-lds03", LDS03_OPEN, fport=2, ts=1_700_000_000_000, session=session)
+    assert values(opened)[244] == 1 and values(opened)[144] == 1 and values(opened)[5] == 42
+    closed = payload_codecs.decode("dragino-lds03", LDS03_CLOSED, fport=2, ts=1_700_000_150_000, session=session)
+    assert {ch: values(closed)[ch] for ch in (244, 144, 150, 151, 168, 503)} == {
+        244: 0, 144: 1, 150: 1, 151: 1, 168: 2.5, 503: 1}
+    assert payload_codecs.decode("dragino-lds03", LDS03_OPEN, fport=3) == []
+    with pytest.raises(payload_codecs.CodecError):
+        payload_codecs.decode("dragino-lds03", LDS03_OPEN[:10], fport=2)
+
+
+def lht65_uplink(fcnt, data):
+    payload = uplink(fcnt, timestamp=1_700_000_000_000 + fcnt, raw_format="base64",
+                     raw_payload=base64.b64encode(data).decode())
+    payload["device_type"]["codec"] = "lorawan.dragino.lht65"
+    for reading in payload["event_data"]["payload"]:
+        reading["timestamp"] = 1_700_000_000_000 + fcnt
+    return payload
+
+
+def test_uplinks_without_readings_are_decoded_at_ingest(server_db, monkeypatch):
+    bare = lht65_uplink(50, LHT65_PROBE)
+    bare["event_data"]["payload"] = []
+    with server_db.db.writer() as conn:
+        assert server_db.store_events(conn, [bare, lht65_uplink(51, LHT65_SOIL)]) == 2
+    with server_db.db.reader() as conn:
+        rows = conn.execute("SELECT channel, value, sensor_id FROM sensor_readings WHERE ts = ?",
+                            (1_700_000_000_050,)).fetchall()
+    assert {r["channel"]: r["value"] for r in rows} == {3: 2.61, 4: 58.4, 7: 2.61, 5: 91.55, 500: 2885}
+    assert server_db.raw_decoder.decoded == 1  # the uplink that already had readings was not decoded
+
+    monkeypatch.setattr(server_db, "DECODE_RAW_PAYLOADS", "off")
+    bare = lht65_uplink(52, LHT65_PROBE)
+    bare["event_data"]["payload"] = []
+    with server_db.db.writer() as conn:
+        assert server_db.store_events(conn, [bare]) == 1
+    assert server_db.raw_decoder.decoded == 1
+
+
+def test_replay_redecodes_history_with_new_options(server_db):
+    with server_db.db.writer() as conn:
+        server_db.store_events(conn, [lht65_uplink(60 + i, LHT65_PROBE) for i in range(5)])
+    server_db.db.close()
+
+    result = replay.main(["--db", server_db.db.db_file, "--rebuild", "--redecode", "--batch-size", "2",
+                          "--codec", "lorawan.dragino.lht65", "--codec-options", '{"probe_offset": -0.5}'])
+
+    assert result["redecode"]["decoded"] == 5 and result["redecode"]["failed"] == 0
+    with server_db.db.reader() as conn:
+        rows = conn.execute("SELECT channel, value, sensor_id FROM sensor_readings WHERE ts = ?",
+                            (1_700_000_000_060,)).fetchall()
+    by_channel = {r["channel"]: r for r in rows}
+    # Codec channels are replaced, network readings (RSSI, SNR) kept, sensor ids carried over
+    assert set(by_channel) == {3, 4, 5, 7, 100, 101, 500}
+    assert by_channel[7]["value"] == pytest.approx(2.11) and by_channel[4]["value"] == 58.4
+    assert by_channel[3]["sensor_id"] == UPLINK_PAYLOAD["event_data"]["payload"][1]["sensor_id"]
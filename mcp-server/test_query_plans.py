@@ -0,0 +1,139 @@
+"""
+EXPLAIN QUERY PLAN regressions for the MCP tool queries.
+
+Each tool is called with tracing enabled on the (single) pooled read connection;
+every SELECT it issues is then explained against the same database. The tests pin
+the index each query must use and assert that no query falls back to a full table
+scan or a temporary sort of the history tables.
+"""
+
+from test_webhook import ALERT_PAYLOAD, UPLINK_PAYLOAD
+
+UPLINK_DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+ALERT_DEVICE = ALERT_PAYLOAD["event_data"]["thingId"]
+
+HISTORY_TABLES = ("sensor_readings", "alerts", "events", "gateway_pings")
+
+
+def query_plans(server, tool, **kwargs):
+    """Run `tool` and return [(sql, [plan detail, ...]), ...] for every SELECT it issued."""
+    statements = []
+    with server.db.reader() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        tool(**kwargs)
+    finally:
+        with server.db.reader() as conn:
+            conn.set_trace_callback(None)
+
+    plans = []
+    with server.db.writer() as conn:
+        for sql in statements:
+            if sql.lstrip().upper().startswith("SELECT"):
+                details = [row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+                plans.append((sql, details))
+    assert plans, f"{tool.__name__} issued no queries"
+    return plans
+
+
+def assert_no_scans(plans):
+    for sql, details in plans:
+        for detail in details:
+            for table in HISTORY_TABLES:
+                assert not detail.startswith(f"SCAN {table}"), f"full scan in {sql!r}: {details}"
+            assert "TEMP B-TREE" not in detail, f"temporary sort in {sql!r}: {details}"
+
+
+def uses_index(plans, index):
+    return any(index in detail for _, details in plans for detail in details)
+
+
+def test_reading_history_uses_device_ts_index(server_db):
+    plans = query_plans(server_db, server_db.get_reading_history, device_id=UPLINK_DEVICE)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_readings_device_ts (device_id=?)")
+
+
+def test_reading_history_by_type_seeks_cursor(server_db):
+    plans = query_plans(server_db, server_db.get_reading_history, device_id=UPLINK_DEVICE,
+                        sensor_type="temp", before_ts=1614196169569, before_id=3)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_readings_device_type_ts (device_id=? AND type=? AND ts<?)")
+
+
+def test_active_alerts_read_alert_state(server_db):
+    plans = query_plans(server_db, server_db.get_alerts, before_ts=1614201509775, before_id=1)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_alert_state_triggered (triggered=? AND (last_ts,alert_id)<(?,?))")
+    assert not uses_index(plans, "alerts")
+
+
+def test_device_alerts_use_device_index(server_db):
+    plans = query_plans(server_db, server_db.get_alerts, device_id=ALERT_DEVICE)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_alert_state_device_triggered (device_id=? AND triggered=?)")
+
+    plans = query_plans(server_db, server_db.get_alerts, device_id=ALERT_DEVICE, triggered_only=False)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_alerts_device_ts (device_id=?)")
+
+
+def test_event_log_by_type_seeks_cursor(server_db):
+    plans = query_plans(server_db, server_db.get_event_log, event_type="uplink", before_id=10)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_events_type (event_type=? AND rowid<?)")
+
+
+def test_latest_readings_and_device_details_avoid_history(server_db):
+    server_db.latest_cache.loaded = False  # force the table-backed path
+    plans = query_plans(server_db, server_db.get_latest_readings, device_id=UPLINK_DEVICE)
+    plans += query_plans(server_db, server_db.get_device_details, device_id=UPLINK_DEVICE)
+    assert_no_scans(plans)
+    tables = " ".join(detail for _, details in plans for detail in details)
+    assert "sensor_readings" not in tables and "alerts" not in tables
+
+
+def test_facility_summary_fallback_avoids_history(server_db):
+    server_db.latest_cache.loaded = False  # multi-worker mode: workers never load the cache
+    plans = query_plans(server_db, server_db.get_facility_summary)
+    tables = " ".join(detail for _, details in plans for detail in details)
+    assert "sensor_readings" not in tables and "alerts " not in tables
+    assert "- Total sensor readings: 5" in server_db.get_facility_summary()
+
+
+def test_reading_aggregates_use_rollup_primary_key(server_db):
+    plans = query_plans(server_db, server_db.get_reading_aggregates, device_id=UPLINK_DEVICE,
+                        start="2021-02-24", end="2021-02-25", resolution="1h")
+    assert uses_index(plans, "SEARCH r USING PRIMARY KEY (device_id=?)")
+    assert not uses_index(plans, "sensor_readings")
+
+
+def test_sensor_query_by_device_seeks_index(server_db):
+    plans = query_plans(server_db, server_db.query_sensor_data, device_id=UPLINK_DEVICE,
+                        sensor_type="temp", min_value=20, start="2021-02-24")
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_readings_device_type_ts (device_id=? AND type=? AND ts>?)")
+
+    plans = query_plans(server_db, server_db.query_sensor_data, location_name="Building", channel=3)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_readings_device_channel_ts (device_id=? AND channel=?)")
+
+
+def test_sensor_query_fleet_wide_is_time_bounded(server_db):
+    plans = query_plans(server_db, server_db.query_sensor_data, sensor_type="temp", max_value=50)
+    assert_no_scans(plans)
+    assert uses_index(plans, "idx_readings_ts (ts>?)")
+
+
+def test_name_filters_and_search_use_device_index(server_db):
+    plans = query_plans(server_db, server_db.list_devices, location_name="Warehouse", company_name="Trane")
+    plans += query_plans(server_db, server_db.search_devices, query="leak sensor")
+    assert_no_scans(plans)
+    assert uses_index(plans, "devices_fts VIRTUAL TABLE")
+    assert not any(detail.startswith("SCAN devices") and "devices_fts" not in detail
+                   for _, details in plans for detail in details)
+
+
+def test_gateway_status_reads_state_not_ping_history(server_db):
+    plans = query_plans(server_db, server_db.get_gateway_status)
+    assert not uses_index(plans, "gateway_pings")
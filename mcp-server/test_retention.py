@@ -0,0 +1,43 @@
+"""Retention pruning, archiving and storage reporting."""
+
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+from test_webhook import UPLINK_PAYLOAD
+
+UPLINK_DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+
+
+def test_prunes_expired_rows_and_archives_events(server_db, tmp_path):
+    archive = tmp_path / "archive"
+    retention = server_db.RetentionManager(events_days=1, readings_days=30, pings_days=30,
+                                           chunk_size=2, archive_dir=str(archive))
+
+    deleted = retention.run_once(now=datetime.now(timezone.utc) + timedelta(days=2))
+
+    assert deleted == {"events": 3, "sensor_readings": 5, "gateway_pings": 1}
+    with server_db.db.reader() as conn:
+        for table in ("events", "sensor_readings", "gateway_pings"):
+            assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
+        stats = conn.execute("SELECT reading_count FROM device_stats WHERE device_id = ?",
+                             (UPLINK_DEVICE,)).fetchone()
+    assert stats["reading_count"] == 0
+    assert server_db.latest_cache.counts(UPLINK_DEVICE)[0] == 0
+
+    files = list((archive / "events").glob("*.jsonl.gz"))
+    assert len(files) == 1
+    with gzip.open(files[0], "rt") as f:
+        records = [json.loads(line) for line in f]
+    assert [r["event_type"] for r in records] == ["uplink", "alert", "ping"]
+    assert records[0]["event"] == UPLINK_PAYLOAD
+
+
+def test_keeps_rows_inside_ttl(server_db):
+    retention = server_db.RetentionManager(events_days=1, readings_days=0, pings_days=0)
+    assert retention.run_once() == {"events": 0}
+
+    storage = retention.storage_stats()
+    assert storage["oldest_event_received_at"] is not None
+    assert storage["oldest_reading_ts"].startswith("2021-02-24")
+    assert storage["db_bytes"] > 0
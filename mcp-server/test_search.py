@@ -0,0 +1,72 @@
+"""Device search: the devices_fts trigram index, search_devices ranking and the name filters routed through it."""
+
+import json
+
+import pytest
+
+import server
+from test_live import store
+from test_webhook import ALERT_PAYLOAD, UPLINK_PAYLOAD, uplink
+
+UPLINK_DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+ALERT_DEVICE = ALERT_PAYLOAD["event_data"]["thingId"]
+
+pytestmark = pytest.mark.skipif(not server.DEVICE_SEARCH, reason="SQLite without FTS5 trigram")
+
+
+def device(n, thing_name, sensor_use, location="Building A - Warehouse"):
+    payload = uplink(1000 + n, device_id=f"search-{n}")
+    payload["device"].update(thing_name=thing_name, sensor_use=sensor_use)
+    payload["location"]["name"] = location
+    return payload
+
+
+def matched_ids(answer):
+    return [row[1] for row in json.loads(answer)["rows"]]  # device_id follows thing_name
+
+
+def test_search_ranks_name_matches_and_falls_back_to_any_term(server_db):
+    store(server_db, [device(1, "Freezer Probe - Kitchen", "Walk-in Freezer"),
+                      device(2, "Door Sensor - Dock 4", "Walk-in Cooler"),
+                      device(3, "Temp Sensor - Office", "Ambient", location="Freezer Annex")])
+
+    answer = server_db.search_devices("walk-in freezer", format="json")
+    assert matched_ids(answer) == ["search-1"]  # every term matches, partial words and any case
+    ranked = matched_ids(server_db.search_devices("freezer", format="json"))
+    assert ranked[0] == "search-1" and ranked[-1] == "search-3"  # name and use weigh above location
+
+    fallback = server_db.search_devices("Dock zzzz")
+    assert fallback.startswith("Found 1 device(s) matching 'Dock zzzz' (no device matches every term")
+    assert "**Door Sensor - Dock 4**" in fallback and "search-2" in fallback
+    assert server_db.search_devices("a b") == "Search terms need at least 3 characters."
+    assert server_db.search_devices("qqqq") == "No devices match 'qqqq'."
+    assert len(matched_ids(server_db.search_devices("sensor", limit=2, format="json"))) == 2
+
+
+def test_index_follows_device_updates(server_db):
+    assert matched_ids(server_db.search_devices("AHU-01", format="json")) == [UPLINK_DEVICE]
+    renamed = uplink(99)
+    renamed["device"]["thing_name"] = "Supply Air Probe - RTU-7"
+    store(server_db, [renamed])
+
+    assert server_db.search_devices("AHU-01") == "No devices match 'AHU-01'."
+    assert matched_ids(server_db.search_devices("RTU-7", format="json")) == [UPLINK_DEVICE]
+    with server_db.db.writer() as conn:
+        conn.execute("INSERT INTO devices_fts (devices_fts) VALUES ('integrity-check')")  # raises when out of sync
+
+
+def test_index_is_built_for_existing_devices_and_filters_use_it(server_db, monkeypatch):
+    with server_db.db.writer() as conn:
+        conn.execute("DROP TABLE devices_fts")
+        server_db._create_schema(conn)  # an index added next to existing devices is filled once
+        assert conn.execute("SELECT COUNT(*) FROM devices_fts").fetchone()[0] == 2
+
+    assert "Found 2 device(s)" in server_db.list_devices(location_name="warehouse")
+    assert "Found 2 device(s)" in server_db.list_devices(company_name="southeast", location_name="Building A")
+    assert server_db.list_devices(location_name="Basement") == "No devices found matching the criteria."
+    indexed = server_db.search_devices("mech room")
+
+    monkeypatch.setattr(server_db, "DEVICE_SEARCH", False)  # plain LIKE scans give the same answers
+    monkeypatch.setattr(server_db, "result_cache", server_db.ResultCache())
+    assert "Found 2 device(s)" in server_db.list_devices(location_name="warehouse")
+    assert server_db.search_devices("mech room") == indexed and ALERT_DEVICE in indexed
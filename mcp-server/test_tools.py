@@ -0,0 +1,31 @@
+"""Behaviour of the MCP tools beyond their query plans."""
+
+from test_webhook import UPLINK_PAYLOAD
+
+UPLINK_DEVICE = UPLINK_PAYLOAD["event_data"]["device_id"]
+
+
+def test_sensor_query_filters_and_caps_rows(server_db, monkeypatch):
+    result = server_db.query_sensor_data(device_id=UPLINK_DEVICE, sensor_type="temp", min_value=20)
+    assert "Query results (1 rows)" in result and "Temperature = 22.11" in result
+    assert "No results" in server_db.query_sensor_data(device_id=UPLINK_DEVICE, min_value=1000)
+
+    monkeypatch.setattr(server_db, "QUERY_ROW_CAP", 2)
+    result = server_db.query_sensor_data(location_name="Building", limit=500)
+    assert "Query results (2 rows)" in result
+
+
+def test_sensor_query_stops_at_time_budget(server_db, monkeypatch):
+    with server_db.db.writer() as conn, conn:
+        conn.executemany(
+            "INSERT INTO sensor_readings (device_id, sensor_id, name, type, value, unit, channel, ts) "
+            "VALUES ('bulk', 1, 'Temperature', 'temp', ?, 'c', 3, ?)",
+            [(i % 40, 1614196169569 + i) for i in range(50_000)],
+        )
+    monkeypatch.setattr(server_db, "QUERY_TIME_BUDGET", 0)
+
+    result = server_db.query_sensor_data(sensor_type="temp", min_value=1000, start="2021-02-24")
+
+    assert "time budget" in result
+    with server_db.db.reader() as conn:  # the handler is cleared for the next borrower
+        assert conn.execute("SELECT COUNT(*) FROM sensor_readings").fetchone()[0] == 50_005
@@ -4,6 +4,7 @@ Run the server first: uvicorn server:app --host 0.0.0.0 --port 8000
 Then run this script: python3 test_webhook.py
 """
 
+import copy
 import requests
 import json
 import time
@@ -129,6 +130,13 @@ PING_PAYLOAD = {
 }
 
 
+def uplink(fcnt, base=UPLINK_PAYLOAD, **event_data):
+    """A copy of `base` as another delivery: frame counter `fcnt`, other event_data fields overridden."""
+    payload = copy.deepcopy(base)
+    payload["event_data"].update(fcnt=fcnt, **event_data)
+    return payload
+
+
 def test_health():
     print("=== Health Check ===")
     r = requests.get(f"{BASE_URL}/health")
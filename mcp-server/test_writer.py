@@ -0,0 +1,114 @@
+"""Multi-worker mode: workers forward writes to the writer process over its Unix socket."""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import writer
+from test_webhook import uplink
+
+
+def stored_uplinks(server):
+    with server.db.reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM events WHERE event_type = 'uplink'").fetchone()[0]
+
+
+def test_worker_forwards_writes_to_the_writer(server_db, monkeypatch, tmp_path):
+    monkeypatch.setattr(server_db, "INGEST_MODE", "direct")
+    path = str(tmp_path / "writer.sock")
+    client = server_db.WriterClient(path, connections=2, connect_timeout=2)
+    monkeypatch.setattr(server_db, "writer_client", client)
+    before = stored_uplinks(server_db)
+
+    async def run():
+        writer_server = writer.WriterServer(path)
+        await writer_server.start()
+        await client.connect()
+        transport = httpx.ASGITransport(app=server_db.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://worker") as http:
+                first = await asyncio.gather(*(http.post("/webhook", json=uplink(n)) for n in (70, 71, 70)))
+                bulk = await http.post("/webhook/bulk", content="\n".join(
+                    json.dumps(uplink(n)) for n in (71, 72, 73)))
+                health = await http.get("/health")
+        finally:
+            await client.close()
+            await writer_server.stop()
+        return [r.json()["status"] for r in first], bulk.json(), health.json()
+
+    statuses, bulk, health = asyncio.run(run())
+    assert sorted(statuses) == ["duplicate", "ok", "ok"]
+    assert (bulk["received"], bulk["stored"], bulk["duplicates"]) == (3, 2, 1)
+    assert health["role"] == "worker"
+    assert health["writer"]["requests"] == 5
+    assert health["writer"]["dedup"]["duplicates_by_type"]["uplink"] == 2
+    assert stored_uplinks(server_db) == before + 4
+
+
+def test_webhook_returns_503_when_the_writer_is_gone(server_db, monkeypatch, tmp_path):
+    path = str(tmp_path / "writer.sock")
+    client = server_db.WriterClient(path, connections=1, connect_timeout=0.3)
+    monkeypatch.setattr(server_db, "writer_client", client)
+
+    async def run():
+        writer_server = writer.WriterServer(path)
+        await writer_server.start()
+        await client.connect()
+        assert (await client.stats())["pid"]
+        await writer_server.stop()
+        transport = httpx.ASGITransport(app=server_db.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://worker") as http:
+            response = await http.post("/webhook", json=uplink(80))
+        await client.close()
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_worker_relays_the_writer_live_feed(server_db, tmp_path):
+    path = str(tmp_path / "writer.sock")
+    client = server_db.WriterClient(path, connections=1, connect_timeout=2)
+    writer_feed = server_db.LiveFeed()  # the writer process's feed; server_db.live_feed is the worker's
+
+    async def run():
+        writer_server = writer.WriterServer(path, feed=writer_feed)
+        await writer_server.start()
+        await client.connect()
+        alerts = server_db.live_feed.subscribe(event_types=["alert"])
+        client.start_relay()
+        while not writer_feed.active:
+            await asyncio.sleep(0.01)
+        writer_feed.publish([{"event_type": "uplink", "device_id": "d1", "channel": 3, "sensor_type": "temp"},
+                             {"event_type": "alert", "device_id": "d1", "sensor_id": "s1", "rule_id": "r1"}])
+        messages = await asyncio.wait_for(alerts.get(), 5)
+        await client.close()
+        await writer_server.stop()
+        return messages, writer_feed.subscribers
+
+    messages, relays = asyncio.run(run())
+    assert [(m["event_type"], m["device_id"], m["rule_id"]) for m in messages] == [("alert", "d1", "r1")]
+    assert relays == 0
+
+
+def test_worker_pool_only_reads(server_db, tmp_path, monkeypatch):
+    with pytest.raises(FileNotFoundError, match="the writer process creates it"):
+        with server_db.ConnectionPool(str(tmp_path / "missing.db"), read_only=True).reader():
+            pass
+    assert not (tmp_path / "missing.db").exists()
+
+    pool = server_db.ConnectionPool(server_db.db.db_file, readers=2, read_only=True)
+    monkeypatch.setattr(server_db, "db", pool)
+    assert "Found 2 device(s)" in server_db.list_devices()
+    server_db.latest_cache.loaded = False  # workers answer from the tables
+    assert "Temperature" in server_db.get_latest_readings(uplink(0)["event_data"]["device_id"])
+    with pytest.raises(RuntimeError, match="read-only"):
+        with pool.writer():
+            pass
+    with pool.reader() as conn, pytest.raises(server_db.sqlite3.OperationalError, match="readonly"):
+        conn.execute("DELETE FROM devices")
+    assert pool._writer is None
+    pool.close()
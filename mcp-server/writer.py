@@ -0,0 +1,158 @@
+"""
+Single-writer process for the multi-worker deployment.
+
+SQLite allows one writer at a time, so when the HTTP/MCP server runs as several
+uvicorn workers, every write goes through this one process instead:
+
+    COGNITUV_WRITER_SOCKET=/tmp/cognituv-writer.sock python3 writer.py &
+    COGNITUV_WRITER_SOCKET=/tmp/cognituv-writer.sock uvicorn server:app --workers 4
+
+(run-multiworker.sh does both.) The writer owns the schema, the dedup window, the
+ingest queue, retention, the gateway sweeper and the MQTT subscriber, exactly as the
+single-process server does. Workers keep read-only connections for the tools and
+forward webhook bodies over the Unix socket (see server.WriterClient for framing), and
+relay the writer's live feed to their own /stream and MCP subscribers.
+SIGTERM/SIGINT stop accepting connections, drain the ingest queue and exit.
+"""
+
+import asyncio
+import os
+import signal
+import stat
+
+from starlette.concurrency import run_in_threadpool
+
+import server
+
+
+class WriterServer:
+    """
+    Answers worker requests on a Unix socket: E(vent), B(ulk) and S(tats). A W(atch)
+    request turns the connection into a one-way stream of live feed batches.
+    """
+
+    def __init__(self, path, feed=None):
+        self.path = path
+        self.feed = feed or server.live_feed
+        self._server = None
+        self._connections = set()
+        self._relays = set()
+        self._closing = False
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self):
+        # A socket file left behind by a crashed writer would make bind() fail
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def stop(self):
+        self._closing = True
+        for subscription in list(self._relays):
+            subscription.close()
+        if self._server is not None:
+            self._server.close()
+            # Workers hold their connections open; drop them so wait_closed() returns
+            for connection in list(self._connections):
+                connection.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _serve(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while not self._closing:
+                try:
+                    header = await reader.readexactly(server._FRAME_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    return  # worker closed the connection
+                op, length = server._FRAME_HEADER.unpack(header)
+                body = await reader.readexactly(length)
+                if op == b"W":
+                    await self.relay(writer)
+                    return
+                reply = server.json_dumps(await self.dispatch(op, body))
+                writer.write(server._LENGTH.pack(len(reply)) + reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def dispatch(self, op, body):
+        self.requests += 1
+        try:
+            if op == b"E":
+                return {"status": await server.ingest_event(server.json_loads(body), body)}
+            if op == b"B":
+                raws, offset = [], 0
+                while offset < len(body):
+                    (length,) = server._LENGTH.unpack_from(body, offset)
+                    offset += server._LENGTH.size
+                    raws.append(body[offset:offset + length])
+                    offset += length
+                payloads = [server.json_loads(raw) for raw in raws]
+                stored, duplicates = await run_in_threadpool(server.store_bulk, payloads, raws)
+                return {"stored": stored, "duplicates": duplicates}
+            if op == b"S":
+                return await self.stats()
+            raise ValueError(f"unknown op {op!r}")
+        except Exception as e:
+            self.errors += 1
+            return {"error": str(e)}
+
+    async def relay(self, writer):
+        """Stream the live feed to a worker until it disconnects or the writer stops."""
+        try:
+            # One relay serves every live subscriber of a worker, so it gets a deeper buffer
+            subscription = self.feed.subscribe(max_queue=server.LIVE_QUEUE_SIZE * 10)
+        except server.LiveFeedFull as e:
+            server.logger.warning("Refusing live feed relay: %s", e)
+            return
+        self._relays.add(subscription)
+        try:
+            while (messages := await subscription.get()) is not None:
+                reply = server.json_dumps(messages)
+                writer.write(server._LENGTH.pack(len(reply)) + reply)
+                await writer.drain()
+        finally:
+            self._relays.discard(subscription)
+            subscription.close()
+
+    async def stats(self):
+        gateways = await run_in_threadpool(server.gateway_sweeper.stats)
+        return {"pid": os.getpid(), "requests": self.requests, "errors": self.errors,
+                "ingest": server.ingest_writer.stats(), "dedup": server.dedup.stats(),
+                "mqtt": server.mqtt_subscriber.stats(), "db_pool": server.db.stats(),
+                "live": self.feed.stats(), "gateways": gateways}
+
+
+async def main():
+    if not server.WRITER_SOCKET:
+        raise SystemExit("COGNITUV_WRITER_SOCKET is not set")
+    # The writer is the only process that runs the ingest services and opens the database read-write
+    server.writer_client = None
+    server.db = server.ConnectionPool(server.DB_FILE)
+    await server.start_services()
+    writer_server = WriterServer(server.WRITER_SOCKET)
+    await writer_server.start()
+    print(f"writer {os.getpid()} listening on {server.WRITER_SOCKET}", flush=True)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    await writer_server.stop()
+    server.live_feed.close()
+    await server.stop_services()
+    server.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())